@@ -0,0 +1,406 @@
+"""
+In-process stand-in for `/usr/bin/csv-to-arrow`, built on `pyarrow.csv`.
+
+pyarrow's CSV reader is stricter than csv-to-arrow in some ways (it won't pad
+ragged rows) and laxer in others (it silently accepts misplaced quotation
+marks, which csv-to-arrow repairs and warns about). We only handle input that
+both programs treat identically. On anything else, `csv_to_arrow()` returns
+`None` and the caller should run csv-to-arrow instead.
+"""
+import io
+import itertools
+import mmap
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pyarrow
+import pyarrow.csv
+
+from .settings import Settings
+
+_QUOTE = ord('"')
+_CR = ord("\r")
+_LF = ord("\n")
+
+
+class CsvToArrowResult(NamedTuple):
+    table: pyarrow.Table
+    """
+    Table with all-utf8 columns -- the same table csv-to-arrow would write.
+    """
+
+    stdout: str
+    """
+    Warnings, formatted exactly the way csv-to-arrow prints them.
+    """
+
+
+def _check_quotes(buf: np.ndarray, quotes: np.ndarray, delimiter: int) -> bool:
+    """
+    Return False if any quotation mark in `buf` is misplaced or unterminated
+    -- that is, if csv-to-arrow would repair it.
+    """
+    if len(quotes) % 2 == 1:
+        return False  # csv-to-arrow would warn, "repaired last value"
+
+    # An opening quote must start a field (or follow a closing quote, as in
+    # `"a""b"`). A closing quote must end a field (or precede an opening
+    # quote).
+    boundaries = np.array([delimiter, _CR, _LF, _QUOTE], dtype=np.uint8)
+    opening = quotes[0::2]
+    closing = quotes[1::2]
+    opening = opening[opening > 0]
+    closing = closing[closing < len(buf) - 1]
+    return (
+        np.isin(buf[opening - 1], boundaries).all()
+        and np.isin(buf[closing + 1], boundaries).all()
+    )
+
+
+def _first_record_n_fields(
+    buf: np.ndarray, quotes: np.ndarray, delimiter: int, *, is_complete: bool
+) -> Optional[int]:
+    """
+    Return the number of fields in the first non-empty record of `buf`.
+
+    Return 0 if there are no records. If `buf` is only the start of the input
+    (not `is_complete`), only count a record that ends within `buf`: return
+    None if there is none yet.
+    """
+    newlines = np.flatnonzero((buf == _LF) | (buf == _CR))
+    # A byte is within quotes if an odd number of quotes precede it
+    newlines = newlines[np.searchsorted(quotes, newlines) % 2 == 0]
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(buf)]))
+    if not is_complete:
+        starts, ends = starts[:-1], ends[:-1]  # the last record may continue
+    nonempty = np.flatnonzero(ends > starts)
+    if not len(nonempty):
+        return 0 if is_complete else None
+    start = starts[nonempty[0]]
+    end = ends[nonempty[0]]
+    delimiters = np.flatnonzero(buf[start:end] == delimiter) + start
+    delimiters = delimiters[np.searchsorted(quotes, delimiters) % 2 == 0]
+    return len(delimiters) + 1
+
+
+def _count_first_record_fields(buf: np.ndarray, delimiter: int) -> Optional[int]:
+    """
+    Return the number of fields in the first non-empty record of `buf`.
+
+    Return 0 if there are no records. Return None if any quotation mark is
+    misplaced or unterminated -- that is, if csv-to-arrow would repair it.
+    """
+    quotes = np.flatnonzero(buf == _QUOTE)
+    if not _check_quotes(buf, quotes, delimiter):
+        return None
+    return _first_record_n_fields(buf, quotes, delimiter, is_complete=True)
+
+
+class _QuoteChecker:
+    """
+    `_check_quotes()`, for input that arrives in chunks.
+    """
+
+    def __init__(self, delimiter: int):
+        self._boundaries = np.array([delimiter, _CR, _LF, _QUOTE], dtype=np.uint8)
+        self._is_quoted = False
+        self._last_byte: Optional[int] = None
+        self._check_next_byte = False  # a chunk ended with a closing quote
+        self.is_valid = True
+
+    def feed(self, chunk: bytes) -> bool:
+        """
+        Check `chunk`, the next bytes of input. Return False if it's invalid.
+        """
+        if not self.is_valid or not chunk:
+            return self.is_valid
+        buf = np.frombuffer(chunk, dtype=np.uint8)
+        if self._check_next_byte and buf[0] not in self._boundaries:
+            self.is_valid = False
+            return False
+
+        quotes = np.flatnonzero(buf == _QUOTE)
+        if self._is_quoted:
+            closing, opening = quotes[0::2], quotes[1::2]
+        else:
+            opening, closing = quotes[0::2], quotes[1::2]
+        if len(opening) and opening[0] == 0:
+            if self._last_byte is not None and self._last_byte not in self._boundaries:
+                self.is_valid = False
+                return False
+            opening = opening[1:]
+        self._check_next_byte = bool(len(closing)) and closing[-1] == len(buf) - 1
+        if self._check_next_byte:
+            closing = closing[:-1]
+        self.is_valid = bool(
+            np.isin(buf[opening - 1], self._boundaries).all()
+            and np.isin(buf[closing + 1], self._boundaries).all()
+        )
+
+        self._is_quoted ^= len(quotes) % 2 == 1
+        self._last_byte = buf[-1]
+        return self.is_valid
+
+    def finish(self) -> bool:
+        """
+        Check the end of input. Return False if the input was invalid.
+        """
+        if self._is_quoted:
+            self.is_valid = False  # csv-to-arrow would warn, "repaired last value"
+        return self.is_valid
+
+
+class _CheckedChunksReader(io.RawIOBase):
+    """
+    Readable stream of `chunks`, which ends early if `checker` rejects one.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], checker: _QuoteChecker):
+        self._chunks = chunks
+        self._checker = checker
+        self._buf = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._checker.finish()
+                return 0
+            if not self._checker.feed(chunk):
+                return 0  # pretend we're done; the caller checks the checker
+            self._buf = memoryview(chunk)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+def _truncate_utf8_chunk(
+    chunk: pyarrow.Array, max_n_bytes: int
+) -> Tuple[pyarrow.Array, np.ndarray]:
+    """
+    Return `chunk` with each value truncated to `max_n_bytes` UTF-8 bytes.
+
+    Like csv-to-arrow, never split a UTF-8 character: drop all its bytes
+    instead. Also return the indices of the values we truncated.
+
+    Assume `chunk` has no nulls.
+    """
+    if len(chunk) == 0:
+        return chunk, np.array([], dtype=np.int64)
+
+    _, offsets_buf, data_buf = chunk.buffers()
+    offsets = np.frombuffer(
+        offsets_buf, dtype="<i4", count=chunk.offset + len(chunk) + 1
+    )[chunk.offset :]
+    lengths = np.diff(offsets)
+    truncated = np.flatnonzero(lengths > max_n_bytes)
+    if not len(truncated):
+        return chunk, truncated
+
+    data = np.frombuffer(data_buf, dtype=np.uint8)
+    starts = offsets[:-1]
+    cuts = np.full(len(truncated), max_n_bytes, dtype=np.int64)
+    for _ in range(3):  # a UTF-8 character has at most 3 continuation bytes
+        continuation = (data[starts[truncated] + cuts] & 0xC0) == 0x80
+        cuts -= continuation & (cuts > 0)
+
+    new_lengths = lengths.astype(np.int64)
+    new_lengths[truncated] = cuts
+    new_offsets = np.zeros(len(chunk) + 1, dtype=np.int64)
+    np.cumsum(new_lengths, out=new_offsets[1:])
+    # For each output byte, the input byte it comes from
+    indices = np.repeat(starts - new_offsets[:-1], new_lengths) + np.arange(
+        new_offsets[-1]
+    )
+    return (
+        pyarrow.StringArray.from_buffers(
+            len(chunk),
+            pyarrow.py_buffer(new_offsets.astype("<i4")),
+            pyarrow.py_buffer(data[indices]),
+        ),
+        truncated,
+    )
+
+
+def _truncate_values(
+    table: pyarrow.Table, max_n_bytes: int
+) -> Tuple[pyarrow.Table, List[str]]:
+    n_truncated = 0
+    first_truncated = None  # (row_index, column_index)
+    columns = []
+    for column_index, column in enumerate(table.columns):
+        chunks = []
+        row_offset = 0
+        for chunk in column.chunks:
+            chunk, truncated = _truncate_utf8_chunk(chunk, max_n_bytes)
+            if len(truncated):
+                n_truncated += len(truncated)
+                location = (row_offset + int(truncated[0]), column_index)
+                if first_truncated is None or location < first_truncated:
+                    first_truncated = location
+            chunks.append(chunk)
+            row_offset += len(chunk)
+        columns.append(pyarrow.chunked_array(chunks, pyarrow.utf8()))
+
+    if n_truncated == 0:
+        return table, []
+    else:
+        return (
+            pyarrow.table(dict(zip(table.column_names, columns))),
+            [
+                "truncated %d values (value byte limit is %d; see row %d column %d)"
+                % (n_truncated, max_n_bytes, *first_truncated)
+            ],
+        )
+
+
+def _read_options(n_columns: int) -> pyarrow.csv.ReadOptions:
+    return pyarrow.csv.ReadOptions(column_names=["f%d" % i for i in range(n_columns)])
+
+
+def _parse_options(delimiter: str) -> pyarrow.csv.ParseOptions:
+    return pyarrow.csv.ParseOptions(delimiter=delimiter, newlines_in_values=True)
+
+
+def _convert_options(n_columns: int, settings: Settings) -> pyarrow.csv.ConvertOptions:
+    names = ["f%d" % i for i in range(n_columns)]
+    return pyarrow.csv.ConvertOptions(
+        column_types={name: pyarrow.utf8() for name in names},
+        include_columns=names[: settings.MAX_COLUMNS_PER_TABLE],
+        strings_can_be_null=False,
+    )
+
+
+def _finish(
+    table: pyarrow.Table, n_columns: int, settings: Settings
+) -> Optional[CsvToArrowResult]:
+    """
+    Enforce `settings` limits on what pyarrow read, reporting like csv-to-arrow.
+    """
+    if any(column_type != pyarrow.utf8() for column_type in table.schema.types):
+        return None  # we counted columns differently than pyarrow did
+
+    stdout_lines = []
+    if table.num_rows > settings.MAX_ROWS_PER_TABLE:
+        stdout_lines.append(
+            "skipped %d rows (after row limit of %d)"
+            % (
+                table.num_rows - settings.MAX_ROWS_PER_TABLE,
+                settings.MAX_ROWS_PER_TABLE,
+            )
+        )
+        table = table.slice(0, settings.MAX_ROWS_PER_TABLE)
+    if n_columns > settings.MAX_COLUMNS_PER_TABLE:
+        stdout_lines.append(
+            "skipped %d columns (after column limit of %d)"
+            % (
+                n_columns - settings.MAX_COLUMNS_PER_TABLE,
+                settings.MAX_COLUMNS_PER_TABLE,
+            )
+        )
+    table, truncate_lines = _truncate_values(table, settings.MAX_BYTES_PER_VALUE)
+    stdout_lines.extend(truncate_lines)
+
+    return CsvToArrowResult(table, "".join(line + "\n" for line in stdout_lines))
+
+
+def csv_to_arrow(
+    path: Path, *, delimiter: str, settings: Settings
+) -> Optional[CsvToArrowResult]:
+    """
+    Parse UTF-8 CSV at `path` into a table, the way csv-to-arrow would.
+
+    Honor `settings.MAX_ROWS_PER_TABLE`, `settings.MAX_COLUMNS_PER_TABLE` and
+    `settings.MAX_BYTES_PER_VALUE`, and report on them the way csv-to-arrow
+    does.
+
+    Return `None` if csv-to-arrow would parse the file differently: for
+    instance, if it has ragged rows or misplaced quotation marks.
+    """
+    with path.open("rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # "cannot mmap an empty file"
+            return CsvToArrowResult(pyarrow.table({}), "")
+        with mm:
+            buf = np.frombuffer(mm, dtype=np.uint8)
+            try:
+                n_columns = _count_first_record_fields(buf, ord(delimiter))
+            finally:
+                del buf  # so we may close the mmap
+
+    if n_columns is None:
+        return None
+    if n_columns == 0:
+        return CsvToArrowResult(pyarrow.table({}), "")
+
+    try:
+        table = pyarrow.csv.read_csv(
+            path.as_posix(),
+            read_options=_read_options(n_columns),
+            parse_options=_parse_options(delimiter),
+            convert_options=_convert_options(n_columns, settings),
+        )
+    except pyarrow.ArrowInvalid:
+        return None  # ragged rows, most likely
+
+    return _finish(table, n_columns, settings)
+
+
+def csv_to_arrow_from_chunks(
+    chunks: Iterator[bytes], *, delimiter: str, settings: Settings
+) -> Optional[CsvToArrowResult]:
+    """
+    `csv_to_arrow()`, reading UTF-8 CSV from `chunks` instead of a file.
+
+    We read the first record, to count columns; then pyarrow parses the rest
+    as it arrives. We never hold the input in memory or write it to disk.
+
+    Return `None` if csv-to-arrow would parse the input differently. We may
+    have consumed some or all of `chunks` by then: to run csv-to-arrow, the
+    caller must produce the input anew.
+    """
+    head = bytearray()
+    for chunk in chunks:
+        head.extend(chunk)
+        buf = np.frombuffer(head, dtype=np.uint8)
+        n_columns = _first_record_n_fields(
+            buf, np.flatnonzero(buf == _QUOTE), ord(delimiter), is_complete=False
+        )
+        del buf  # so we may extend `head`
+        if n_columns is not None:
+            break
+    else:
+        buf = np.frombuffer(head, dtype=np.uint8)
+        n_columns = _first_record_n_fields(
+            buf, np.flatnonzero(buf == _QUOTE), ord(delimiter), is_complete=True
+        )
+        del buf
+
+    # Check quotes as pyarrow reads: it accepts quotes csv-to-arrow repairs
+    checker = _QuoteChecker(ord(delimiter))
+    reader = _CheckedChunksReader(itertools.chain([bytes(head)], chunks), checker)
+    if n_columns == 0:
+        reader.read()  # just check quotes
+        return CsvToArrowResult(pyarrow.table({}), "") if checker.is_valid else None
+
+    try:
+        table = pyarrow.csv.open_csv(
+            io.BufferedReader(reader),
+            read_options=_read_options(n_columns),
+            parse_options=_parse_options(delimiter),
+            convert_options=_convert_options(n_columns, settings),
+        ).read_all()
+    except pyarrow.ArrowInvalid:
+        return None  # ragged rows, most likely
+    if not checker.is_valid:
+        return None
+
+    return _finish(table, n_columns, settings)
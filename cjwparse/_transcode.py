@@ -0,0 +1,107 @@
+"""
+Decoding that can be split across worker processes.
+
+CPython's codecs hold the GIL, so threads can't decode in parallel; worker
+processes import this module, so it imports nothing heavy.
+"""
+import codecs
+import importlib
+from typing import NamedTuple, Optional
+
+_NEWLINE_SAFE_MULTIBYTE_CODECS = frozenset(
+    [
+        "big5",
+        "big5hkscs",
+        "cp932",
+        "cp949",
+        "cp950",
+        "euc_jis_2004",
+        "euc_jisx0213",
+        "euc_jp",
+        "euc_kr",
+        "gb18030",
+        "gb2312",
+        "gbk",
+        "johab",
+        "shift_jis",
+        "shift_jis_2004",
+        "shift_jisx0213",
+    ]
+)
+"""
+Stateless codecs (by `codecs.lookup().name`) in which byte 0x0A is always a
+newline: it is never part of a multibyte character.
+"""
+
+
+class SplittableCodec(NamedTuple):
+    """
+    A stateless codec: we can decode its text in pieces, independently.
+    """
+
+    name: str
+
+    is_single_byte: bool
+    """
+    True if every byte decodes to one character, on its own.
+    """
+
+    is_ascii_compatible: bool
+    """
+    True if ASCII bytes decode to ASCII -- so ASCII text is already UTF-8.
+    """
+
+    def find_split(self, data: bytes) -> int:
+        """
+        Return an offset into `data` where a new piece may start.
+
+        Return 0 if there is no such offset (beyond the start).
+        """
+        if self.is_single_byte:
+            return len(data)
+        else:
+            return data.rfind(b"\n") + 1
+
+
+def _is_single_byte_codec(name: str) -> bool:
+    try:
+        module = importlib.import_module("encodings." + name.replace("-", "_"))
+    except ImportError:
+        return False
+    table = getattr(module, "decoding_table", None)
+    return isinstance(table, str) and len(table) == 256
+
+
+def lookup_splittable_codec(encoding: str) -> Optional[SplittableCodec]:
+    """
+    Return a SplittableCodec for `encoding`, or `None` if we can't split it.
+
+    Raise LookupError for an `encoding` Python cannot handle.
+    """
+    name = codecs.lookup(encoding).name
+    if _is_single_byte_codec(name):
+        is_single_byte = True
+    elif name in _NEWLINE_SAFE_MULTIBYTE_CODECS:
+        is_single_byte = False
+    else:
+        return None
+    ascii_bytes = bytes(range(128))
+    try:
+        is_ascii_compatible = ascii_bytes.decode(name) == ascii_bytes.decode("ascii")
+    except UnicodeDecodeError:
+        is_ascii_compatible = False
+    return SplittableCodec(name, is_single_byte, is_ascii_compatible)
+
+
+def decode_to_utf8(data: bytes, codec: SplittableCodec) -> Optional[bytes]:
+    """
+    Return the UTF-8 for `data`, or `None` if `data` isn't valid `codec`.
+
+    `data` must be a whole piece: a split on each side (see `find_split()`).
+    """
+    if codec.is_ascii_compatible and data.isascii():
+        return data
+    try:
+        return codecs.utf_8_encode(data.decode(codec.name))[0]
+    except UnicodeDecodeError:
+        return None
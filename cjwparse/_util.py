@@ -1,8 +1,35 @@
+import asyncio
+import concurrent.futures
 import contextlib
 import os
+import signal
+import subprocess
 import tempfile
+import threading
 from pathlib import Path
-from typing import ContextManager
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from .report import ToolUsage
+
+T = TypeVar("T")
+
+STDIN_PATH = "/dev/stdin"
+"""
+Input path that makes an arrow-tools program read from its stdin.
+"""
 
 
 @contextlib.contextmanager
@@ -15,3 +42,388 @@ def tempfile_context(prefix=None, suffix=None, dir=None) -> ContextManager[Path]
     finally:
         with contextlib.suppress(FileNotFoundError):
             path.unlink()
+
+
+def run_with_stdin_chunks(
+    args: List[str], chunks: Iterable[bytes]
+) -> subprocess.CompletedProcess:
+    """
+    Run `args`, streaming `chunks` to its stdin through a pipe.
+
+    Like `subprocess.run(args, capture_output=True, check=True)`, raise
+    subprocess.CalledProcessError if the child exits with nonzero status.
+
+    `chunks` is consumed in a separate thread, so the child can parse while we
+    produce its input. If `chunks` raises, re-raise its exception after the
+    child exits. If the child stops reading early, stop consuming `chunks`.
+    """
+    return run_tool(ToolCall(args, iter(chunks)))
+
+
+class ToolCall(NamedTuple):
+    """
+    Request to run an arrow-tools program, yielded by a `ToolSteps` generator.
+    """
+
+    args: List[str]
+
+    stdin_chunks: Optional[Iterator[bytes]] = None
+    """
+    Chunks to stream to the program's stdin (see `run_with_stdin_chunks()`).
+    """
+
+
+class ToolResult(subprocess.CompletedProcess):
+    """
+    `subprocess.CompletedProcess`, plus the program's resource usage.
+    """
+
+    def __init__(self, args, returncode, stdout, stderr, usage: ToolUsage):
+        super().__init__(args, returncode, stdout, stderr)
+        self.usage = usage
+
+
+ToolSteps = Generator[
+    Union[ToolCall, List[ToolCall]], Union[ToolResult, List[ToolResult]], T
+]
+"""
+A parse, written as a generator so it can run synchronously or on asyncio.
+
+The generator does all its blocking work (transcoding, reading and writing
+Arrow files, postprocessing) itself. Whenever it needs to run a program, it
+yields a `ToolCall`; it receives a `ToolResult` -- or has
+`subprocess.CalledProcessError` thrown into it. Its return value is the
+result of the parse.
+
+To run several programs at once, it may yield a list of `ToolCall`s instead.
+It receives a list of `ToolResult`s, in the same order -- or, once all the
+programs have exited, the first call's exception.
+"""
+
+
+def _returncode(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    else:
+        return os.WEXITSTATUS(status)
+
+
+class _ToolProcess:
+    """
+    A running arrow-tools program.
+
+    We reap the child ourselves, with `os.wait4()`, to learn its resource
+    usage. (`subprocess` and asyncio's child watchers discard it.) So we start
+    it with `subprocess.Popen`, even on asyncio: `communicate_async()` wires
+    its pipes to the event loop itself.
+
+    `kill()` is safe to call from any thread: we only reap the child after
+    marking it exited, so we never signal a recycled PID.
+    """
+
+    def __init__(self, call: ToolCall):
+        self.call = call
+        self.popen = subprocess.Popen(
+            call.args,
+            stdin=(None if call.stdin_chunks is None else subprocess.PIPE),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._lock = threading.Lock()
+        self._exited = False
+
+    def kill(self) -> None:
+        with self._lock:
+            if not self._exited:
+                os.kill(self.popen.pid, signal.SIGKILL)
+
+    def _reap(self) -> ToolUsage:
+        os.waitid(os.P_PID, self.popen.pid, os.WEXITED | os.WNOWAIT)
+        return self._wait4()
+
+    async def _wait_exited_async(self) -> None:
+        """
+        Wait for the program to exit, without reaping it.
+
+        The event loop watches a pidfd. Without pidfds (Python 3.8, or Linux
+        before 5.3), we wait on the default executor instead.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            pidfd = os.pidfd_open(self.popen.pid)
+        except (AttributeError, OSError):
+            await loop.run_in_executor(
+                None, os.waitid, os.P_PID, self.popen.pid, os.WEXITED | os.WNOWAIT
+            )
+            return
+
+        try:
+            exited = loop.create_future()
+
+            def on_readable() -> None:
+                if not exited.done():
+                    exited.set_result(None)
+
+            loop.add_reader(pidfd, on_readable)
+            try:
+                await exited
+            finally:
+                loop.remove_reader(pidfd)
+        finally:
+            os.close(pidfd)
+
+    def _wait4(self) -> ToolUsage:
+        """
+        Reap the program, blocking until it exits; return its resource usage.
+        """
+        with self._lock:
+            self._exited = True
+        _, status, rusage = os.wait4(self.popen.pid, 0)
+        self.popen.returncode = _returncode(status)  # so Popen won't reap it
+        return ToolUsage(
+            max_rss=rusage.ru_maxrss * 1024,  # Linux reports KiB
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            n_blocks_in=rusage.ru_inblock,
+            n_blocks_out=rusage.ru_oublock,
+        )
+
+    def communicate(self) -> ToolResult:
+        """
+        Feed stdin, read stdout and stderr, and wait for the program to exit.
+
+        Raise subprocess.CalledProcessError if it exits with nonzero status.
+        If `call.stdin_chunks` raises, re-raise its exception after the
+        program exits.
+        """
+        chunks_error: Optional[BaseException] = None
+        stderr_chunks: List[bytes] = []
+
+        def write_chunks() -> None:
+            nonlocal chunks_error
+            try:
+                with self.popen.stdin as stdin:
+                    for chunk in self.call.stdin_chunks:
+                        stdin.write(chunk)
+            except BrokenPipeError:
+                pass  # the child stopped reading
+            except BaseException as err:
+                chunks_error = err
+
+        def read_stderr() -> None:
+            stderr_chunks.append(self.popen.stderr.read())
+
+        threads = [threading.Thread(target=read_stderr)]
+        if self.call.stdin_chunks is not None:
+            threads.append(threading.Thread(target=write_chunks))
+        for thread in threads:
+            thread.start()
+        try:
+            stdout = self.popen.stdout.read()
+        except BaseException:
+            self.kill()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            usage = self._reap()
+            self.popen.stdout.close()
+            self.popen.stderr.close()
+        stderr = stderr_chunks[0]
+
+        if chunks_error is not None:
+            raise chunks_error
+        returncode = self.popen.returncode
+        if returncode != 0:
+            raise subprocess.CalledProcessError(
+                returncode, self.call.args, stdout, stderr
+            )
+        return ToolResult(self.call.args, returncode, stdout, stderr, usage)
+
+    async def communicate_async(self) -> ToolResult:
+        """
+        Like `communicate()`, but on the event loop: no thread waits on the
+        program.
+
+        Its pipes are asyncio transports, and we reap it once the loop sees it
+        exit. Producing each stdin chunk may block (transcoding, say), so we do
+        that on the default executor.
+
+        If we are cancelled, kill the program.
+        """
+        loop = asyncio.get_running_loop()
+        transports = []
+
+        async def read_all(pipe) -> bytes:
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), pipe
+            )
+            transports.append(transport)
+            return await reader.read()
+
+        async def write_chunks() -> None:
+            transport, protocol = await loop.connect_write_pipe(
+                lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()),
+                self.popen.stdin,
+            )
+            transports.append(transport)
+            writer = asyncio.StreamWriter(transport, protocol, None, loop)
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(
+                        None, next, self.call.stdin_chunks, None
+                    )
+                    if chunk is None:
+                        break
+                    writer.write(chunk)
+                    await writer.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the child stopped reading
+            except BaseException:
+                transport.abort()  # don't flush: we're failing or cancelled
+                raise
+            finally:
+                writer.close()
+
+        tasks = [read_all(self.popen.stdout), read_all(self.popen.stderr)]
+        if self.call.stdin_chunks is not None:
+            tasks.append(write_chunks())
+        try:
+            stdout, stderr, *chunks_error = await asyncio.gather(
+                *tasks, return_exceptions=True
+            )
+            await self._wait_exited_async()
+        except BaseException:
+            # asyncio.CancelledError, most likely
+            self.kill()
+            raise
+        finally:
+            for transport in transports:
+                transport.close()
+            for pipe in (self.popen.stdin, self.popen.stdout, self.popen.stderr):
+                if pipe is not None:
+                    pipe.close()
+            usage = self._wait4()  # it has exited -- or we killed it
+
+        for result in (stdout, stderr, *chunks_error):
+            if isinstance(result, BaseException):
+                raise result
+        returncode = self.popen.returncode
+        if returncode != 0:
+            raise subprocess.CalledProcessError(
+                returncode, self.call.args, stdout, stderr
+            )
+        return ToolResult(self.call.args, returncode, stdout, stderr, usage)
+
+
+def run_tool(call: ToolCall) -> ToolResult:
+    """
+    Run `call.args`, raising subprocess.CalledProcessError on nonzero exit.
+    """
+    return _ToolProcess(call).communicate()
+
+
+def run_tools(calls: List[ToolCall]) -> List[ToolResult]:
+    """
+    Run `calls` at the same time, each on its own thread.
+
+    Wait for every program to exit. Then raise the exception of the first
+    call (in `calls` order) that failed, if any.
+    """
+    if len(calls) == 1:
+        return [run_tool(calls[0])]
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(calls), thread_name_prefix="cjwparse-tool"
+    ) as executor:
+        futures = [executor.submit(run_tool, call) for call in calls]
+        concurrent.futures.wait(futures)
+    return [future.result() for future in futures]  # or raise
+
+
+def run_tool_steps(steps: ToolSteps[T]) -> T:
+    """
+    Run `steps` to completion on this thread, blocking on each program.
+    """
+    try:
+        call = next(steps)
+        while True:
+            try:
+                if isinstance(call, list):
+                    child = run_tools(call)
+                else:
+                    child = run_tool(call)
+            except Exception as err:
+                call = steps.throw(err)
+            else:
+                call = steps.send(child)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_tool_async(call: ToolCall) -> ToolResult:
+    """
+    Like `run_tool()`, but without blocking the event loop.
+
+    If we are cancelled, kill the program.
+    """
+    return await _ToolProcess(call).communicate_async()
+
+
+async def run_tools_async(calls: List[ToolCall]) -> List[ToolResult]:
+    """
+    Like `run_tools()`, but without blocking the event loop.
+
+    If we are cancelled, kill all the programs.
+    """
+    results = await asyncio.gather(
+        *(run_tool_async(call) for call in calls), return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def _advance(method: Callable[[Any], ToolCall], value: Any) -> Tuple[bool, Any]:
+    """
+    Call `steps.send(value)` or `steps.throw(value)`.
+
+    Return (True, return_value) if `steps` finished, else (False, ToolCall) --
+    or (False, List[ToolCall]).
+    (StopIteration must not cross an executor Future.)
+    """
+    try:
+        return False, method(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+async def run_tool_steps_async(steps: ToolSteps[T]) -> T:
+    """
+    Run `steps` to completion without blocking the event loop.
+
+    Each step of `steps` runs on the default executor. The event loop feeds
+    each program, reads its output and notices when it exits: no thread waits
+    on a program.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        done, value = await loop.run_in_executor(None, _advance, steps.send, None)
+        while not done:
+            try:
+                if isinstance(value, list):
+                    child = await run_tools_async(value)
+                else:
+                    child = await run_tool_async(value)
+            except Exception as err:
+                method, value = steps.throw, err
+            else:
+                method, value = steps.send, child
+            done, value = await loop.run_in_executor(None, _advance, method, value)
+        return value
+    finally:
+        if not steps.gi_running:
+            # Clean up temporary files, if we were cancelled. (If a step is
+            # still running on the executor, garbage collection will do it.)
+            steps.close()
@@ -1,22 +1,63 @@
+import collections
+import concurrent.futures
+import dataclasses
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Optional
+from typing import Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import pyarrow
 
 from cjwmodule.i18n import I18nMessage
 
-from .csv import parse_csv
-from .excel import parse_xls, parse_xlsx
+from ._util import ToolSteps, run_tool_steps, run_tool_steps_async
+from .archive import TEXT_MIME_TYPES, choose_zip_member, list_zip_members
+from .cache import ParseCache
+from .compression import Compression, detect_compression
+from .csv import _parse_csv_and_write_steps, parse_csv, parse_csv_async
+from .excel import (
+    ParseSheetResult,
+    _parse_excel_and_write_steps,
+    parse_xls,
+    parse_xls_async,
+    parse_xls_sheets,
+    parse_xlsx,
+    parse_xlsx_async,
+    parse_xlsx_sheets,
+    probe_xlsx,
+)
 from .i18n import _trans_cjwparse
-from .json import parse_json
+from .json import _parse_json_and_write_steps, parse_json, parse_json_async
+from .jsonl import _parse_jsonl_and_write_steps, parse_jsonl, parse_jsonl_async
 from .mime import MimeType
+from .report import ParseReport
 from .settings import DEFAULT_SETTINGS, Settings
 
 __all__ = [
     "MimeType",
+    "ParseCache",
+    "ParseFilesJob",
+    "ParseFilesResult",
+    "ParseReport",
+    "ParseSheetResult",
     "parse_file",
+    "parse_file_async",
+    "parse_files",
     "parse_csv",
+    "parse_csv_async",
     "parse_json",
+    "parse_json_async",
+    "parse_jsonl",
+    "parse_jsonl_async",
     "parse_xls",
+    "parse_xls_async",
+    "parse_xls_sheets",
     "parse_xlsx",
+    "parse_xlsx_async",
+    "parse_xlsx_sheets",
+    "probe_xlsx",
 ]
 
 
@@ -28,12 +69,32 @@ def parse_file(
     encoding: Optional[str] = None,
     mime_type: Optional[MimeType] = None,
     has_header: bool = True,
+    zip_member: Optional[str] = None,
+    cache: Optional[ParseCache] = None,
+    report: Optional[ParseReport] = None,
 ) -> List[I18nMessage]:
     """
     Parse the data file at `path` into new Arrow file `output_path`.
 
     Return a list of warnings as (translatable) I18nMessages.
 
+    If `cache` is set, reuse the result of an earlier parse of identical
+    input (same bytes, settings and arguments), and store new results in it.
+    CSV parses also reuse earlier raw tables when only `has_header` differs.
+
+    If `report` is set, record where the parse spent its time and what it
+    output (see `ParseReport`).
+
+    If `path` is a ZIP archive, parse its member named `zip_member` -- or, if
+    that is `None`, its largest CSV, TSV, TXT or JSON file. We stream the
+    member out of the archive: we never extract it to disk.
+
+    We pick a parser by content when `MimeType.sniff()` recognizes it (XLS,
+    XLSX, ZIP, JSON, JSON Lines, HTML) -- even if `mime_type` or the file extension says
+    otherwise. (One exception: a JSON Lines file with one record looks like
+    JSON, so we trust `mime_type` or the extension when they say JSON Lines.)
+    Failing that, we use `mime_type`; failing that, the extension.
+
     This must never fail, cause out-of-memory or any such madness:
 
     * If `path` points to a file we do not handle, write an empty file to
@@ -41,46 +102,526 @@ def parse_file(
     * If `path` points to an invalid file, convert what data we can and
       return a warning.
     """
+    return run_tool_steps(
+        _parse_file_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            mime_type=mime_type,
+            has_header=has_header,
+            zip_member=zip_member,
+            cache=cache,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+async def parse_file_async(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings = DEFAULT_SETTINGS,
+    encoding: Optional[str] = None,
+    mime_type: Optional[MimeType] = None,
+    has_header: bool = True,
+    zip_member: Optional[str] = None,
+    cache: Optional[ParseCache] = None,
+    report: Optional[ParseReport] = None,
+) -> List[I18nMessage]:
+    """
+    `parse_file()`, without blocking the event loop.
+
+    The event loop drives arrow-tools programs' pipes and notices when they
+    exit, and cancelling the task kills them. Everything else (transcoding,
+    postprocessing, caching) runs on the event loop's default executor.
+    """
+    return await run_tool_steps_async(
+        _parse_file_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            mime_type=mime_type,
+            has_header=has_header,
+            zip_member=zip_member,
+            cache=cache,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+def _extension(path: Path) -> str:
+    """
+    Return the extension of `path`, ignoring a compression extension.
+
+    "data.csv.gz" is CSV.
+    """
+    suffixes = [suffix.lower() for suffix in path.suffixes]
+    if suffixes:
+        try:
+            Compression.from_extension(suffixes[-1])
+            suffixes.pop()
+        except KeyError:
+            pass
+    return "".join(suffixes)
+
+
+def _parse_file_steps(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings,
+    encoding: Optional[str],
+    mime_type: Optional[MimeType],
+    has_header: bool,
+    zip_member: Optional[str],
+    cache: Optional[ParseCache],
+    report: ParseReport,
+) -> ToolSteps[List[I18nMessage]]:
+    ext = _extension(path)
     if mime_type is None:
-        ext = "".join(path.suffixes).lower()
         try:
             mime_type = MimeType.from_extension(ext)
         except KeyError:
-            output_path.write_bytes(b"")
-            return [
-                _trans_cjwparse(
-                    "file.unknown_ext",
-                    "Unknown file extension {ext}. Please try a different file.",
-                    {"ext": ext},
-                )
-            ]
+            pass
+
+    # Trust content over names: a mislabeled file would waste a parse in the
+    # wrong tool, and fail
+    sniffed_mime_type = MimeType.sniff(path)
+    if sniffed_mime_type is not None and not (
+        # JSON Lines with one record looks like JSON
+        sniffed_mime_type == MimeType.JSON
+        and mime_type == MimeType.JSONL
+    ):
+        mime_type = sniffed_mime_type
+    elif mime_type is None:
+        output_path.write_bytes(b"")
+        return [
+            _trans_cjwparse(
+                "file.unknown_ext",
+                "Unknown file extension {ext}. Please try a different file.",
+                {"ext": ext},
+            )
+        ]
+
+    if mime_type == MimeType.HTML:
+        output_path.write_bytes(b"")
+        return [
+            _trans_cjwparse(
+                "file.html",
+                "This file is a web page, not a data file. Please try a different file.",
+            )
+        ]
+
+    compression = detect_compression(path)
+    if compression is not None and (
+        not compression.is_supported or mime_type in {MimeType.XLS, MimeType.XLSX}
+    ):
+        output_path.write_bytes(b"")
+        return [
+            _trans_cjwparse(
+                "file.unsupported_compression",
+                "We cannot decompress this {compression} file. Please decompress it and try again.",
+                {"compression": compression.value},
+            )
+        ]
+
+    if cache is None:
+        return (
+            yield from _parse_file_by_mime_type_steps(
+                path,
+                output_path=output_path,
+                settings=settings,
+                encoding=encoding,
+                mime_type=mime_type,
+                has_header=has_header,
+                zip_member=zip_member,
+                cache=cache,
+                cache_digest=None,
+                report=report,
+            )
+        )
+
+    with report.stage("cache"):
+        # Hash once: the raw CSV cache keys on this digest, too
+        cache_digest = cache.file_digest(path)
+        key = cache.key(
+            cache_digest,
+            settings=settings,
+            encoding=encoding,
+            mime_type=mime_type,
+            has_header=has_header,
+            zip_member=zip_member,
+        )
+        warnings = cache.get(key, output_path)
+    if warnings is None:
+        warnings = yield from _parse_file_by_mime_type_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            mime_type=mime_type,
+            has_header=has_header,
+            zip_member=zip_member,
+            cache=cache,
+            cache_digest=cache_digest,
+            report=report,
+        )
+        with report.stage("cache"):
+            cache.put(key, output_path, warnings)
+    return warnings
+
 
+def _parse_file_by_mime_type_steps(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings,
+    encoding: Optional[str],
+    mime_type: MimeType,
+    has_header: bool,
+    zip_member: Optional[str],
+    cache: Optional[ParseCache],
+    cache_digest: Optional[bytes],
+    report: ParseReport,
+) -> ToolSteps[List[I18nMessage]]:
     if mime_type in {MimeType.CSV, MimeType.TSV, MimeType.TXT}:
         delimiter: Optional[str] = {
             MimeType.CSV: ",",
             MimeType.TSV: "\t",
             MimeType.TXT: None,
         }[mime_type]
-        return parse_csv(
-            path,
-            output_path=output_path,
-            encoding=encoding,
-            settings=settings,
-            delimiter=delimiter,
-            has_header=has_header,
-            autoconvert_text_to_numbers=True,
+        return (
+            yield from _parse_csv_and_write_steps(
+                path,
+                output_path=output_path,
+                encoding=encoding,
+                settings=settings,
+                delimiter=delimiter,
+                has_header=has_header,
+                autoconvert_text_to_numbers=True,
+                cache=cache,
+                report=report,
+                zip_member=zip_member,
+                cache_digest=cache_digest,
+            )
         )
     elif mime_type == MimeType.JSON:
-        return parse_json(
-            path, output_path=output_path, settings=settings, encoding=encoding
+        return (
+            yield from _parse_json_and_write_steps(
+                path,
+                output_path=output_path,
+                settings=settings,
+                encoding=encoding,
+                report=report,
+                zip_member=zip_member,
+            )
+        )
+    elif mime_type == MimeType.JSONL:
+        return (
+            yield from _parse_jsonl_and_write_steps(
+                path,
+                output_path=output_path,
+                settings=settings,
+                encoding=encoding,
+                report=report,
+                zip_member=zip_member,
+            )
         )
     elif mime_type == MimeType.XLS:
-        return parse_xls(
-            path, output_path=output_path, settings=settings, has_header=has_header
+        return (
+            yield from _parse_excel_and_write_steps(
+                tool="xls-to-arrow",
+                path=path,
+                output_path=output_path,
+                settings=settings,
+                has_header=has_header,
+                report=report,
+            )
         )
     elif mime_type == MimeType.XLSX:
-        return parse_xlsx(
-            path, output_path=output_path, settings=settings, has_header=has_header
+        return (
+            yield from _parse_excel_and_write_steps(
+                tool="xlsx-to-arrow",
+                path=path,
+                output_path=output_path,
+                settings=settings,
+                has_header=has_header,
+                report=report,
+            )
+        )
+    elif mime_type == MimeType.ZIP:
+        return (
+            yield from _parse_zip_steps(
+                path,
+                output_path=output_path,
+                settings=settings,
+                encoding=encoding,
+                has_header=has_header,
+                zip_member=zip_member,
+                cache=cache,
+                cache_digest=cache_digest,
+                report=report,
+            )
         )
     else:
         raise RuntimeError("Unhandled MIME type")
+
+
+def _parse_zip_steps(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings,
+    encoding: Optional[str],
+    has_header: bool,
+    zip_member: Optional[str],
+    cache: Optional[ParseCache],
+    cache_digest: Optional[bytes],
+    report: ParseReport,
+) -> ToolSteps[List[I18nMessage]]:
+    """
+    Parse one member of ZIP archive `path`, streaming it out of the archive.
+    """
+    try:
+        with report.stage("list_zip_members"):
+            members = list_zip_members(path)
+    except zipfile.BadZipFile as err:
+        output_path.write_bytes(b"")
+        return [
+            _trans_cjwparse(
+                "file.invalid_zip",
+                "This ZIP file is invalid. Please try a different file. (Debugging message: “{message}”)",
+                {"message": str(err)},
+            )
+        ]
+
+    member = choose_zip_member(members, zip_member)
+    if member is None:
+        output_path.write_bytes(b"")
+        if zip_member is None:
+            return [
+                _trans_cjwparse(
+                    "file.zip_no_data_file",
+                    "This ZIP file has no CSV, TSV, TXT or JSON file. Please try a different file.",
+                )
+            ]
+        else:
+            return [
+                _trans_cjwparse(
+                    "file.zip_member_not_found",
+                    "This ZIP file has no file named {name}. Please try a different file.",
+                    {"name": zip_member},
+                )
+            ]
+    if member.mime_type not in TEXT_MIME_TYPES:
+        output_path.write_bytes(b"")
+        return [
+            _trans_cjwparse(
+                "file.unsupported_zip_member",
+                "We cannot parse {name} within a ZIP file. Please extract it and try again.",
+                {"name": member.name},
+            )
+        ]
+
+    return (
+        yield from _parse_file_by_mime_type_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            mime_type=member.mime_type,
+            has_header=has_header,
+            zip_member=member.name,
+            cache=cache,
+            cache_digest=cache_digest,
+            report=report,
+        )
+    )
+
+
+class ParseFilesJob(NamedTuple):
+    """
+    Arguments to one `parse_file()` call, for `parse_files()`.
+    """
+
+    path: Path
+    output_path: Path
+    encoding: Optional[str] = None
+    mime_type: Optional[MimeType] = None
+    has_header: bool = True
+    zip_member: Optional[str] = None
+
+
+class ParseFilesResult(NamedTuple):
+    job: ParseFilesJob
+
+    warnings: List[I18nMessage]
+    """
+    What `parse_file()` returned -- or `[]` if it raised `error`.
+    """
+
+    error: Optional[Exception]
+    """
+    What `parse_file()` raised, or `None` if it succeeded.
+    """
+
+
+_MEMORY_PER_INPUT_BYTE = 4
+"""
+Estimated RAM per byte of input file, for `parse_files(max_memory=...)`.
+
+Transcoding, parsing and postprocessing each hold a copy of the text, roughly.
+"""
+
+_MAX_CRASHES_PER_JOB = 2
+"""
+Number of worker crashes a job may witness before we blame it for them.
+"""
+
+_worker_settings: Optional[Settings] = None
+
+
+def _init_worker(settings: Settings) -> None:
+    global _worker_settings
+    _worker_settings = settings
+    if settings.ARROW_CPU_COUNT is not None:
+        pyarrow.set_cpu_count(settings.ARROW_CPU_COUNT)
+
+
+def _parse_files_job(job: ParseFilesJob) -> List[I18nMessage]:
+    return parse_file(
+        job.path,
+        output_path=job.output_path,
+        settings=_worker_settings,
+        encoding=job.encoding,
+        mime_type=job.mime_type,
+        has_header=job.has_header,
+        zip_member=job.zip_member,
+    )
+
+
+def _estimate_job_memory(job: ParseFilesJob) -> int:
+    try:
+        return job.path.stat().st_size * _MEMORY_PER_INPUT_BYTE
+    except OSError:
+        return 0  # the job will fail; parse_file() will report why
+
+
+def parse_files(
+    jobs: Iterable[ParseFilesJob],
+    *,
+    settings: Settings = DEFAULT_SETTINGS,
+    max_workers: Optional[int] = None,
+    max_memory: Optional[int] = None,
+) -> Iterator[ParseFilesResult]:
+    """
+    Run `parse_file()` on each of `jobs`, in parallel worker processes.
+
+    Yield a result as each job completes -- in completion order, not `jobs`
+    order. A job that raises yields a result with `error` set; other jobs are
+    unaffected. If a worker process dies (say, killed for using too much
+    memory), we retry the jobs it may have been running in a new pool, one at
+    a time; a job whose worker dies while it runs alone fails with
+    `BrokenProcessPool`.
+
+    Run at most `max_workers` jobs at a time (default: one per CPU). Each
+    worker process is started once and reused. To avoid oversubscribing CPUs,
+    workers split `settings.POSTPROCESS_N_THREADS`,
+    `settings.TRANSCODE_N_PROCESSES`, `settings.JSONL_N_PROCESSES` and
+    (unless you set it) pyarrow's CPU pool among themselves.
+
+    If `max_memory` is set, don't start a job while the jobs in progress are
+    estimated to need more than `max_memory` bytes of RAM in all. (We
+    estimate from input file sizes. A job that alone exceeds `max_memory`
+    still runs, by itself.)
+
+    `jobs` is read lazily, so it may be a generator.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    n_cpus = os.cpu_count() or 1
+    worker_settings = dataclasses.replace(
+        settings,
+        POSTPROCESS_N_THREADS=max(1, settings.POSTPROCESS_N_THREADS // max_workers),
+        TRANSCODE_N_PROCESSES=max(1, settings.TRANSCODE_N_PROCESSES // max_workers),
+        JSONL_N_PROCESSES=max(1, settings.JSONL_N_PROCESSES // max_workers),
+        ARROW_CPU_COUNT=settings.ARROW_CPU_COUNT or max(1, n_cpus // max_workers),
+    )
+
+    def create_executor() -> concurrent.futures.ProcessPoolExecutor:
+        # "spawn", not "fork": the caller may be running threads
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(worker_settings,),
+        )
+
+    job_iter = iter(jobs)
+    retries: Deque[Tuple[ParseFilesJob, int]] = collections.deque()
+    next_job: Optional[Tuple[ParseFilesJob, int]] = None  # (job, n_crashes)
+    running: Dict[concurrent.futures.Future, Tuple[ParseFilesJob, int, int]] = {}
+    memory_in_use = 0
+
+    executor = create_executor()
+    try:
+        while True:
+            while len(running) < max_workers:
+                if any(n_crashes for _, n_crashes, _ in running.values()):
+                    break  # a crash suspect is running alone
+                if next_job is None:
+                    if retries:
+                        next_job = retries.popleft()
+                    else:
+                        job = next(job_iter, None)
+                        if job is None:
+                            break
+                        next_job = (job, 0)
+                job, n_crashes = next_job
+                memory = _estimate_job_memory(job)
+                if n_crashes and running:
+                    break  # wait to run the crash suspect alone
+                if (
+                    running
+                    and max_memory is not None
+                    and memory_in_use + memory > max_memory
+                ):
+                    break  # wait for memory to free up
+                running[executor.submit(_parse_files_job, job)] = (
+                    job,
+                    n_crashes,
+                    memory,
+                )
+                memory_in_use += memory
+                next_job = None
+
+            if not running:
+                return
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if any(isinstance(f.exception(), BrokenProcessPool) for f in done):
+                # Every running job fails with BrokenProcessPool. Finish them
+                # all, then start a new pool.
+                executor.shutdown(wait=True)
+                done = list(running.keys())
+                executor = create_executor()
+
+            for future in done:
+                job, n_crashes, memory = running.pop(future)
+                memory_in_use -= memory
+                error = future.exception()
+                if error is None:
+                    yield ParseFilesResult(job, future.result(), None)
+                elif (
+                    isinstance(error, BrokenProcessPool)
+                    and n_crashes + 1 < _MAX_CRASHES_PER_JOB
+                ):
+                    retries.append((job, n_crashes + 1))
+                else:
+                    yield ParseFilesResult(job, [], error)
+    finally:
+        executor.shutdown(wait=True)
@@ -0,0 +1,88 @@
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import List, NamedTuple, Optional
+
+from .mime import MimeType
+
+__all__ = ["ZipMember", "choose_zip_member", "list_zip_members"]
+
+
+TEXT_MIME_TYPES = frozenset(
+    [MimeType.CSV, MimeType.TSV, MimeType.TXT, MimeType.JSON, MimeType.JSONL]
+)
+"""
+MIME types we can stream out of a ZIP archive.
+
+Excel programs need a file on disk, so we don't parse Excel members.
+"""
+
+
+class ZipMember(NamedTuple):
+    """
+    A file in a ZIP archive, as listed in its central directory.
+    """
+
+    name: str
+
+    n_bytes: int
+    """
+    Uncompressed size, according to the archive. (It may lie.)
+    """
+
+    mime_type: Optional[MimeType]
+    """
+    MIME type by extension, or `None` if we don't know the extension.
+    """
+
+
+def _is_junk(name: str) -> bool:
+    """
+    Return True for files zip tools add that nobody means to parse.
+    """
+    path = PurePosixPath(name)
+    return path.parts[0] == "__MACOSX" or path.name.startswith(".")
+
+
+def list_zip_members(path: Path) -> List[ZipMember]:
+    """
+    List the files in ZIP archive `path`, without reading them.
+
+    We only read the archive's central directory: skip directories and files
+    like "__MACOSX/..." and ".DS_Store".
+
+    Raise zipfile.BadZipFile if `path` is not a ZIP archive.
+    """
+    with zipfile.ZipFile(path) as zf:
+        infos = zf.infolist()
+
+    members = []
+    for info in infos:
+        if info.is_dir() or _is_junk(info.filename):
+            continue
+        try:
+            mime_type = MimeType.from_extension(
+                PurePosixPath(info.filename).suffix.lower()
+            )
+        except KeyError:
+            mime_type = None
+        members.append(ZipMember(info.filename, info.file_size, mime_type))
+    return members
+
+
+def choose_zip_member(
+    members: List[ZipMember], name: Optional[str]
+) -> Optional[ZipMember]:
+    """
+    Pick the member to parse: the one called `name`, if set; otherwise, the
+    largest CSV, TSV, TXT, JSON or JSON Lines file.
+
+    Return `None` if there is no such member.
+    """
+    if name is not None:
+        return next((member for member in members if member.name == name), None)
+
+    candidates = [member for member in members if member.mime_type in TEXT_MIME_TYPES]
+    if not candidates:
+        return None
+    # Largest wins; ties go to the first in the archive
+    return max(candidates, key=lambda member: member.n_bytes)
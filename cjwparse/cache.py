@@ -0,0 +1,396 @@
+import contextlib
+import dataclasses
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+import pyarrow
+
+from cjwmodule.i18n import I18nMessage
+
+from . import __version__
+from .mime import MimeType
+from .settings import Settings
+
+__all__ = ["CacheStats", "ParseCache", "RawCsv"]
+
+_SETTINGS_NOT_AFFECTING_OUTPUT = frozenset(
+    {
+        "CSV_ENGINE",
+        "CSV_ENGINE_AUTO_MAX_BYTES",
+        "STREAM_TEXT_TO_ARROW_TOOLS",
+        "TRANSCODE_N_PROCESSES",
+        "POSTPROCESS_N_THREADS",
+        "ARROW_CPU_COUNT",
+        "JSONL_N_PROCESSES",
+        "JSONL_MIN_CHUNK_BYTES",
+    }
+)
+"""
+Settings that change how we parse, but never what we output.
+
+We omit these from cache keys, so differently-tuned processes share results.
+"""
+
+_RAW_CSV_SETTINGS = (
+    "MAX_ROWS_PER_TABLE",
+    "MAX_COLUMNS_PER_TABLE",
+    "MAX_BYTES_PER_VALUE",
+    "MAX_CSV_BYTES",
+    "MAX_DECOMPRESSED_BYTES",
+    "CHARDET_CHUNK_SIZE",
+    "ENCODING_DETECTION_MAX_BYTES",
+    "SEP_DETECT_CHUNK_SIZE",
+)
+"""
+Settings that affect `_parse_csv()` output before postprocessing.
+"""
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+_TABLE_FILENAME = "table.arrow"
+_ENTRY_FILENAME = "entry.json"
+
+
+class CacheStats(NamedTuple):
+    n_hits: int
+    n_misses: int
+    n_raw_csv_hits: int = 0
+    n_raw_csv_misses: int = 0
+
+
+class RawCsv(NamedTuple):
+    """
+    Cached CSV, parsed into text columns but not yet postprocessed.
+    """
+
+    table: pyarrow.Table
+    """
+    Raw csv-to-arrow output (memory-mapped from the cache).
+    """
+
+    warnings: List[I18nMessage]
+    """
+    Warnings from truncating, transcoding and parsing.
+    """
+
+    encoding: str
+    """
+    Encoding we read the file as (detected, if the caller didn't specify).
+    """
+
+    delimiter: str
+    """
+    Delimiter we parsed with (sniffed, if the caller didn't specify).
+    """
+
+
+class ParseCache:
+    """
+    On-disk cache of `parse_file()` results, keyed by input content.
+
+    Each entry is a directory holding an Arrow file and a JSON document (such
+    as the warnings to replay). Entries are written to temporary directories
+    and renamed into place, so readers never see half-written entries; several
+    processes may share one cache directory.
+
+    A hit hardlinks the cached Arrow file to `output_path` (or copies it, if
+    the cache is on a different filesystem). Cached files are read-only:
+    callers must not modify `output_path` in place.
+
+    We also cache raw CSV tables (before postprocessing), so toggling
+    `has_header` or `autoconvert_text_to_numbers` only re-runs
+    postprocessing.
+
+    When the cache grows beyond `max_n_bytes`, we evict least-recently-used
+    entries.
+    """
+
+    def __init__(self, directory: Path, *, max_n_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_n_bytes = max_n_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._stats_lock = threading.Lock()
+        self._stats = CacheStats(0, 0, 0, 0)
+
+    @property
+    def stats(self) -> CacheStats:
+        with self._stats_lock:
+            return self._stats
+
+    def _count(self, field: str) -> None:
+        with self._stats_lock:
+            self._stats = self._stats._replace(
+                **{field: getattr(self._stats, field) + 1}
+            )
+
+    def file_digest(self, path: Path) -> bytes:
+        """
+        Hash the contents of `path`, for `key()` and `raw_csv_key()`.
+
+        Hash once per parse, and pass the digest to every key of that parse.
+        """
+        hasher = hashlib.sha256()
+        with path.open("rb") as f:
+            while True:
+                chunk = f.read(_HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        return hasher.digest()
+
+    def _key(self, digest: bytes, params: Dict[str, Any]) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(
+            json.dumps(dict(version=__version__, **params), sort_keys=True).encode(
+                "utf-8"
+            )
+        )
+        hasher.update(digest)
+        return hasher.hexdigest()
+
+    def key(
+        self,
+        digest: bytes,
+        *,
+        settings: Settings,
+        encoding: Optional[str],
+        mime_type: MimeType,
+        has_header: bool,
+        zip_member: Optional[str] = None,
+    ) -> str:
+        """
+        Hash `digest` (see `file_digest()`) and the parameters that affect
+        parse output.
+        """
+        return self._key(
+            digest,
+            dict(
+                settings={
+                    k: v
+                    for k, v in dataclasses.asdict(settings).items()
+                    if k not in _SETTINGS_NOT_AFFECTING_OUTPUT
+                },
+                encoding=encoding,
+                mime_type=mime_type.value,
+                has_header=has_header,
+                zip_member=zip_member,
+            ),
+        )
+
+    def raw_csv_key(
+        self,
+        digest: bytes,
+        *,
+        settings: Settings,
+        encoding: Optional[str],
+        delimiter: Optional[str],
+        zip_member: Optional[str] = None,
+    ) -> str:
+        """
+        Hash `digest` (see `file_digest()`) and the parameters that affect raw
+        CSV tables.
+        """
+        return self._key(
+            digest,
+            dict(
+                raw_csv=True,
+                settings={k: getattr(settings, k) for k in _RAW_CSV_SETTINGS},
+                encoding=encoding,
+                delimiter=delimiter,
+                zip_member=zip_member,
+            ),
+        )
+
+    def get(self, key: str, output_path: Path) -> Optional[List[I18nMessage]]:
+        """
+        Write the cached table to `output_path` and return its warnings.
+
+        Return None (and leave `output_path` alone) on cache miss.
+        """
+        entry = self.directory / key
+        try:
+            document = self._read_entry(entry)
+            _link_or_copy(entry / _TABLE_FILENAME, output_path)
+        except FileNotFoundError:
+            # Missing, or evicted by another process while we read it
+            self._count("n_misses")
+            return None
+
+        self._count("n_hits")
+        return _parse_warnings(document["warnings"])
+
+    def put(self, key: str, table_path: Path, warnings: List[I18nMessage]) -> None:
+        """
+        Store a copy of `table_path` and `warnings` under `key`.
+        """
+        self._put(
+            [key],
+            table_path,
+            dict(warnings=_format_warnings(warnings)),
+            can_link=False,
+        )
+
+    def get_raw_csv(self, key: str) -> Optional[RawCsv]:
+        """
+        Return the raw CSV table stored under `key`, or None on cache miss.
+        """
+        entry = self.directory / key
+        try:
+            document = self._read_entry(entry)
+            # Memory-map: even a huge table costs no RAM until we read it. The
+            # mapping outlives eviction (which merely unlinks the file).
+            with pyarrow.memory_map((entry / _TABLE_FILENAME).as_posix()) as source:
+                table = pyarrow.ipc.open_file(source).read_all()
+        except FileNotFoundError:
+            self._count("n_raw_csv_misses")
+            return None
+
+        self._count("n_raw_csv_hits")
+        return RawCsv(
+            table,
+            _parse_warnings(document["warnings"]),
+            document["encoding"],
+            document["delimiter"],
+        )
+
+    def put_raw_csv(self, keys: List[str], table_path: Path, raw_csv: RawCsv) -> None:
+        """
+        Store Arrow file `table_path` and `raw_csv`'s metadata under `keys`.
+
+        `raw_csv.table` is ignored: `table_path` must hold the same table. We
+        may hardlink `table_path` and make it read-only.
+        Pass several keys so a parse that detected its encoding and delimiter
+        also serves later callers who pass that encoding and delimiter.
+        """
+        self._put(
+            keys,
+            table_path,
+            dict(
+                warnings=_format_warnings(raw_csv.warnings),
+                encoding=raw_csv.encoding,
+                delimiter=raw_csv.delimiter,
+            ),
+            can_link=True,
+        )
+
+    def _read_entry(self, entry: Path) -> Dict[str, Any]:
+        """
+        Read `entry`'s JSON document and mark the entry as recently used.
+
+        Raise FileNotFoundError if the entry does not exist.
+        """
+        document = json.loads((entry / _ENTRY_FILENAME).read_text(encoding="utf-8"))
+        os.utime(entry)  # for LRU eviction
+        return document
+
+    def _put(
+        self,
+        keys: List[str],
+        table_path: Path,
+        document: Dict[str, Any],
+        *,
+        can_link: bool,
+    ) -> None:
+        """
+        Store `table_path` and `document` under each of `keys`.
+
+        If `can_link`, `table_path` is ours to keep: hardlink it instead of
+        copying it. (Either way, only the first key costs a copy: later keys
+        are hardlinks to the first.)
+        """
+        src = table_path
+        for key in dict.fromkeys(keys):  # unique, in order
+            tmp_dir = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.directory))
+            try:
+                dest = tmp_dir / _TABLE_FILENAME
+                try:
+                    if not can_link:
+                        raise OSError(errno.EPERM, "we must copy")
+                    os.link(src, dest)
+                except OSError:
+                    shutil.copyfile(table_path, dest)
+                (tmp_dir / _ENTRY_FILENAME).write_text(
+                    json.dumps(document), encoding="utf-8"
+                )
+                for child in tmp_dir.iterdir():
+                    child.chmod(0o444)
+                try:
+                    os.rename(tmp_dir, self.directory / key)
+                except OSError as err:
+                    if err.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                        raise
+                    # Another process stored this entry first. Fine.
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            src = self.directory / key / _TABLE_FILENAME
+            can_link = True
+
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock():
+            entries = []
+            total = 0
+            for entry in self.directory.iterdir():
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    n_bytes = sum(child.stat().st_size for child in entry.iterdir())
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                entries.append((mtime, n_bytes, entry))
+                total += n_bytes
+
+            entries.sort()
+            for _, n_bytes, entry in entries:
+                if total <= self.max_n_bytes:
+                    break
+                # Rename first, so readers see either the whole entry or none
+                trash = Path(tempfile.mkdtemp(prefix=".trash-", dir=self.directory))
+                with contextlib.suppress(FileNotFoundError):
+                    os.rename(entry, trash / entry.name)
+                shutil.rmtree(trash, ignore_errors=True)
+                total -= n_bytes
+
+    @contextlib.contextmanager
+    def _lock(self) -> Iterator[None]:
+        with (self.directory / ".lock").open("a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _format_warnings(warnings: List[I18nMessage]) -> List[List[Any]]:
+    return [list(warning) for warning in warnings]
+
+
+def _parse_warnings(data: List[List[Any]]) -> List[I18nMessage]:
+    return [I18nMessage(id, arguments, source) for id, arguments, source in data]
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    """
+    Atomically make `dest` a hardlink to `src`; copy if we can't link.
+    """
+    tmp = dest.with_name(
+        ".%s.tmp-%d-%d" % (dest.name, os.getpid(), threading.get_ident())
+    )
+    with contextlib.suppress(FileNotFoundError):
+        tmp.unlink()
+    try:
+        os.link(src, tmp)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise  # FileNotFoundError, for instance
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
@@ -0,0 +1,170 @@
+import bz2
+import gzip
+import lzma
+import zipfile
+import zlib
+from enum import Enum
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional: pip install cjwparse[zstd]
+    zstandard = None
+
+__all__ = [
+    "DECOMPRESSION_ERRORS",
+    "Compression",
+    "DecompressingReader",
+    "detect_compression",
+]
+
+DECOMPRESSION_ERRORS = (
+    OSError,  # gzip.BadGzipFile, bz2's "Invalid data stream"
+    EOFError,  # truncated file
+    lzma.LZMAError,
+    zlib.error,  # corrupt gzip or ZIP deflate stream
+    zipfile.BadZipFile,  # ZIP member with bad CRC-32
+) + (() if zstandard is None else (zstandard.ZstdError,))
+"""
+Exceptions a decompressing file object may raise on corrupt or truncated input.
+"""
+
+
+class Compression(Enum):
+    GZIP = "gzip"
+    BZIP2 = "bzip2"
+    XZ = "xz"
+    ZSTD = "zstd"
+
+    @property
+    def magic(self) -> bytes:
+        """
+        Bytes every file in this format starts with.
+        """
+        return {
+            Compression.GZIP: b"\x1f\x8b",
+            Compression.BZIP2: b"BZh",
+            Compression.XZ: b"\xfd7zXZ\x00",
+            Compression.ZSTD: b"\x28\xb5\x2f\xfd",
+        }[self]
+
+    @property
+    def is_supported(self) -> bool:
+        """
+        False if decompressing needs an optional module that isn't installed.
+        """
+        return self != Compression.ZSTD or zstandard is not None
+
+    @classmethod
+    def from_extension(cls, ext: str):
+        """
+        Find compression by extension (e.g., ".gz").
+
+        Raise KeyError if there is none.
+        """
+        return {
+            ".gz": Compression.GZIP,
+            ".bz2": Compression.BZIP2,
+            ".xz": Compression.XZ,
+            ".zst": Compression.ZSTD,
+        }[ext]
+
+    def open(self, path: Path) -> BinaryIO:
+        """
+        Open `path` for streaming decompression.
+        """
+        if self == Compression.GZIP:
+            return gzip.open(path, "rb")
+        elif self == Compression.BZIP2:
+            return bz2.open(path, "rb")
+        elif self == Compression.XZ:
+            return lzma.open(path, "rb")
+        elif self == Compression.ZSTD:
+            if zstandard is None:
+                raise ImportError("Decompressing zstd needs the zstandard module")
+            return zstandard.ZstdDecompressor().stream_reader(
+                path.open("rb"), closefd=True
+            )
+        else:
+            raise RuntimeError("Unhandled compression")
+
+
+def detect_compression(path: Path) -> Optional[Compression]:
+    """
+    Detect compression from the first bytes of `path`, or return `None`.
+
+    We ignore the filename: a file named ".csv.gz" may be plain CSV.
+    """
+    with path.open("rb") as f:
+        head = f.read(6)
+    for compression in Compression:
+        if head.startswith(compression.magic):
+            return compression
+    return None
+
+
+class DecompressingReader:
+    """
+    Read-only, forward-only stream of at most `max_n_bytes` decompressed bytes.
+
+    Decompression stops at `max_n_bytes`, however large the file claims to be
+    -- our defense against "zip bombs". After reading everything, check
+    `is_truncated` to learn whether we stopped early.
+
+    Decompression also stops if the input is corrupt or truncated: we return
+    everything we decompressed before the error, then end the stream. After
+    reading everything, check `error` to learn whether that happened.
+
+    Supports just what our readers need: `read()` and `peek()`.
+    """
+
+    def __init__(self, f: BinaryIO, max_n_bytes: int):
+        self._f = f
+        self._max_n_bytes = max_n_bytes
+        self._peeked = b""
+        self.n_bytes = 0
+        """
+        Number of decompressed bytes we have read from `f`.
+        """
+        self.is_truncated = False
+        self.error: Optional[Exception] = None
+        """
+        Error that stopped decompression (one of `DECOMPRESSION_ERRORS`).
+        """
+
+    def _read(self, size: int) -> bytes:
+        size = min(size, self._max_n_bytes - self.n_bytes)
+        if size <= 0 or self.error is not None:
+            return b""
+        data = bytearray()
+        try:
+            # read1(), not read(): if the stream is corrupt, read() would
+            # discard the bytes it decompressed before the error.
+            while len(data) < size:
+                chunk = self._f.read1(size - len(data))
+                if not chunk:
+                    break
+                data += chunk
+            if self.n_bytes + len(data) == self._max_n_bytes and self._f.read(1):
+                self.is_truncated = True
+        except DECOMPRESSION_ERRORS as err:
+            self.error = err
+        self.n_bytes += len(data)
+        return bytes(data)
+
+    def peek(self, size: int) -> bytes:
+        """
+        Return up to `size` bytes, without consuming them.
+        """
+        if len(self._peeked) < size:
+            self._peeked += self._read(size - len(self._peeked))
+        return self._peeked[:size]
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = self._max_n_bytes
+        if self._peeked:
+            data, self._peeked = self._peeked[:size], self._peeked[size:]
+            return data
+        return self._read(size)
@@ -1,24 +1,31 @@
-import array
 import contextlib
-import csv
-import os
+import dataclasses
 import re
-import subprocess
-import sys
 from pathlib import Path
 from typing import Any, Callable, Dict, List, NamedTuple, Optional, Pattern, Tuple
 
 import numpy as np
 import pyarrow
+import pyarrow.compute
 
 from cjwmodule.i18n import I18nMessage
 from cjwmodule.util.colnames import gen_unique_clean_colnames_and_warn
 
-from ._util import tempfile_context
+from ._pyarrow_csv import CsvToArrowResult, csv_to_arrow, csv_to_arrow_from_chunks
+from ._util import (
+    ToolCall,
+    ToolSteps,
+    run_tool_steps,
+    run_tool_steps_async,
+    tempfile_context,
+)
+from .cache import ParseCache, RawCsv
+from .compression import detect_compression
 from .i18n import _trans_cjwparse
-from .postprocess import dictionary_encode_columns
+from .postprocess import dictionary_encode_columns, map_columns
+from .report import ParseReport
 from .settings import DEFAULT_SETTINGS, Settings
-from .text import transcode_to_utf8_and_warn
+from .text import Utf8Input, utf8_input_context
 
 
 class ErrorPattern(NamedTuple):
@@ -152,6 +159,9 @@ def _nix_utf8_chunk_empty_strings(chunk: pyarrow.Array) -> pyarrow.Array:
     """
     # pyarrow's cast() can't handle empty string. Create a new Array with
     # "" changed to null.
+    if len(chunk) == 0:
+        return chunk
+
     _, offsets_buf, data_buf = chunk.buffers()
 
     # Build a new validity buffer, based on offsets. Empty string = null.
@@ -162,74 +172,20 @@ def _nix_utf8_chunk_empty_strings(chunk: pyarrow.Array) -> pyarrow.Array:
     # Validity-bitmap spec:
     # https://arrow.apache.org/docs/format/Columnar.html#validity-bitmaps
 
-    # first offset must be 0. Next offsets are used to calculate lengths
-    offsets = array.array("i")
-    assert offsets.itemsize == 4
-    offsets.frombytes(offsets_buf)
-    if sys.byteorder != "little":
-        offsets.byteswap()  # pyarrow is little-endian
-
-    validity = bytearray()
-    null_count = 0
-    last_offset = offsets[0]
-    assert last_offset == 0
-    pos = 1
-    while True:
-        # Travel offsets in strides of 8: one per char in the validity bitmap.
-        # Pad with an extra 1 bit -- [2020-02-20, adamhooper] I think I read
-        # this is needed somewhere.
-        valid_byte = 0x00
-        block = offsets[pos : pos + 8]
-        try:
-            if block[0] > last_offset:
-                valid_byte |= 0x1
-            else:
-                null_count += 1
-            if block[1] > block[0]:
-                valid_byte |= 0x2
-            else:
-                null_count += 1
-            if block[2] > block[1]:
-                valid_byte |= 0x4
-            else:
-                null_count += 1
-            if block[3] > block[2]:
-                valid_byte |= 0x8
-            else:
-                null_count += 1
-            if block[4] > block[3]:
-                valid_byte |= 0x10
-            else:
-                null_count += 1
-            if block[5] > block[4]:
-                valid_byte |= 0x20
-            else:
-                null_count += 1
-            if block[6] > block[5]:
-                valid_byte |= 0x40
-            else:
-                null_count += 1
-            if block[7] > block[6]:
-                valid_byte |= 0x80
-            else:
-                null_count += 1
-            validity.append(valid_byte)
-            last_offset = block[7]
-            pos += 8
-        except IndexError:
-            validity.append(valid_byte)
-            break  # end of offsets
-
-    validity_buf = pyarrow.py_buffer(validity)
-
-    # We may have over-counted in null_count: anything before `chunk.offset`
-    # should not count.
-    #
-    # It's less work to "undo" the counting we did before -- otherwise we'd
-    # riddle the above loop with if-statements.
-    for i in range(chunk.offset):
-        if offsets[i + 1] == offsets[i]:
-            null_count -= 1
+    # Zero-copy view of the offsets we care about. pyarrow is little-endian.
+    # We include the values before `chunk.offset`: the validity bitmap is
+    # indexed from the start of the buffer, just like the offsets are.
+    n = chunk.offset + len(chunk)
+    offsets = np.frombuffer(offsets_buf, dtype="<i4", count=n + 1)
+    assert offsets[0] == 0
+    valid = np.diff(offsets) > 0
+
+    # Only values at or after `chunk.offset` count as nulls
+    null_count = len(chunk) - int(np.count_nonzero(valid[chunk.offset :]))
+    if null_count == 0:
+        validity_buf = None
+    else:
+        validity_buf = pyarrow.py_buffer(np.packbits(valid, bitorder="little"))
 
     return pyarrow.StringArray.from_buffers(
         length=len(chunk),
@@ -241,36 +197,72 @@ def _nix_utf8_chunk_empty_strings(chunk: pyarrow.Array) -> pyarrow.Array:
     )
 
 
-SCARY_BYTE_REGEX = re.compile(b"[nainfNAINF]")
+# Classes of bytes we may find in the text of a number. pyarrow cast() parses
+# "NaN" and "Inf" as doubles (and newer pyarrow parses "0x1F" as an integer).
+# Workbench doesn't support NaN or Inf, so bytes outside these classes mean we
+# won't auto-convert.
+_BYTE_NOT_NUMBER = 0
+_BYTE_INTEGER = 1  # may appear in int64 text: "-123"
+_BYTE_FLOAT = 2  # may only appear in float64 text: "+1.2e-3"
+_BYTE_CLASSES = np.full(256, _BYTE_NOT_NUMBER, dtype=np.uint8)
+_BYTE_CLASSES[np.frombuffer(b"0123456789-", dtype=np.uint8)] = _BYTE_INTEGER
+_BYTE_CLASSES[np.frombuffer(b"+.eE", dtype=np.uint8)] = _BYTE_FLOAT
+
+# Number of bytes to check before scanning the whole chunk. Most text columns
+# fail on their first few values; don't make them pay for a full scan.
+_AUTOCAST_PEEK_N_BYTES = 1024
+
+_AUTOCAST_INTEGER_TYPES = [
+    (pyarrow.int8(), np.iinfo(np.int8)),
+    (pyarrow.int16(), np.iinfo(np.int16)),
+    (pyarrow.int32(), np.iinfo(np.int32)),
+    (pyarrow.int64(), np.iinfo(np.int64)),
+]
 
 
-def _utf8_chunk_may_contain_inf_or_nan(chunk: pyarrow.Array) -> bool:
+def _utf8_chunk_text(chunk: pyarrow.Array) -> np.ndarray:
     """
-    Return true if we should fast-skip converting a pa.Array.
-
-    The _true_ reason for this function is to test whether an Array contains
-    "Inf" or "NaN". A number-conversion library will parse those. But _this_
-    library is for Workbench, and Workbench doesn't support NaN/Inf. So this
-    function helps us decide _not_ to auto-convert a column when the intent
-    isn't perfectly clear.
+    Return a zero-copy numpy uint8 view of all the text in `chunk`.
 
-    Assume `arr` is of type `utf8` or a dictionary of `utf8`. Assume there
-    are no gaps hidden in null values in the buffer. (It's up to the caller to
-    prove this.)
+    Assume `chunk` is of type `utf8`. Assume there are no gaps hidden in null
+    values in the buffer. (It's up to the caller to prove this.)
     """
     _, offsets_buf, data_buf = chunk.buffers()
+    if len(chunk) == 0 or data_buf is None:
+        return np.empty(0, dtype=np.uint8)
+    offsets = np.frombuffer(
+        offsets_buf, dtype="<i4", count=chunk.offset + len(chunk) + 1
+    )
+    offset0 = int(offsets[chunk.offset])
+    offsetN = int(offsets[-1])
+    return np.frombuffer(data_buf, dtype=np.uint8)[offset0:offsetN]
+
 
-    offsets = array.array("i")
-    assert offsets.itemsize == 4
-    offsets.frombytes(offsets_buf)
-    if sys.byteorder != "little":
-        offsets.byteswap()  # pyarrow is little-endian
+def _classify_utf8_text(text: np.ndarray) -> int:
+    """
+    Return the widest byte class (e.g., `_BYTE_FLOAT`) of any byte in `text`.
+
+    Return `_BYTE_NOT_NUMBER` if any byte cannot be part of a number.
+    """
+    # Fast-fail: don't scan the whole chunk when the first values are text.
+    if _BYTE_CLASSES[text[:_AUTOCAST_PEEK_N_BYTES]].min() == _BYTE_NOT_NUMBER:
+        return _BYTE_NOT_NUMBER
 
-    offset0 = offsets[chunk.offset]
-    offsetN = offsets[chunk.offset + len(chunk)]  # len(offsets) == 1 + len(chunk)
+    classes = _BYTE_CLASSES[text]
+    if classes.min() == _BYTE_NOT_NUMBER:
+        return _BYTE_NOT_NUMBER
+    return int(classes.max())
 
-    b = data_buf[offset0:offsetN].to_pybytes()
-    return SCARY_BYTE_REGEX.search(b) is not None
+
+def _narrowest_integer_type(
+    min_value: float, max_value: float, widest: pyarrow.DataType
+) -> Optional[pyarrow.DataType]:
+    for dtype, info in _AUTOCAST_INTEGER_TYPES:
+        if info.min <= min_value and max_value <= info.max:
+            return dtype
+        if dtype == widest:
+            return None
+    return None
 
 
 def _autocast_column(data: pyarrow.ChunkedArray) -> pyarrow.ChunkedArray:
@@ -279,86 +271,81 @@ def _autocast_column(data: pyarrow.ChunkedArray) -> pyarrow.ChunkedArray:
 
     Assume `data` is of type `utf8` or a dictionary of utf8.
 
+    We classify each chunk's bytes in a single pass, so text columns bail out
+    quickly. Then we cast at most twice: text with only digits and "-" is
+    parsed exactly as int64 (even above 2**53); anything else is parsed as
+    float64. Finally, we cast once to the narrowest integer type that fits.
+
     *Implementation wart*: this may choose float64 when integers would seem a
     better choice, because we use Pandas and Pandas does not support nulls
     in integer columns.
     """
-    # All-empty (and all-null) columns stay text
+    widest_class = _BYTE_INTEGER
+    has_text = False
     for chunk in data.iterchunks():
-        # https://arrow.apache.org/docs/format/Columnar.html#variable-size-binary-layout
-        _, offsets_buf, _ = chunk.buffers()
-        # If data has an offset, ignore what comes before
-        #
-        # We don't need to grab the _int_ offset: we can just look at the
-        # byte-representation of it.
-        offset_0_buf = offsets_buf[chunk.offset * 4 : (chunk.offset + 1) * 4]
-        # last offset isn't always the last 4 bytes: there can be padding
-        offset_n_buf = offsets_buf[
-            (chunk.offset + len(chunk)) * 4 : (chunk.offset + len(chunk) + 1) * 4
-        ]
-        if offset_0_buf.to_pybytes() != offset_n_buf.to_pybytes():
-            # there's at least 1 byte of text. (Assumes the CSV reader doesn't
-            # pad the buffer with gibberish.)
-            break
-    else:
-        # there are 0 bytes of text
+        text = _utf8_chunk_text(chunk)
+        if len(text) == 0:
+            continue  # all-empty chunk: nothing to disqualify
+        has_text = True
+        byte_class = _classify_utf8_text(text)
+        if byte_class == _BYTE_NOT_NUMBER:
+            return data
+        widest_class = max(widest_class, byte_class)
+
+    if not has_text:
+        # All-empty (and all-null) columns stay text
         return data
 
     # Convert "" => null, so pyarrow cast() won't balk at it.
     sane = pyarrow.chunked_array(
-        [_nix_utf8_chunk_empty_strings(chunk) for chunk in data.iterchunks()]
+        [_nix_utf8_chunk_empty_strings(chunk) for chunk in data.iterchunks()],
+        pyarrow.utf8(),
     )
 
-    for chunk in sane.iterchunks():
-        # pyarrow cast() uses double-conversion, so it parses "NaN" and "Inf"
-        # as doubles. Workbench doesn't support NaN or Inf, so don't convert to
-        # them.
-        if _utf8_chunk_may_contain_inf_or_nan(chunk):
+    numbers = None
+    if widest_class == _BYTE_INTEGER:
+        try:
+            numbers = sane.cast(pyarrow.int64())
+            widest_int = pyarrow.int64()
+        except pyarrow.ArrowInvalid:
+            # Overflow, or a stray "-". Maybe float64 can handle it.
+            pass
+
+    if numbers is None:
+        try:
+            numbers = sane.cast(pyarrow.float64())
+        except pyarrow.ArrowInvalid:
+            # Some string somewhere wasn't a number
             return data
+        # We even downcast float to int. Workbench semantics say a Number is a
+        # Number; so we might as well store it efficiently.
+        widest_int = pyarrow.int32()
 
-    try:
-        numbers = sane.cast(pyarrow.float64())
-    except pyarrow.ArrowInvalid:
-        # Some string somewhere wasn't a number
+    min_max = pyarrow.compute.min_max(numbers).as_py()
+    min_value, max_value = min_max["min"], min_max["max"]
+
+    if numbers.type == pyarrow.float64() and (
+        np.isinf(min_value) or np.isinf(max_value)
+    ):
+        # Numbers too large. Workbench doesn't support Inf.
         return data
 
-    # Test that there's no infinity. We'll use numpy. .to_numpy() with
-    # zero_copy_only=False will convert nulls to NaN. That's fine, since we
-    # know `numbers` has no NaN values (because `cast()` would have raised
-    # rather than return a NaN.)
-    for chunk in numbers.iterchunks():
-        npchunk = chunk.to_numpy(zero_copy_only=False)
-        if np.inf in npchunk or -np.inf in npchunk:
-            # Numbers too large
-            return data
+    int_type = _narrowest_integer_type(min_value, max_value, widest_int)
+    if int_type is None:
+        return numbers
 
-    # Downcast integers, when possible.
-    #
-    # We even downcast float to int. Workbench semantics say a Number is a
-    # Number; so we might as well store it efficiently.
     try:
-        # Shrink as far as we can, until pyarrow complains.
-        #
         # pyarrow will error "Floating point value truncated" if a conversion
         # from float to int would be lossy.
-        #
-        # We'll return the last _successful_ `numbers` result.
-        numbers = numbers.cast(pyarrow.int32())
-        numbers = numbers.cast(pyarrow.int16())
-        numbers = numbers.cast(pyarrow.int8())
+        return numbers.cast(int_type)
     except pyarrow.ArrowInvalid:
-        pass
-
-    return numbers
+        return numbers
 
 
-def _postprocess_autocast_columns(table: pyarrow.Table) -> pyarrow.Table:
-    return pyarrow.table(
-        {
-            name: _autocast_column(column)
-            for name, column in zip(table.column_names, table.columns)
-        }
-    )
+def _postprocess_autocast_columns(
+    table: pyarrow.Table, *, settings: Settings
+) -> pyarrow.Table:
+    return map_columns(table, _autocast_column, settings=settings)
 
 
 def _postprocess_table(
@@ -366,6 +353,7 @@ def _postprocess_table(
     has_header: bool,
     autoconvert_text_to_numbers: bool,
     settings: Settings,
+    report: ParseReport,
 ) -> Tuple[pyarrow.Table, List[I18nMessage]]:
     """
     Transform `raw_table` to meet our standards:
@@ -381,24 +369,336 @@ def _postprocess_table(
       `settings.MAX_DICTIONARY_PYLIST_N_BYTES` and
       `settings.MIN_DICTIONARY_COMPRESSION_RATIO`.
     """
-    table, warnings = _postprocess_name_columns(table, has_header, settings)
+    with report.stage("name_columns"):
+        table, warnings = _postprocess_name_columns(table, has_header, settings)
     if autoconvert_text_to_numbers:
-        table = _postprocess_autocast_columns(table)
-    table = dictionary_encode_columns(table, settings=settings)
+        with report.stage("autocast", n_bytes_in=table.nbytes) as stage:
+            table = _postprocess_autocast_columns(table, settings=settings)
+            stage.n_bytes_out = table.nbytes
+    with report.stage("dictionary_encode", n_bytes_in=table.nbytes) as stage:
+        table = dictionary_encode_columns(table, settings=settings)
+        stage.n_bytes_out = table.nbytes
+    report.record_table(table)
     return table, warnings
 
 
+class CsvDialect(NamedTuple):
+    delimiter: str
+    quotechar: str
+    lineterminator: str
+
+
+_DEFAULT_DIALECT = CsvDialect(",", '"', "\n")
+_DELIMITER_CANDIDATES = [",", "\t", ";"]  # in order of preference
+_QUOTECHAR_CANDIDATES = ['"', "'"]  # in order of preference
+
+
+def detect_dialect(sample: bytes, *, is_prefix: bool = False) -> CsvDialect:
+    """
+    Guess the delimiter, quote character and line terminator of UTF-8 `sample`.
+
+    We pick the delimiter that appears outside of quotes on the most lines --
+    and, in case of a tie, the same number of times on the most lines. All the
+    byte-counting is vectorized, so this takes milliseconds even on a wide
+    sample. When in doubt, CSV.
+
+    If `is_prefix`, `sample` is the start of a larger file: ignore its last,
+    partial line.
+    """
+    data = np.frombuffer(sample, dtype=np.uint8)
+    if len(data) == 0:
+        return _DEFAULT_DIALECT
+
+    is_lf = data == ord("\n")
+    is_cr = data == ord("\r")
+    is_candidate = {c: data == ord(c) for c in _DELIMITER_CANDIDATES}
+
+    # Quote character: the candidate that most often starts a field
+    is_field_start = np.empty(len(data), dtype=bool)
+    is_field_start[0] = True
+    is_field_start[1:] = is_lf[:-1] | is_cr[:-1]
+    for is_delimiter in is_candidate.values():
+        is_field_start[1:] |= is_delimiter[:-1]
+    is_quote = None
+    quotechar = _DEFAULT_DIALECT.quotechar
+    best_n_quoted_fields = 0
+    for c in _QUOTECHAR_CANDIDATES:
+        is_c = data == ord(c)
+        n_quoted_fields = int(np.count_nonzero(is_c & is_field_start))
+        if n_quoted_fields > best_n_quoted_fields:
+            quotechar, is_quote, best_n_quoted_fields = c, is_c, n_quoted_fields
+
+    # Outside quotes: an even number of quote characters came before. (An
+    # escaped quote, `""`, toggles twice.)
+    if is_quote is None:
+        is_outside = np.ones(len(data), dtype=bool)
+    else:
+        is_outside = (np.cumsum(is_quote) & 1) == 0
+        is_outside |= is_quote  # a closing quote is outside
+
+    # Line terminator
+    is_lf &= is_outside
+    is_cr &= is_outside
+    is_crlf = is_cr[:-1] & is_lf[1:]
+    n_crlf = int(np.count_nonzero(is_crlf))
+    n_lf = int(np.count_nonzero(is_lf))
+    n_cr = int(np.count_nonzero(is_cr))
+    if n_crlf and n_crlf * 2 >= n_lf:
+        lineterminator = "\r\n"
+        is_newline = is_lf
+    elif n_cr > n_lf:
+        lineterminator = "\r"
+        is_newline = is_cr
+    else:
+        lineterminator = "\n"
+        is_newline = is_lf
+
+    # Assign each byte a line number, and count each delimiter on each line
+    line_ids = np.cumsum(is_newline) - is_newline  # newline is on its line
+    n_lines = int(line_ids[-1]) + 1
+    is_last_line_partial = is_prefix and not is_newline[-1] and n_lines > 1
+    line_lengths = np.bincount(line_ids, minlength=n_lines)
+    # Ignore empty lines (and the partial line, if any). csv-to-arrow skips
+    # empty lines, too.
+    is_line_used = line_lengths > (
+        np.bincount(line_ids, weights=is_newline | is_cr, minlength=n_lines)
+    )
+    if is_last_line_partial:
+        is_line_used[-1] = False
+    n_lines_used = int(np.count_nonzero(is_line_used))
+    if n_lines_used == 0:
+        return CsvDialect(_DEFAULT_DIALECT.delimiter, quotechar, lineterminator)
+
+    # Score = (n lines the candidate appears on, n lines with its modal count).
+    # Ragged rows are common, so presence matters most; consistency breaks ties.
+    delimiter = _DEFAULT_DIALECT.delimiter
+    best_score = (0, 0)
+    for c in _DELIMITER_CANDIDATES:
+        counts = np.bincount(line_ids[is_candidate[c] & is_outside], minlength=n_lines)[
+            is_line_used
+        ]
+        count_frequencies = np.bincount(counts)
+        count_frequencies[0] = 0  # a delimiter must appear on a line to count
+        score = (
+            int(np.count_nonzero(counts)),
+            int(count_frequencies.max()),
+        )
+        if score > best_score:  # ">": ties go to the preferred candidate
+            delimiter, best_score = c, score
+
+    return CsvDialect(delimiter, quotechar, lineterminator)
+
+
 def detect_delimiter(path: Path, settings: Settings):
-    with path.open("r", encoding="utf-8") as textio:
-        sample = textio.read(settings.SEP_DETECT_CHUNK_SIZE)
+    with path.open("rb") as f:
+        sample = f.read(settings.SEP_DETECT_CHUNK_SIZE + 1)
+
+    return detect_dialect(
+        sample[: settings.SEP_DETECT_CHUNK_SIZE],
+        is_prefix=len(sample) > settings.SEP_DETECT_CHUNK_SIZE,
+    ).delimiter
+
+
+def _csv_to_arrow_args(
+    input_path: str, arrow_path: Path, *, delimiter: str, settings: Settings
+) -> List[str]:
+    return [
+        "/usr/bin/csv-to-arrow",
+        "--delimiter",
+        delimiter,
+        "--max-rows",
+        str(settings.MAX_ROWS_PER_TABLE),
+        "--max-columns",
+        str(settings.MAX_COLUMNS_PER_TABLE),
+        "--max-bytes-per-value",
+        str(settings.MAX_BYTES_PER_VALUE),
+        input_path,
+        arrow_path.as_posix(),
+    ]
+
+
+def _choose_engine(n_bytes: Optional[int], settings: Settings) -> str:
+    """
+    Pick an engine for `n_bytes` of input (`None` meaning, "unknown").
+    """
+    if settings.CSV_ENGINE == "auto":
+        if n_bytes is not None and n_bytes <= settings.CSV_ENGINE_AUTO_MAX_BYTES:
+            return "pyarrow"
+        else:
+            return "csv-to-arrow"
+    elif settings.CSV_ENGINE in ("pyarrow", "csv-to-arrow"):
+        return settings.CSV_ENGINE
+    else:
+        raise ValueError("Invalid settings.CSV_ENGINE: %r" % settings.CSV_ENGINE)
 
-    try:
-        dialect = csv.Sniffer().sniff(sample, ",;\t")
-    except csv.Error:
-        # When in doubt, CSV. (We have no logic to handle an exception.)
-        dialect = csv.excel
 
-    return dialect.delimiter
+def _read_raw_csv_steps(
+    path: Path,
+    *,
+    settings: Settings,
+    encoding: Optional[str],
+    delimiter: Optional[str],
+    cache: Optional[ParseCache],
+    cache_digest: Optional[bytes],
+    report: ParseReport,
+    zip_member: Optional[str] = None,
+) -> ToolSteps[RawCsv]:
+    """
+    Parse CSV into text columns, without postprocessing.
+
+    If `cache` is set, store the result in it, keyed by `cache_digest`.
+
+    If `zip_member` is set, `path` is a ZIP archive: parse that member.
+    """
+    warnings = []
+
+    with contextlib.ExitStack() as ctx:
+        if zip_member is not None or detect_compression(path) is not None:
+            # We won't know the decompressed size until we've decompressed.
+            # utf8_input_context() stops at MAX_CSV_BYTES, and warns.
+            n_bytes = None
+        else:
+            n_bytes = path.stat().st_size
+        if n_bytes is not None and n_bytes > settings.MAX_CSV_BYTES:
+            # We can't simply os.truncate() the input file, because sandboxed code
+            # can't modify input files. utf8_input_context() truncates as it
+            # reads.
+            warnings.append(
+                _trans_cjwparse(
+                    "csv.truncated_file",
+                    "{n_bytes_truncated, one{Truncated # byte} other{Truncated # bytes}} from file (maximum is {max_n_bytes} bytes)",
+                    dict(
+                        n_bytes_truncated=(n_bytes - settings.MAX_CSV_BYTES),
+                        max_n_bytes=settings.MAX_CSV_BYTES,
+                    ),
+                )
+            )
+            n_bytes = settings.MAX_CSV_BYTES
+
+        engine = _choose_engine(n_bytes, settings)
+
+        def open_utf8_input(
+            utf8_warnings: List[I18nMessage], utf8_settings: Settings
+        ) -> Utf8Input:
+            # raises LookupError, UnicodeError
+            return ctx.enter_context(
+                utf8_input_context(
+                    path,
+                    encoding,
+                    settings=utf8_settings,
+                    warnings=utf8_warnings,
+                    n_head_bytes=0 if delimiter else settings.SEP_DETECT_CHUNK_SIZE,
+                    max_n_bytes=settings.MAX_CSV_BYTES,
+                    report=report,
+                    zip_member=zip_member,
+                )
+            )
+
+        utf8_warnings = []
+        if engine == "pyarrow":
+            # pyarrow reads in-process, not from an arrow-tools pipe: it can
+            # always stream the text we'd otherwise copy to a temporary file.
+            utf8_input = open_utf8_input(
+                utf8_warnings,
+                dataclasses.replace(settings, STREAM_TEXT_TO_ARROW_TOOLS=True),
+            )
+        else:
+            utf8_input = open_utf8_input(utf8_warnings, settings)
+
+        # Sniff delimiter
+        if delimiter:
+            detected_delimiter = delimiter
+        else:
+            with report.stage("detect_delimiter"):
+                detected_delimiter = detect_dialect(
+                    utf8_input.head[: settings.SEP_DETECT_CHUNK_SIZE],
+                    is_prefix=len(utf8_input.head) >= settings.SEP_DETECT_CHUNK_SIZE,
+                ).delimiter
+
+        result = None
+        arrow_path = None
+        if engine == "pyarrow":
+            with report.stage("pyarrow.csv", n_bytes_in=n_bytes) as stage:
+                if utf8_input.stdin_chunks is None:
+                    result = csv_to_arrow(
+                        Path(utf8_input.path),
+                        delimiter=detected_delimiter,
+                        settings=settings,
+                    )
+                else:
+                    result = csv_to_arrow_from_chunks(
+                        utf8_input.stdin_chunks,
+                        delimiter=detected_delimiter,
+                        settings=settings,
+                    )
+                if result is not None:
+                    stage.n_bytes_out = result.table.nbytes
+            if result is None and utf8_input.stdin_chunks is not None:
+                # pyarrow consumed the stream. Read again, for csv-to-arrow.
+                # (Forget warnings from the first pass: we'll see them again.)
+                utf8_warnings = []
+                utf8_input = open_utf8_input(utf8_warnings, settings)
+        if result is None:
+            arrow_path = ctx.enter_context(tempfile_context(suffix=".arrow"))
+            args = _csv_to_arrow_args(
+                utf8_input.path,
+                arrow_path,
+                delimiter=detected_delimiter,
+                settings=settings,
+            )
+            with report.stage("csv-to-arrow", n_bytes_in=n_bytes) as stage:
+                # raise subprocess.CalledProcessError on error ... but there is
+                # no error csv-to-arrow will throw that we can recover from.
+                child = yield ToolCall(args, utf8_input.stdin_chunks)
+                report.add_tool_usage("csv-to-arrow", child.usage)
+
+                reader = pyarrow.ipc.open_file(arrow_path.as_posix())
+                result = CsvToArrowResult(
+                    reader.read_all(),  # efficient -- RAM is mmapped
+                    child.stdout.decode("utf-8"),
+                )
+                stage.n_bytes_out = arrow_path.stat().st_size
+
+        warnings.extend(utf8_warnings)
+        warnings.extend(_parse_csv_to_arrow_warnings(result.stdout))
+        raw_csv = RawCsv(
+            result.table, warnings, utf8_input.encoding, detected_delimiter
+        )
+
+        if cache is not None:
+            if arrow_path is None:
+                arrow_path = ctx.enter_context(tempfile_context(suffix=".arrow"))
+                _write_arrow_file(result.table, arrow_path)
+            cache.put_raw_csv(
+                [
+                    cache.raw_csv_key(
+                        cache_digest,
+                        settings=settings,
+                        encoding=encoding,
+                        delimiter=delimiter,
+                        zip_member=zip_member,
+                    ),
+                    # Serve callers who pass what we detected, too
+                    cache.raw_csv_key(
+                        cache_digest,
+                        settings=settings,
+                        encoding=raw_csv.encoding,
+                        delimiter=raw_csv.delimiter,
+                        zip_member=zip_member,
+                    ),
+                ],
+                arrow_path,
+                raw_csv,
+            )
+
+    return raw_csv
+
+
+def _write_arrow_file(table: pyarrow.Table, path: Path) -> None:
+    with pyarrow.ipc.RecordBatchFileWriter(
+        path.as_posix(), schema=table.schema
+    ) as writer:
+        writer.write_table(table)
 
 
 def _parse_csv(
@@ -409,6 +709,8 @@ def _parse_csv(
     delimiter: Optional[str],
     has_header: bool,
     autoconvert_text_to_numbers: bool,
+    cache: Optional[ParseCache] = None,
+    report: Optional[ParseReport] = None,
 ) -> ParseCsvResult:
     """
     Parse CSV, TSV or other delimiter-separated text file.
@@ -420,101 +722,180 @@ def _parse_csv(
 
     The process:
 
-    1. Truncate the file to our maximum size. (WARNING This is destructive!)
-       (TODO if any caller minds the truncation, fix this logic.)
-    2. Convert the file to UTF-8.
+    1. Truncate the file to our maximum size, as we read it.
+    2. Convert the file to UTF-8, if it isn't valid UTF-8 already (or if we
+       truncated it). (With `settings.STREAM_TEXT_TO_ARROW_TOOLS`, stream it to
+       step 4 instead of writing a temporary file.)
     3. Sniff delimiter, if the passed argument is `None`.
-    4. Run `csv-to-arrow` to parse the CSV into unnamed columns.
+    4. Run `csv-to-arrow` to parse the CSV into unnamed columns. (Or, depending
+       on `settings.CSV_ENGINE`, parse in-process with pyarrow.)
     5. Postprocess each column: remove its header if needed and
        dictionary-encode if it's helpful. (This doesn't cost much RAM per
        column: either dictionary encoding makes it small, or it's a zero-copy
        slice of the csv-to-arrow output file.)
     6. Write the final Arrow file.
-    """
-    warnings = []
 
-    with contextlib.ExitStack() as ctx:
-        n_bytes = path.stat().st_size
-        if n_bytes > settings.MAX_CSV_BYTES:
-            # We can't simply os.truncate() the input file, because sandboxed code
-            # can't modify input files.
-            truncated_path = ctx.enter_context(tempfile_context(prefix="truncated-"))
-            with path.open("rb") as src, truncated_path.open("wb") as dest:
-                os.sendfile(dest.fileno(), src.fileno(), 0, settings.MAX_CSV_BYTES)
-            path = truncated_path
-            warnings.append(
-                _trans_cjwparse(
-                    "csv.truncated_file",
-                    "{n_bytes_truncated, one{Truncated # byte} other{Truncated # bytes}} from file (maximum is {max_n_bytes} bytes)",
-                    dict(
-                        n_bytes_truncated=(n_bytes - settings.MAX_CSV_BYTES),
-                        max_n_bytes=settings.MAX_CSV_BYTES,
-                    ),
-                )
-            )
+    If `cache` is set, steps 1-4 happen at most once per input file, encoding,
+    delimiter and limit settings: on a cache hit, we skip to step 5.
 
-        utf8_path = ctx.enter_context(tempfile_context(prefix="utf8-", suffix=".txt"))
-        # raises LookupError, UnicodeError
-        warnings.extend(
-            transcode_to_utf8_and_warn(path, utf8_path, encoding, settings=settings)
+    If `report` is set, record the time and bytes each step took, and the
+    columns we output.
+    """
+    return run_tool_steps(
+        _parse_csv_steps(
+            path,
+            settings=settings,
+            encoding=encoding,
+            delimiter=delimiter,
+            has_header=has_header,
+            autoconvert_text_to_numbers=autoconvert_text_to_numbers,
+            cache=cache,
+            report=(report or ParseReport()),
         )
+    )
 
-        # Sniff delimiter
-        if not delimiter:
-            delimiter = detect_delimiter(utf8_path, settings)
 
-        with tempfile_context(suffix=".arrow") as arrow_path:
-            # raise subprocess.CalledProcessError on error ... but there is no
-            # error csv-to-arrow will throw that we can recover from.
-            child = subprocess.run(
-                [
-                    "/usr/bin/csv-to-arrow",
-                    "--delimiter",
-                    delimiter,
-                    "--max-rows",
-                    str(settings.MAX_ROWS_PER_TABLE),
-                    "--max-columns",
-                    str(settings.MAX_COLUMNS_PER_TABLE),
-                    "--max-bytes-per-value",
-                    str(settings.MAX_BYTES_PER_VALUE),
-                    utf8_path.as_posix(),
-                    arrow_path.as_posix(),
-                ],
-                capture_output=True,
-                check=True,
-            )
-            warnings.extend(_parse_csv_to_arrow_warnings(child.stdout.decode("utf-8")))
+def _parse_csv_steps(
+    path: Path,
+    *,
+    settings: Settings,
+    encoding: Optional[str],
+    delimiter: Optional[str],
+    has_header: bool,
+    autoconvert_text_to_numbers: bool,
+    cache: Optional[ParseCache],
+    report: ParseReport,
+    zip_member: Optional[str] = None,
+    cache_digest: Optional[bytes] = None,
+) -> ToolSteps[ParseCsvResult]:
+    """
+    `_parse_csv()`, as `ToolSteps`.
 
-            reader = pyarrow.ipc.open_file(arrow_path.as_posix())
-            raw_table = reader.read_all()  # efficient -- RAM is mmapped
+    If `cache` is set, pass `cache_digest` if the caller already hashed
+    `path`. Otherwise, we hash it.
+    """
+    raw_csv = None
+    if cache is not None:
+        with report.stage("cache"):
+            if cache_digest is None:
+                cache_digest = cache.file_digest(path)
+            raw_csv = cache.get_raw_csv(
+                cache.raw_csv_key(
+                    cache_digest,
+                    settings=settings,
+                    encoding=encoding,
+                    delimiter=delimiter,
+                    zip_member=zip_member,
+                )
+            )
+    if raw_csv is None:
+        raw_csv = yield from _read_raw_csv_steps(
+            path,
+            settings=settings,
+            encoding=encoding,
+            delimiter=delimiter,
+            cache=cache,
+            cache_digest=cache_digest,
+            report=report,
+            zip_member=zip_member,
+        )
 
     table, more_warnings = _postprocess_table(
-        raw_table, has_header, autoconvert_text_to_numbers, settings
+        raw_csv.table, has_header, autoconvert_text_to_numbers, settings, report
     )
-    return ParseCsvResult(table, warnings + more_warnings)
+    return ParseCsvResult(table, raw_csv.warnings + more_warnings)
 
 
-def parse_csv(
+def _parse_csv_and_write_steps(
     path: Path,
     *,
     output_path: Path,
-    settings: Settings = DEFAULT_SETTINGS,
+    settings: Settings,
     encoding: Optional[str],
     delimiter: Optional[str],
     has_header: bool,
     autoconvert_text_to_numbers: bool,
-) -> List[I18nMessage]:
-    result = _parse_csv(
+    cache: Optional[ParseCache],
+    report: ParseReport,
+    zip_member: Optional[str] = None,
+    cache_digest: Optional[bytes] = None,
+) -> ToolSteps[List[I18nMessage]]:
+    """
+    `parse_csv()`, as `ToolSteps`.
+    """
+    result = yield from _parse_csv_steps(
         path,
-        encoding=encoding,
         settings=settings,
+        encoding=encoding,
         delimiter=delimiter,
         has_header=has_header,
         autoconvert_text_to_numbers=autoconvert_text_to_numbers,
+        cache=cache,
+        report=report,
+        zip_member=zip_member,
+        cache_digest=cache_digest,
     )
-    with pyarrow.ipc.RecordBatchFileWriter(
-        output_path.as_posix(), schema=result.table.schema
-    ) as writer:
-        writer.write_table(result.table)
-
+    with report.stage("write", n_bytes_in=result.table.nbytes) as stage:
+        _write_arrow_file(result.table, output_path)
+        stage.n_bytes_out = output_path.stat().st_size
     return result.warnings
+
+
+def parse_csv(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings = DEFAULT_SETTINGS,
+    encoding: Optional[str],
+    delimiter: Optional[str],
+    has_header: bool,
+    autoconvert_text_to_numbers: bool,
+    cache: Optional[ParseCache] = None,
+    report: Optional[ParseReport] = None,
+) -> List[I18nMessage]:
+    return run_tool_steps(
+        _parse_csv_and_write_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            delimiter=delimiter,
+            has_header=has_header,
+            autoconvert_text_to_numbers=autoconvert_text_to_numbers,
+            cache=cache,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+async def parse_csv_async(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings = DEFAULT_SETTINGS,
+    encoding: Optional[str],
+    delimiter: Optional[str],
+    has_header: bool,
+    autoconvert_text_to_numbers: bool,
+    cache: Optional[ParseCache] = None,
+    report: Optional[ParseReport] = None,
+) -> List[I18nMessage]:
+    """
+    `parse_csv()`, without blocking the event loop.
+
+    The event loop drives `csv-to-arrow`'s pipes and notices when it exits;
+    everything else runs on the event loop's default executor.
+    """
+    return await run_tool_steps_async(
+        _parse_csv_and_write_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            delimiter=delimiter,
+            has_header=has_header,
+            autoconvert_text_to_numbers=autoconvert_text_to_numbers,
+            cache=cache,
+            report=(report or ParseReport()),
+        )
+    )
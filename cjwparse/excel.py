@@ -1,15 +1,33 @@
-import subprocess
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import functools
+import os
+import posixpath
+import re
+import shutil
+import zipfile
 from pathlib import Path
-from typing import List, NamedTuple, Optional, Tuple
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from xml.etree import ElementTree
 
 import pyarrow
 
 from cjwmodule.i18n import I18nMessage
 from cjwmodule.util.colnames import gen_unique_clean_colnames_and_warn
 
-from ._util import tempfile_context
+from ._util import (
+    ToolCall,
+    ToolSteps,
+    run_tool_steps,
+    run_tool_steps_async,
+    tempfile_context,
+)
 from .i18n import _trans_cjwparse
 from .postprocess import dictionary_encode_columns
+from .report import ParseReport
 from .settings import DEFAULT_SETTINGS, Settings
 
 
@@ -19,7 +37,10 @@ class ParseResult(NamedTuple):
 
 
 def _postprocess_table(
-    table: pyarrow.Table, headers_table: Optional[pyarrow.Table], settings: Settings
+    table: pyarrow.Table,
+    headers_table: Optional[pyarrow.Table],
+    settings: Settings,
+    report: ParseReport,
 ) -> Tuple[pyarrow.Table, List[I18nMessage]]:
     """
     Transform `raw_table` to meet our standards:
@@ -29,35 +50,48 @@ def _postprocess_table(
       `settings.MIN_DICTIONARY_COMPRESSION_RATIO`.
     * Rename columns if `headers_table` is provided.
     """
-    table = dictionary_encode_columns(table, settings=settings)
-    if headers_table is not None:
-        colnames = [
-            # filter out None and ""
-            " - ".join(v for v in column.to_pylist() if v)
-            for column in headers_table.itercolumns()
-        ]
-        colnames, warnings = gen_unique_clean_colnames_and_warn(
-            colnames, settings=settings
-        )
-        table = table.rename_columns(colnames)
-    else:
-        warnings = []
+    with report.stage("dictionary_encode", n_bytes_in=table.nbytes) as stage:
+        table = dictionary_encode_columns(table, settings=settings)
+        stage.n_bytes_out = table.nbytes
+    with report.stage("name_columns"):
+        if headers_table is not None:
+            colnames = [
+                # filter out None and ""
+                " - ".join(v for v in column.to_pylist() if v)
+                for column in headers_table.itercolumns()
+            ]
+            colnames, warnings = gen_unique_clean_colnames_and_warn(
+                colnames, settings=settings
+            )
+            table = table.rename_columns(colnames)
+        else:
+            warnings = []
+    report.record_table(table)
     return table, warnings
 
 
+def _invalid_file_warning(message: str) -> I18nMessage:
+    return _trans_cjwparse(
+        "excel.invalid_file",
+        "This Excel file is invalid. Open it in Microsoft Office and re-save it to correct errors. (Debugging message: “{message}”)",
+        {"message": message},
+    )
+
+
 def _stderr_line_to_error(line: str) -> I18nMessage:
     if line.startswith("Invalid XLSX file: "):
-        return _trans_cjwparse(
-            "excel.invalid_file",
-            "This Excel file is invalid. Open it in Microsoft Office and re-save it to correct errors. (Debugging message: “{message}”)",
-            {"message": line[len("Invalid XLSX file: ") :]},
-        )
+        return _invalid_file_warning(line[len("Invalid XLSX file: ") :])
     else:
         return I18nMessage("TODO_i18n", {"text": line}, None)
 
 
 def _parse_excel(
-    tool: str, path: Path, *, header_rows: str, settings: Settings = DEFAULT_SETTINGS
+    tool: str,
+    path: Path,
+    *,
+    header_rows: str,
+    settings: Settings = DEFAULT_SETTINGS,
+    report: Optional[ParseReport] = None,
 ) -> ParseResult:
     """
     Parse Excel .xlsx or .xls file.
@@ -67,49 +101,70 @@ def _parse_excel(
     1. Run `/usr/bin/{tool}` (`xlsx-to-arrow`, say) to parse cells into columns.
     2. Dictionary-encode each column if it's helpful.
     3. Write the final Arrow file.
+
+    If `report` is set, record the time and bytes each step took, and the
+    columns we output.
+    """
+    return run_tool_steps(
+        _parse_excel_steps(
+            tool,
+            path,
+            header_rows=header_rows,
+            settings=settings,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+def _parse_excel_steps(
+    tool: str, path: Path, *, header_rows: str, settings: Settings, report: ParseReport
+) -> ToolSteps[ParseResult]:
+    """
+    `_parse_excel()`, as `ToolSteps`.
     """
     with tempfile_context(suffix=".arrow") as arrow_path, tempfile_context(
         suffix="-headers.arrow"
     ) as header_rows_path:
-        # raise subprocess.CalledProcessError on error ... but there is no
-        # error xls-to-arrow will throw that we can recover from.
-        child = subprocess.run(
-            [
-                "/usr/bin/" + tool,
-                "--max-rows",
-                str(settings.MAX_ROWS_PER_TABLE),
-                "--max-columns",
-                str(settings.MAX_COLUMNS_PER_TABLE),
-                "--max-bytes-per-value",
-                str(settings.MAX_BYTES_PER_VALUE),
-                "--max-bytes-total",
-                str(settings.MAX_BYTES_TEXT_DATA),
-                "--header-rows",
-                header_rows,
-                "--header-rows-file",
-                header_rows_path.as_posix(),
-                path.as_posix(),
-                arrow_path.as_posix(),
-            ],
-            capture_output=True,
-            check=True,
-        )
-        parse_warnings = [
-            _stderr_line_to_error(line)
-            for line in child.stdout.decode("utf-8").split("\n")
-            if line
-        ]
+        with report.stage(tool, n_bytes_in=path.stat().st_size) as stage:
+            # raise subprocess.CalledProcessError on error ... but there is no
+            # error xls-to-arrow will throw that we can recover from.
+            child = yield ToolCall(
+                [
+                    "/usr/bin/" + tool,
+                    "--max-rows",
+                    str(settings.MAX_ROWS_PER_TABLE),
+                    "--max-columns",
+                    str(settings.MAX_COLUMNS_PER_TABLE),
+                    "--max-bytes-per-value",
+                    str(settings.MAX_BYTES_PER_VALUE),
+                    "--max-bytes-total",
+                    str(settings.MAX_BYTES_TEXT_DATA),
+                    "--header-rows",
+                    header_rows,
+                    "--header-rows-file",
+                    header_rows_path.as_posix(),
+                    path.as_posix(),
+                    arrow_path.as_posix(),
+                ]
+            )
+            report.add_tool_usage(tool, child.usage)
+            parse_warnings = [
+                _stderr_line_to_error(line)
+                for line in child.stdout.decode("utf-8").split("\n")
+                if line
+            ]
 
-        with pyarrow.ipc.open_file(arrow_path.as_posix()) as reader:
-            raw_table = reader.read_all()  # efficient -- RAM is mmapped
-        if header_rows:
-            with pyarrow.ipc.open_file(header_rows_path.as_posix()) as reader:
-                maybe_headers_table = reader.read_all()
-        else:
-            maybe_headers_table = None
+            with pyarrow.ipc.open_file(arrow_path.as_posix()) as reader:
+                raw_table = reader.read_all()  # efficient -- RAM is mmapped
+            if header_rows:
+                with pyarrow.ipc.open_file(header_rows_path.as_posix()) as reader:
+                    maybe_headers_table = reader.read_all()
+            else:
+                maybe_headers_table = None
+            stage.n_bytes_out = arrow_path.stat().st_size
 
     table, colname_warnings = _postprocess_table(
-        raw_table, maybe_headers_table, settings
+        raw_table, maybe_headers_table, settings, report
     )
     return ParseResult(table, (parse_warnings + colname_warnings))
 
@@ -121,18 +176,25 @@ def _write_table(table: pyarrow.Table, output_path: Path) -> None:
         writer.write_table(table)
 
 
-def _parse_excel_and_write_result(
+def _parse_excel_and_write_steps(
     *,
     tool: str,
     path: Path,
     output_path: Path,
     has_header: bool,
-    settings: Settings = DEFAULT_SETTINGS
-) -> List[I18nMessage]:
-    table, warnings = _parse_excel(
-        tool, path, header_rows=("0-1" if has_header else ""), settings=settings
+    settings: Settings,
+    report: ParseReport,
+) -> ToolSteps[List[I18nMessage]]:
+    table, warnings = yield from _parse_excel_steps(
+        tool,
+        path,
+        header_rows=("0-1" if has_header else ""),
+        settings=settings,
+        report=report,
     )
-    _write_table(table, output_path)
+    with report.stage("write", n_bytes_in=table.nbytes) as stage:
+        _write_table(table, output_path)
+        stage.n_bytes_out = output_path.stat().st_size
     return warnings
 
 
@@ -141,14 +203,38 @@ def parse_xlsx(
     *,
     output_path: Path,
     settings: Settings = DEFAULT_SETTINGS,
-    has_header: bool
+    has_header: bool,
+    report: Optional[ParseReport] = None,
 ) -> List[I18nMessage]:
-    return _parse_excel_and_write_result(
-        tool="xlsx-to-arrow",
-        path=path,
-        output_path=output_path,
-        settings=settings,
-        has_header=has_header,
+    return run_tool_steps(
+        _parse_excel_and_write_steps(
+            tool="xlsx-to-arrow",
+            path=path,
+            output_path=output_path,
+            settings=settings,
+            has_header=has_header,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+async def parse_xlsx_async(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings = DEFAULT_SETTINGS,
+    has_header: bool,
+    report: Optional[ParseReport] = None,
+) -> List[I18nMessage]:
+    return await run_tool_steps_async(
+        _parse_excel_and_write_steps(
+            tool="xlsx-to-arrow",
+            path=path,
+            output_path=output_path,
+            settings=settings,
+            has_header=has_header,
+            report=(report or ParseReport()),
+        )
     )
 
 
@@ -157,12 +243,656 @@ def parse_xls(
     *,
     output_path: Path,
     settings: Settings = DEFAULT_SETTINGS,
-    has_header: bool
+    has_header: bool,
+    report: Optional[ParseReport] = None,
 ) -> List[I18nMessage]:
-    return _parse_excel_and_write_result(
-        tool="xls-to-arrow",
-        path=path,
-        output_path=output_path,
-        settings=settings,
-        has_header=has_header,
+    return run_tool_steps(
+        _parse_excel_and_write_steps(
+            tool="xls-to-arrow",
+            path=path,
+            output_path=output_path,
+            settings=settings,
+            has_header=has_header,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+async def parse_xls_async(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings = DEFAULT_SETTINGS,
+    has_header: bool,
+    report: Optional[ParseReport] = None,
+) -> List[I18nMessage]:
+    return await run_tool_steps_async(
+        _parse_excel_and_write_steps(
+            tool="xls-to-arrow",
+            path=path,
+            output_path=output_path,
+            settings=settings,
+            has_header=has_header,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+_XLSX_PROBE_N_BYTES = 64 * 1024
+"""
+Number of (decompressed) bytes `probe_xlsx()` reads from each sheet.
+"""
+
+_RELATIONSHIP_TYPE_SUFFIXES = ("/officeDocument", "/worksheet", "/sharedStrings")
+_DIMENSION_REF = re.compile(
+    rb"<(?:\w+:)?dimension\b[^>]*?\bref=\"([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?\""
+)
+_ROW_START = re.compile(rb"<(?:\w+:)?row[\s>/]")
+_CELL_START = re.compile(rb"<(?:\w+:)?c[\s>/]")
+_SST_COUNT = re.compile(rb"<(?:\w+:)?sst\b[^>]*?\buniqueCount=\"(\d+)\"")
+_XML_DTD = re.compile(r"<!(?:DOCTYPE|ENTITY)\b")
+
+
+class XlsxSheetProbe(NamedTuple):
+    name: str
+
+    is_hidden: bool
+
+    n_rows: Optional[int]
+    """
+    Estimated number of rows, or `None` if we can't tell.
+
+    This comes from the sheet's `<dimension ref>` if it has one; otherwise, we
+    count the rows in the sheet's first bytes and extrapolate by size.
+    """
+
+    n_columns: Optional[int]
+    """
+    Estimated number of columns, or `None` if we can't tell.
+    """
+
+    n_bytes: int
+    """
+    Size of the sheet's XML, decompressed (according to the ZIP directory).
+    """
+
+
+class XlsxProbe(NamedTuple):
+    sheets: List[XlsxSheetProbe]
+
+    n_shared_strings: Optional[int]
+    """
+    Number of unique shared strings, if the workbook says.
+    """
+
+    shared_strings_n_bytes: int
+    """
+    Size of the shared-string table's XML, decompressed: xlsx-to-arrow reads
+    all of it before the first cell.
+    """
+
+    warnings: List[I18nMessage]
+
+
+def _xml_local_name(name: str) -> str:
+    return name.rpartition("}")[2]
+
+
+def _parse_xml(data: bytes) -> ElementTree.Element:
+    """
+    Parse an XLSX part from an untrusted file.
+
+    OOXML parts never declare a DTD. One that does may define nested entities
+    that expand exponentially ("billion laughs"), so we refuse it.
+
+    Raise ElementTree.ParseError on invalid XML or a DTD.
+    """
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        text = data.decode("utf-16", errors="replace")
+    else:
+        text = data.decode("utf-8", errors="replace")
+    if _XML_DTD.search(text):
+        raise ElementTree.ParseError("XML declares a DTD, which XLSX forbids")
+    return ElementTree.fromstring(data)
+
+
+def _read_relationships(
+    zf: zipfile.ZipFile, rels_path: str
+) -> Dict[str, Tuple[str, str]]:
+    """
+    Map relationship ID to (type-suffix, target path) in `rels_path`.
+
+    We only keep types in `_RELATIONSHIP_TYPE_SUFFIXES`. Targets are relative
+    to the rels file's part, as the spec says.
+    """
+    base = posixpath.dirname(posixpath.dirname(rels_path))  # drop "_rels/"
+    try:
+        root = _parse_xml(zf.read(rels_path))
+    except KeyError:
+        return {}
+    relationships = {}
+    for element in root:
+        rel_type = element.get("Type", "")
+        rel_type_suffix = rel_type[rel_type.rfind("/") :]
+        if rel_type_suffix not in _RELATIONSHIP_TYPE_SUFFIXES:
+            continue
+        target = element.get("Target", "")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(base, target))
+        relationships[element.get("Id")] = (rel_type_suffix, target)
+    return relationships
+
+
+def _column_number(letters: bytes) -> int:
+    number = 0
+    for letter in letters:
+        number = number * 26 + letter - ord("A") + 1
+    return number
+
+
+def _probe_sheet_dimensions(
+    head: bytes, n_bytes: int
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Estimate (n_rows, n_columns) from the first bytes of a sheet's XML.
+    """
+    row_starts = [match.start() for match in _ROW_START.finditer(head)]
+
+    match = _DIMENSION_REF.search(head)
+    # Some writers emit ref="A1" for every sheet. Only trust a one-cell
+    # dimension if the sheet has at most one row.
+    if match is not None and (match.group(3) is not None or len(row_starts) <= 1):
+        if match.group(3) is None:
+            return 1, 1
+        first_column, first_row, last_column, last_row = match.groups()
+        return (
+            int(last_row) - int(first_row) + 1,
+            _column_number(last_column) - _column_number(first_column) + 1,
+        )
+
+    if not row_starts:
+        return (0, 0) if len(head) == n_bytes else (None, None)
+
+    if len(head) == n_bytes:
+        # We read the whole sheet
+        row_ends = row_starts[1:] + [len(head)]
+        n_rows = len(row_starts)
+    elif len(row_starts) > 1:
+        # The last row may be cut off: measure whole rows, and extrapolate
+        row_ends = row_starts[1:]
+        n_bytes_per_row = (row_starts[-1] - row_starts[0]) / len(row_ends)
+        n_rows = round((n_bytes - row_starts[0]) / n_bytes_per_row)
+    else:
+        # One huge row (or the start of one)
+        row_ends = [len(head)]
+        n_rows = round((n_bytes - row_starts[0]) / (len(head) - row_starts[0]))
+    n_columns = max(
+        len(_CELL_START.findall(head, start, end))
+        for start, end in zip(row_starts, row_ends)
     )
+    return n_rows, n_columns
+
+
+class _XlsxSheet(NamedTuple):
+    name: str
+    is_hidden: bool
+    position: int
+    """
+    Index among the workbook's `<sheet>` elements (which include chart sheets).
+    """
+    rel_id: str
+    part: str
+    """
+    ZIP member holding the worksheet XML.
+    """
+
+
+class _XlsxWorkbook(NamedTuple):
+    part: str
+    rels_part: str
+    sheets: List[_XlsxSheet]
+    """
+    Worksheets (not chart sheets), in workbook order.
+    """
+    shared_strings_part: Optional[str]
+
+
+def _read_xlsx_workbook(zf: zipfile.ZipFile) -> _XlsxWorkbook:
+    """
+    Find the worksheets and shared strings in an XLSX file.
+
+    Raise KeyError or ElementTree.ParseError on an invalid file.
+    """
+    package = _read_relationships(zf, "_rels/.rels")
+    part = next(
+        (
+            target
+            for rel_type, target in package.values()
+            if rel_type == "/officeDocument"
+        ),
+        "xl/workbook.xml",
+    )
+    part_dir, part_name = posixpath.split(part)
+    rels_part = posixpath.join(part_dir, "_rels", part_name + ".rels")
+    relationships = _read_relationships(zf, rels_part)
+    workbook = _parse_xml(zf.read(part))
+
+    sheets = []
+    sheet_elements = (
+        element
+        for element in workbook.iter()
+        if _xml_local_name(element.tag) == "sheet"
+    )
+    for position, element in enumerate(sheet_elements):
+        rel_id = next((v for k, v in element.attrib.items() if k.endswith("}id")), None)
+        rel_type, target = relationships.get(rel_id, (None, None))
+        if rel_type != "/worksheet":
+            continue  # a chart sheet, say
+        sheets.append(
+            _XlsxSheet(
+                element.get("name", ""),
+                element.get("state", "visible") != "visible",
+                position,
+                rel_id,
+                target,
+            )
+        )
+
+    shared_strings_part = next(
+        (
+            target
+            for rel_type, target in relationships.values()
+            if rel_type == "/sharedStrings" and target in zf.NameToInfo
+        ),
+        None,
+    )
+    return _XlsxWorkbook(part, rels_part, sheets, shared_strings_part)
+
+
+def probe_xlsx(path: Path) -> XlsxProbe:
+    """
+    List the sheets in `path` and estimate their sizes, without parsing cells.
+
+    We read the workbook and relationship parts, the first
+    `_XLSX_PROBE_N_BYTES` of each sheet and the start of the shared-string
+    table -- so this takes milliseconds, even on huge workbooks.
+
+    If `path` is not a valid XLSX file, return no sheets and a warning.
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            workbook = _read_xlsx_workbook(zf)
+
+            sheets = []
+            for sheet in workbook.sheets:
+                info = zf.getinfo(sheet.part)
+                with zf.open(info) as f:
+                    head = f.read(_XLSX_PROBE_N_BYTES)
+                n_rows, n_columns = _probe_sheet_dimensions(head, info.file_size)
+                sheets.append(
+                    XlsxSheetProbe(
+                        sheet.name, sheet.is_hidden, n_rows, n_columns, info.file_size
+                    )
+                )
+
+            n_shared_strings = None
+            shared_strings_n_bytes = 0
+            if workbook.shared_strings_part is not None:
+                info = zf.getinfo(workbook.shared_strings_part)
+                shared_strings_n_bytes = info.file_size
+                with zf.open(info) as f:
+                    match = _SST_COUNT.search(f.read(1024))
+                if match is not None:
+                    n_shared_strings = int(match.group(1))
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as err:
+        return XlsxProbe([], None, 0, [_invalid_file_warning(str(err))])
+
+    return XlsxProbe(sheets, n_shared_strings, shared_strings_n_bytes, [])
+
+
+_SHEETS_BLOCK = re.compile(
+    rb"(<(?:\w+:)?sheets\b[^>]*>)(.*?)(</(?:\w+:)?sheets>)", re.DOTALL
+)
+_SHEET_ELEMENT = re.compile(rb"<(?:\w+:)?sheet\b[^>]*?/>")
+_DEFINED_NAMES = re.compile(
+    rb"<(?:\w+:)?definedNames\b[^>]*?(?:/>|>.*?</(?:\w+:)?definedNames>)", re.DOTALL
+)
+_RELATIONSHIP_ELEMENT = re.compile(
+    rb"<(?:\w+:)?Relationship\b[^>]*?\bId=\"([^\"]*)\"[^>]*?/>"
+)
+_OVERRIDE_ELEMENT = re.compile(
+    rb"<(?:\w+:)?Override\b[^>]*?\bPartName=\"/([^\"]*)\"[^>]*?/>"
+)
+
+
+def _write_single_sheet_xlsx(
+    zf: zipfile.ZipFile,
+    workbook: _XlsxWorkbook,
+    sheet: _XlsxSheet,
+    dest: Path,
+    *,
+    shared_strings_path: Optional[Path],
+) -> None:
+    """
+    Write a copy of `zf` to `dest`, with `sheet` as its only sheet.
+
+    xlsx-to-arrow converts a workbook's first sheet. We drop the other
+    worksheets' parts, `<sheet>` elements, relationships and content types,
+    plus all `<definedNames>` (which may refer to dropped sheets by index).
+    Everything else is byte-for-byte the same, uncompressed: xlsx-to-arrow
+    would only decompress it again.
+
+    If `shared_strings_path` is set, it holds the shared-string table,
+    already decompressed.
+    """
+    dropped = [other for other in workbook.sheets if other != sheet]
+    dropped_parts = set(other.part for other in dropped)
+    dropped_rel_ids = set(other.rel_id.encode("utf-8") for other in dropped)
+
+    def rewrite_workbook(xml: bytes) -> bytes:
+        def keep_one_sheet(match):
+            elements = _SHEET_ELEMENT.findall(match.group(2))
+            return match.group(1) + elements[sheet.position] + match.group(3)
+
+        return _DEFINED_NAMES.sub(b"", _SHEETS_BLOCK.sub(keep_one_sheet, xml, 1))
+
+    def rewrite_rels(xml: bytes) -> bytes:
+        return _RELATIONSHIP_ELEMENT.sub(
+            lambda m: b"" if m.group(1) in dropped_rel_ids else m.group(0), xml
+        )
+
+    def rewrite_content_types(xml: bytes) -> bytes:
+        return _OVERRIDE_ELEMENT.sub(
+            lambda m: b""
+            if m.group(1).decode("utf-8") in dropped_parts
+            else m.group(0),
+            xml,
+        )
+
+    rewrites = {
+        workbook.part: rewrite_workbook,
+        workbook.rels_part: rewrite_rels,
+        "[Content_Types].xml": rewrite_content_types,
+    }
+
+    with zipfile.ZipFile(dest, "w", zipfile.ZIP_STORED) as out:
+        for info in zf.infolist():
+            if info.filename in dropped_parts:
+                continue
+            elif info.filename in rewrites:
+                out.writestr(info.filename, rewrites[info.filename](zf.read(info)))
+            elif (
+                info.filename == workbook.shared_strings_part
+                and shared_strings_path is not None
+            ):
+                out.write(shared_strings_path, info.filename)
+            else:
+                with zf.open(info) as src_f, out.open(
+                    info.filename, "w", force_zip64=True
+                ) as dest_f:
+                    shutil.copyfileobj(src_f, dest_f)
+
+
+def _sheet_not_found_warning(sheet_index: int) -> I18nMessage:
+    return _trans_cjwparse(
+        "excel.sheet_not_found",
+        "There is no sheet {sheet_number} in this workbook.",
+        {"sheet_number": sheet_index + 1},
+    )
+
+
+class ParseSheetResult(NamedTuple):
+    """
+    Outcome of parsing one sheet, in `parse_xlsx_sheets()`.
+    """
+
+    warnings: List[I18nMessage]
+    """
+    What parsing the sheet returned -- or `[]` if it raised `error`.
+    """
+
+    error: Optional[Exception]
+    """
+    What parsing the sheet raised (such as `subprocess.CalledProcessError`),
+    or `None` if it succeeded.
+    """
+
+    report: ParseReport
+    """
+    Time and bytes this sheet's parse took, and the columns it output.
+    """
+
+
+class _SheetJob(NamedTuple):
+    sheet_index: int
+    output_path: Path
+    memory: int
+    run: Callable[[ParseReport], List[I18nMessage]]
+
+
+def _run_sheet_jobs(
+    jobs: List[_SheetJob], *, max_workers: int, max_memory: Optional[int]
+) -> Dict[int, ParseSheetResult]:
+    """
+    Run `jobs` on threads, as `parse_files()` runs its jobs on processes.
+
+    Each job waits on an Excel program, which doesn't hold the GIL. Each gets
+    its own `ParseReport`; a job that raises doesn't affect the others.
+    """
+    results = {}
+    pending = collections.deque(jobs)
+    running: Dict[concurrent.futures.Future, Tuple[_SheetJob, ParseReport]] = {}
+    memory_in_use = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                job = pending[0]
+                if (
+                    running
+                    and max_memory is not None
+                    and memory_in_use + job.memory > max_memory
+                ):
+                    break  # wait for memory to free up
+                pending.popleft()
+                report = ParseReport()
+                running[executor.submit(job.run, report)] = (job, report)
+                memory_in_use += job.memory
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                job, report = running.pop(future)
+                memory_in_use -= job.memory
+                error = future.exception()
+                results[job.sheet_index] = ParseSheetResult(
+                    [] if error is not None else future.result(), error, report
+                )
+    return results
+
+
+def _write_empty_output(output_path: Path, warnings: List[I18nMessage]):
+    def run(report: ParseReport) -> List[I18nMessage]:
+        output_path.write_bytes(b"")
+        return warnings
+
+    return run
+
+
+def _parse_sheets_settings(settings: Settings, max_workers: int) -> Settings:
+    return dataclasses.replace(
+        settings,
+        POSTPROCESS_N_THREADS=max(1, settings.POSTPROCESS_N_THREADS // max_workers),
+    )
+
+
+def parse_xlsx_sheets(
+    path: Path,
+    *,
+    sheets: Dict[int, Path],
+    settings: Settings = DEFAULT_SETTINGS,
+    has_header: bool,
+    max_workers: Optional[int] = None,
+    max_memory: Optional[int] = None,
+    report: Optional[ParseReport] = None,
+) -> Dict[int, ParseSheetResult]:
+    """
+    Parse several sheets of an .xlsx file at once.
+
+    `sheets` maps sheet index (in `probe_xlsx(path).sheets`) to output path.
+    Return each sheet's `ParseSheetResult`, by sheet index. A missing sheet
+    gets an empty output file and a warning. A sheet whose parse raises gets
+    the error in its result; the other sheets are unaffected.
+
+    Run at most `max_workers` xlsx-to-arrow programs at a time (default: one
+    per CPU). If `max_memory` is set, don't start a sheet while the ones in
+    progress are estimated to need more than `max_memory` bytes of RAM in all
+    (estimating from their XML and the shared strings, decompressed).
+
+    xlsx-to-arrow only reads a workbook's first sheet, so for every other
+    sheet we write a one-sheet copy of the workbook (see
+    `_write_single_sheet_xlsx()`). We decompress the shared-string table
+    once, for all copies.
+
+    Each sheet's result has its own report. If `report` is set, record the
+    stages we run once for the whole workbook in it.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if report is None:
+        report = ParseReport()
+    tool_settings = _parse_sheets_settings(settings, max_workers)
+
+    def parse(
+        xlsx_path: Path, output_path: Path, report: ParseReport
+    ) -> List[I18nMessage]:
+        return run_tool_steps(
+            _parse_excel_and_write_steps(
+                tool="xlsx-to-arrow",
+                path=xlsx_path,
+                output_path=output_path,
+                settings=tool_settings,
+                has_header=has_header,
+                report=report,
+            )
+        )
+
+    with report.stage("probe_xlsx"):
+        probe = probe_xlsx(path)
+
+    if probe.warnings:
+        # We can't read the workbook, but xlsx-to-arrow may repair it: let it
+        # try the first sheet.
+        jobs = [
+            _SheetJob(
+                index,
+                output_path,
+                0,
+                (
+                    functools.partial(parse, path, output_path)
+                    if index == 0
+                    else _write_empty_output(output_path, probe.warnings)
+                ),
+            )
+            for index, output_path in sheets.items()
+        ]
+        return _run_sheet_jobs(jobs, max_workers=max_workers, max_memory=max_memory)
+
+    with contextlib.ExitStack() as ctx:
+        zf = ctx.enter_context(zipfile.ZipFile(path))
+        workbook = _read_xlsx_workbook(zf)
+
+        shared_strings_path = None
+        if workbook.shared_strings_part is not None and any(
+            0 <= index < len(workbook.sheets) and workbook.sheets[index].position > 0
+            for index in sheets
+        ):
+            with report.stage("decompress_shared_strings"):
+                shared_strings_path = ctx.enter_context(tempfile_context(suffix=".xml"))
+                with zf.open(workbook.shared_strings_part) as src_f:
+                    with shared_strings_path.open("wb") as dest_f:
+                        shutil.copyfileobj(src_f, dest_f)
+
+        def parse_sheet(
+            sheet: _XlsxSheet, output_path: Path, report: ParseReport
+        ) -> List[I18nMessage]:
+            if sheet.position == 0:
+                # xlsx-to-arrow's favorite sheet
+                return parse(path, output_path, report)
+            with tempfile_context(suffix=".xlsx") as sheet_path:
+                # Our own ZipFile: threads would fight over one's file position
+                with report.stage("write_single_sheet_xlsx"), zipfile.ZipFile(
+                    path
+                ) as sheet_zf:
+                    _write_single_sheet_xlsx(
+                        sheet_zf,
+                        workbook,
+                        sheet,
+                        sheet_path,
+                        shared_strings_path=shared_strings_path,
+                    )
+                return parse(sheet_path, output_path, report)
+
+        jobs = []
+        for index, output_path in sheets.items():
+            if 0 <= index < len(workbook.sheets):
+                sheet = workbook.sheets[index]
+                memory = probe.sheets[index].n_bytes + probe.shared_strings_n_bytes
+                run = functools.partial(parse_sheet, sheet, output_path)
+            else:
+                memory = 0
+                run = _write_empty_output(
+                    output_path, [_sheet_not_found_warning(index)]
+                )
+            jobs.append(_SheetJob(index, output_path, memory, run))
+        return _run_sheet_jobs(jobs, max_workers=max_workers, max_memory=max_memory)
+
+
+def parse_xls_sheets(
+    path: Path,
+    *,
+    sheets: Dict[int, Path],
+    settings: Settings = DEFAULT_SETTINGS,
+    has_header: bool,
+) -> Dict[int, ParseSheetResult]:
+    """
+    `parse_xlsx_sheets()`, for .xls files.
+
+    xls-to-arrow only reads an .xls file's first sheet, and we can't rewrite
+    .xls files: every other sheet gets an empty output file and a warning.
+    """
+
+    def parse(output_path: Path, report: ParseReport) -> List[I18nMessage]:
+        return parse_xls(
+            path,
+            output_path=output_path,
+            settings=settings,
+            has_header=has_header,
+            report=report,
+        )
+
+    jobs = [
+        _SheetJob(
+            index,
+            output_path,
+            0,
+            (
+                functools.partial(parse, output_path)
+                if index == 0
+                else _write_empty_output(
+                    output_path,
+                    [
+                        _trans_cjwparse(
+                            "excel.xls_sheet_unsupported",
+                            "We can only read the first sheet of an .xls file. To read sheet {sheet_number}, save the file as .xlsx and try again.",
+                            {"sheet_number": index + 1},
+                        )
+                    ],
+                )
+            ),
+        )
+        for index, output_path in sheets.items()
+    ]
+    return _run_sheet_jobs(jobs, max_workers=1, max_memory=None)
@@ -1,4 +1,4 @@
-import subprocess
+import contextlib
 from pathlib import Path
 from typing import List, NamedTuple, Optional
 
@@ -6,13 +6,22 @@ import pyarrow
 
 from cjwmodule.i18n import I18nMessage
 
-from ._util import tempfile_context
+from ._util import (
+    ToolCall,
+    ToolSteps,
+    run_tool_steps,
+    run_tool_steps_async,
+    tempfile_context,
+)
 from .postprocess import dictionary_encode_columns
+from .report import ParseReport
 from .settings import DEFAULT_SETTINGS, Settings
-from .text import transcode_to_utf8_and_warn
+from .text import utf8_input_context
 
 
-def _postprocess_table(table: pyarrow.Table, settings: Settings) -> pyarrow.Table:
+def _postprocess_table(
+    table: pyarrow.Table, settings: Settings, report: ParseReport
+) -> pyarrow.Table:
     """
     Transform `raw_table` to meet our standards:
 
@@ -20,17 +29,44 @@ def _postprocess_table(table: pyarrow.Table, settings: Settings) -> pyarrow.Tabl
       `settings.MAX_DICTIONARY_SIZE` and
       `settings.MIN_DICTIONARY_COMPRESSION_RATIO`.
     """
-    table = dictionary_encode_columns(table, settings=settings)
+    with report.stage("dictionary_encode", n_bytes_in=table.nbytes) as stage:
+        table = dictionary_encode_columns(table, settings=settings)
+        stage.n_bytes_out = table.nbytes
+    report.record_table(table)
     return table
 
 
+def _json_to_arrow_args(
+    input_path: str, arrow_path: Path, *, settings: Settings
+) -> List[str]:
+    return [
+        "/usr/bin/json-to-arrow",
+        "--max-rows",
+        str(settings.MAX_ROWS_PER_TABLE),
+        "--max-columns",
+        str(settings.MAX_COLUMNS_PER_TABLE),
+        "--max-bytes-per-value",
+        str(settings.MAX_BYTES_PER_VALUE),
+        "--max-bytes-total",
+        str(settings.MAX_BYTES_TEXT_DATA),
+        "--max-bytes-per-column-name",
+        str(settings.MAX_BYTES_PER_COLUMN_NAME),
+        input_path,
+        arrow_path.as_posix(),
+    ]
+
+
 class ParseJsonResult(NamedTuple):
     table: pyarrow.Table
     warnings: List[I18nMessage]
 
 
 def _parse_json(
-    path: Path, *, settings: Settings = DEFAULT_SETTINGS, encoding: Optional[str]
+    path: Path,
+    *,
+    settings: Settings = DEFAULT_SETTINGS,
+    encoding: Optional[str],
+    report: Optional[ParseReport] = None,
 ) -> ParseJsonResult:
     """
     Parse JSON text file.
@@ -42,41 +78,60 @@ def _parse_json(
 
     The process:
 
-    1. Convert the file to UTF-8.
+    1. Convert the file to UTF-8, if it isn't valid UTF-8 already. (With
+       `settings.STREAM_TEXT_TO_ARROW_TOOLS`, stream it to step 2 instead of
+       writing a temporary file.)
     2. Run `json-to-arrow` to parse the JSON into columns.
     3. Dictionary-encode each column if it's helpful.
     4. Write the final Arrow file.
+
+    If `report` is set, record the time and bytes each step took, and the
+    columns we output.
+    """
+    return run_tool_steps(
+        _parse_json_steps(
+            path,
+            settings=settings,
+            encoding=encoding,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+def _parse_json_steps(
+    path: Path,
+    *,
+    settings: Settings,
+    encoding: Optional[str],
+    report: ParseReport,
+    zip_member: Optional[str] = None,
+) -> ToolSteps[ParseJsonResult]:
+    """
+    `_parse_json()`, as `ToolSteps`.
     """
     warnings = []
 
-    with tempfile_context(prefix="utf8-", suffix=".txt") as utf8_path:
+    with contextlib.ExitStack() as ctx:
         # raises LookupError, UnicodeError
-        warnings.extend(
-            transcode_to_utf8_and_warn(path, utf8_path, encoding, settings=settings)
+        utf8_input = ctx.enter_context(
+            utf8_input_context(
+                path,
+                encoding,
+                settings=settings,
+                warnings=warnings,
+                n_head_bytes=0,
+                report=report,
+                zip_member=zip_member,
+            )
         )
 
-        with tempfile_context(suffix=".arrow") as arrow_path:
+        arrow_path = ctx.enter_context(tempfile_context(suffix=".arrow"))
+        args = _json_to_arrow_args(utf8_input.path, arrow_path, settings=settings)
+        with report.stage("json-to-arrow") as stage:
             # raise subprocess.CalledProcessError on error ... but there is no
             # error json-to-arrow will throw that we can recover from.
-            child = subprocess.run(
-                [
-                    "/usr/bin/json-to-arrow",
-                    "--max-rows",
-                    str(settings.MAX_ROWS_PER_TABLE),
-                    "--max-columns",
-                    str(settings.MAX_COLUMNS_PER_TABLE),
-                    "--max-bytes-per-value",
-                    str(settings.MAX_BYTES_PER_VALUE),
-                    "--max-bytes-total",
-                    str(settings.MAX_BYTES_TEXT_DATA),
-                    "--max-bytes-per-column-name",
-                    str(settings.MAX_BYTES_PER_COLUMN_NAME),
-                    utf8_path.as_posix(),
-                    arrow_path.as_posix(),
-                ],
-                capture_output=True,
-                check=True,
-            )
+            child = yield ToolCall(args, utf8_input.stdin_chunks)
+            report.add_tool_usage("json-to-arrow", child.usage)
             warnings.extend(
                 [
                     I18nMessage("TODO_i18n", {"text": line}, None)
@@ -87,22 +142,71 @@ def _parse_json(
 
             reader = pyarrow.ipc.open_file(arrow_path.as_posix())
             raw_table = reader.read_all()  # efficient -- RAM is mmapped
+            stage.n_bytes_out = arrow_path.stat().st_size
 
-    table = _postprocess_table(raw_table, settings)
+    table = _postprocess_table(raw_table, settings, report)
     return ParseJsonResult(table, warnings)
 
 
+def _parse_json_and_write_steps(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings,
+    encoding: Optional[str],
+    report: ParseReport,
+    zip_member: Optional[str] = None,
+) -> ToolSteps[List[I18nMessage]]:
+    table, warnings = yield from _parse_json_steps(
+        path,
+        encoding=encoding,
+        settings=settings,
+        report=report,
+        zip_member=zip_member,
+    )
+    with report.stage("write", n_bytes_in=table.nbytes) as stage:
+        with pyarrow.ipc.RecordBatchFileWriter(
+            output_path.as_posix(), schema=table.schema
+        ) as writer:
+            writer.write_table(table)
+        stage.n_bytes_out = output_path.stat().st_size
+
+    return warnings
+
+
 def parse_json(
     path: Path,
     *,
     output_path: Path,
     settings: Settings = DEFAULT_SETTINGS,
-    encoding: Optional[str]
+    encoding: Optional[str],
+    report: Optional[ParseReport] = None,
 ) -> List[I18nMessage]:
-    table, warnings = _parse_json(path, encoding=encoding, settings=settings)
-    with pyarrow.ipc.RecordBatchFileWriter(
-        output_path.as_posix(), schema=table.schema
-    ) as writer:
-        writer.write_table(table)
+    return run_tool_steps(
+        _parse_json_and_write_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            report=(report or ParseReport()),
+        )
+    )
 
-    return warnings
+
+async def parse_json_async(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings = DEFAULT_SETTINGS,
+    encoding: Optional[str],
+    report: Optional[ParseReport] = None,
+) -> List[I18nMessage]:
+    return await run_tool_steps_async(
+        _parse_json_and_write_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            report=(report or ParseReport()),
+        )
+    )
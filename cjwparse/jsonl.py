@@ -0,0 +1,508 @@
+import contextlib
+import dataclasses
+import re
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow
+import pyarrow.compute
+
+from cjwmodule.i18n import I18nMessage
+
+from ._util import (
+    ToolCall,
+    ToolSteps,
+    run_tool_steps,
+    run_tool_steps_async,
+    tempfile_context,
+)
+from .i18n import _trans_cjwparse
+from .json import ParseJsonResult, _json_to_arrow_args, _postprocess_table
+from .report import ParseReport
+from .settings import DEFAULT_SETTINGS, Settings
+from .text import BUFFER_SIZE, utf8_input_context
+
+_LIMIT_WARNING = re.compile(
+    r"^(?:skipped \d+ rows \(after row limit of \d+\)"
+    r"|skipped column .* \(after column limit of \d+\)"
+    r"|stopped at limit of \d+ bytes of data)$"
+)
+_TEXT_LIMIT_WARNING = re.compile(r"^stopped at limit of \d+ bytes of data$")
+_SKIPPED_NON_OBJECTS = re.compile(r"^skipped (\d+) non-Object records?\b")
+
+
+def _next_line_start(f: BinaryIO, offset: int) -> int:
+    """
+    Return the offset of the first line in `f` that starts at or after `offset`
+    (or the file size, if there is none).
+    """
+    if offset == 0:
+        return 0
+    f.seek(offset - 1)  # a newline just before `offset` means it's a line start
+    while True:
+        block = f.read(BUFFER_SIZE)
+        if not block:
+            return f.tell()
+        newline = block.find(b"\n")
+        if newline != -1:
+            return f.tell() - len(block) + newline + 1
+
+
+def _split_lines(
+    path: Path, n_chunks: int, start: int = 0, end: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """
+    Split bytes `start` to `end` of `path` into at most `n_chunks` (start, end)
+    byte ranges of about the same size, each ending at the end of a line.
+
+    `start` must be the start of a line. If `end` isn't, the last range
+    extends past it to finish its line.
+    """
+    n_bytes = path.stat().st_size
+    if end is None:
+        end = n_bytes
+    offsets = [start]
+    with path.open("rb") as f:
+        for i in range(1, n_chunks + 1):
+            offset = start + (end - start) * i // n_chunks
+            offsets.append(max(offsets[-1], _next_line_start(f, offset)))
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+def _write_json_array(
+    path: Path, start: int, end: int, dest: Path, max_n_records: int
+) -> Tuple[int, int]:
+    """
+    Write bytes `start` to `end` of JSON Lines file `path` to `dest`, as a JSON
+    array of at most `max_n_records` records.
+
+    Skip blank lines. We don't parse records: a record that isn't valid JSON
+    makes the whole array invalid, and json-to-arrow stops reading there.
+
+    Return the number of records we wrote, and the offset in `path` after the
+    last line we read.
+    """
+    n_records = 0
+    with path.open("rb") as src_f, dest.open("wb") as dest_f:
+        src_f.seek(start)
+        offset = start
+        dest_f.write(b"[")
+        while offset < end and n_records < max_n_records:
+            line = src_f.readline(end - offset)
+            offset += len(line)
+            if line.strip():
+                if n_records:
+                    dest_f.write(b",")
+                dest_f.write(line[:-1] if line.endswith(b"\n") else line)
+                n_records += 1
+        dest_f.write(b"]")
+    return n_records, offset
+
+
+def _count_records(path: Path, start: int) -> int:
+    """
+    Count the records (non-blank lines) of JSON Lines file `path` after `start`.
+    """
+    with path.open("rb") as f:
+        f.seek(start)
+        return sum(1 for line in f if line.strip())
+
+
+def _unify_types(a: pyarrow.DataType, b: pyarrow.DataType) -> pyarrow.DataType:
+    """
+    Pick a type that can hold values of both `a` and `b`.
+    """
+    if a == b or pyarrow.types.is_null(b):
+        return a
+    elif pyarrow.types.is_null(a):
+        return b
+    elif pyarrow.types.is_integer(a) and pyarrow.types.is_integer(b):
+        return pyarrow.int64()
+    elif (pyarrow.types.is_integer(a) or pyarrow.types.is_floating(a)) and (
+        pyarrow.types.is_integer(b) or pyarrow.types.is_floating(b)
+    ):
+        return pyarrow.float64()
+    else:
+        return pyarrow.utf8()
+
+
+def _unify_tables(tables: List[pyarrow.Table]) -> pyarrow.Table:
+    """
+    Concatenate `tables`, which may have different columns and types.
+
+    Columns are ordered by first appearance. A column missing from one table
+    is null in its rows. Where tables disagree about a column's type, we
+    convert to a common type: integer and float become float; anything else
+    becomes text.
+    """
+    types: Dict[str, pyarrow.DataType] = {}
+    for table in tables:
+        for field in table.schema:
+            if field.name in types:
+                types[field.name] = _unify_types(types[field.name], field.type)
+            else:
+                types[field.name] = field.type
+
+    if not tables:
+        return pyarrow.table({})
+
+    return pyarrow.concat_tables(
+        [
+            pyarrow.table(
+                {
+                    name: (
+                        table.column(name).cast(dtype)
+                        if name in table.column_names
+                        else pyarrow.nulls(table.num_rows, dtype)
+                    )
+                    for name, dtype in types.items()
+                }
+            )
+            for table in tables
+        ]
+    )
+
+
+def _text_n_bytes_per_row(table: pyarrow.Table) -> np.ndarray:
+    """
+    Count each row's bytes of text data.
+    """
+    n_bytes = np.zeros(table.num_rows, dtype=np.int64)
+    for column in table.columns:
+        if pyarrow.types.is_string(column.type):
+            lengths = pyarrow.compute.binary_length(column).to_numpy()
+            n_bytes += np.nan_to_num(lengths).astype(np.int64)  # null => NaN => 0
+    return n_bytes
+
+
+def _enforce_limits(
+    table: pyarrow.Table,
+    settings: Settings,
+    *,
+    n_unread_rows: int = 0,
+    n_unread_text_rows: int = 0,
+) -> Tuple[pyarrow.Table, List[I18nMessage]]:
+    """
+    Truncate `table` to `settings`' column, row and text-data limits.
+
+    json-to-arrow enforces them on each chunk; we enforce them on the whole.
+    (Unifying types can turn numbers into text, so the whole can exceed a
+    limit its chunks obeyed.)
+
+    `n_unread_rows` and `n_unread_text_rows` count records we never parsed,
+    because we had reached the row limit or the text limit. We count them in
+    our warnings, as skipped rows.
+    """
+    warnings = []
+
+    if table.num_columns > settings.MAX_COLUMNS_PER_TABLE:
+        warnings.append(
+            _trans_cjwparse(
+                "warning.skipped_columns",
+                "{n_columns, plural, one{Skipped # column} other{Skipped # columns}} (after column limit of {max_n_columns})",
+                dict(
+                    n_columns=table.num_columns - settings.MAX_COLUMNS_PER_TABLE,
+                    max_n_columns=settings.MAX_COLUMNS_PER_TABLE,
+                ),
+            )
+        )
+        table = table.select(range(settings.MAX_COLUMNS_PER_TABLE))
+
+    n_skipped_rows = n_unread_rows
+    if table.num_rows > settings.MAX_ROWS_PER_TABLE:
+        n_skipped_rows += table.num_rows - settings.MAX_ROWS_PER_TABLE
+        table = table.slice(0, settings.MAX_ROWS_PER_TABLE)
+    if n_skipped_rows:
+        warnings.append(
+            _trans_cjwparse(
+                "warning.skipped_rows",
+                "{n_rows, plural, one{Skipped # row} other{Skipped # rows}} (after row limit of {max_n_rows})",
+                dict(n_rows=n_skipped_rows, max_n_rows=settings.MAX_ROWS_PER_TABLE),
+            )
+        )
+
+    total_n_bytes = np.cumsum(_text_n_bytes_per_row(table))
+    n_rows = int(np.searchsorted(total_n_bytes, settings.MAX_BYTES_TEXT_DATA, "right"))
+    n_skipped_rows = n_unread_text_rows + table.num_rows - n_rows
+    if n_skipped_rows:
+        warnings.append(
+            _trans_cjwparse(
+                "jsonl.skipped_rows_text_limit",
+                "{n_rows, plural, one{Skipped # row} other{Skipped # rows}} (after text limit of {max_n_bytes} bytes)",
+                dict(n_rows=n_skipped_rows, max_n_bytes=settings.MAX_BYTES_TEXT_DATA),
+            )
+        )
+        table = table.slice(0, n_rows)
+
+    return table, warnings
+
+
+def _parse_jsonl(
+    path: Path,
+    *,
+    settings: Settings = DEFAULT_SETTINGS,
+    encoding: Optional[str],
+    report: Optional[ParseReport] = None,
+) -> ParseJsonResult:
+    """
+    Parse JSON Lines (NDJSON) text file: one JSON record per line.
+
+    Raise LookupError for an `encoding` Python cannot handle.
+
+    Raise UnicodeError when the file simply cannot be read as text. (e.g., a
+    UTF-16 file that does not start with a byte-order marker.)
+
+    The process:
+
+    1. Convert the file to UTF-8, if it isn't valid UTF-8 already.
+    2. Split the next part of it on line boundaries into up to
+       `settings.JSONL_N_PROCESSES` chunks of at least
+       `settings.JSONL_MIN_CHUNK_BYTES` bytes. The part holds no more records
+       than the row limit allows, and no more bytes than the text limit
+       allows. (A record's text data is never longer than its JSON.)
+    3. Run one `json-to-arrow` per chunk, all at once, each reading its
+       chunk as a JSON array.
+    4. Repeat from step 2 until we reach the end of the file or a limit. If a
+       chunk stops early (because of invalid JSON or the text limit), ignore
+       the chunks after it and stop, just as one `json-to-arrow` would.
+    5. Concatenate the chunks' tables, unifying their columns and types, and
+       enforce our limits on the whole.
+    6. Dictionary-encode each column if it's helpful.
+
+    So we never hold more than about one table's worth of limits in memory,
+    however many processes we run.
+
+    If `report` is set, record the time and bytes each step took, and the
+    columns we output.
+    """
+    return run_tool_steps(
+        _parse_jsonl_steps(
+            path,
+            settings=settings,
+            encoding=encoding,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+def _parse_jsonl_steps(
+    path: Path,
+    *,
+    settings: Settings,
+    encoding: Optional[str],
+    report: ParseReport,
+    zip_member: Optional[str] = None,
+) -> ToolSteps[ParseJsonResult]:
+    """
+    `_parse_jsonl()`, as `ToolSteps`.
+    """
+    warnings = []
+
+    with contextlib.ExitStack() as ctx:
+        # raises LookupError, UnicodeError
+        utf8_input = ctx.enter_context(
+            utf8_input_context(
+                path,
+                encoding,
+                settings=settings,
+                warnings=warnings,
+                n_head_bytes=0,
+                report=report,
+                zip_member=zip_member,
+                seekable=True,  # we split a file on disk
+            )
+        )
+        utf8_path = Path(utf8_input.path)
+        n_bytes = utf8_path.stat().st_size
+
+        tables = []
+        n_rows_left = settings.MAX_ROWS_PER_TABLE
+        n_text_bytes_left = settings.MAX_BYTES_TEXT_DATA
+        n_unread_rows = 0
+        n_unread_text_rows = 0
+        offset = 0
+        while offset < n_bytes:
+            if n_rows_left <= 0 or n_text_bytes_left <= 0:
+                with report.stage("count_records", n_bytes_in=n_bytes - offset):
+                    n_unread = _count_records(utf8_path, offset)
+                if n_rows_left <= 0:
+                    n_unread_rows = n_unread
+                else:
+                    n_unread_text_rows = n_unread
+                break
+
+            # A record's text data is never longer than its JSON: we needn't
+            # read more JSON than we have text left to hold.
+            wave_end = min(
+                n_bytes,
+                offset + max(n_text_bytes_left, settings.JSONL_MIN_CHUNK_BYTES),
+            )
+            n_chunks = max(
+                1,
+                min(
+                    settings.JSONL_N_PROCESSES,
+                    (wave_end - offset) // max(1, settings.JSONL_MIN_CHUNK_BYTES),
+                ),
+            )
+            with report.stage("split_lines", n_bytes_in=wave_end - offset):
+                ranges = _split_lines(utf8_path, n_chunks, offset, wave_end)
+
+            with contextlib.ExitStack() as chunks_ctx:
+                calls = []
+                arrow_paths = []
+                n_records_per_chunk = []
+                n_records_left = n_rows_left
+                for start, end in ranges:
+                    json_path = chunks_ctx.enter_context(
+                        tempfile_context(suffix=".json")
+                    )
+                    with report.stage("write_json_array", n_bytes_in=end - start):
+                        n_records, offset = _write_json_array(
+                            utf8_path, start, end, json_path, n_records_left
+                        )
+                    if n_records:  # else the chunk is all blank lines
+                        arrow_path = ctx.enter_context(
+                            tempfile_context(suffix=".arrow")
+                        )
+                        args = _json_to_arrow_args(
+                            json_path.as_posix(),
+                            arrow_path,
+                            settings=dataclasses.replace(
+                                settings,
+                                MAX_ROWS_PER_TABLE=n_records,
+                                MAX_BYTES_TEXT_DATA=n_text_bytes_left,
+                            ),
+                        )
+                        calls.append(ToolCall(args))
+                        arrow_paths.append(arrow_path)
+                        n_records_per_chunk.append(n_records)
+                    n_records_left -= n_records
+                    if n_records_left == 0:
+                        break  # the next wave will count the rest, if any
+
+                if not calls:
+                    continue
+
+                with report.stage("json-to-arrow") as stage:
+                    # raise subprocess.CalledProcessError on error ... but there
+                    # is no error json-to-arrow will throw that we can recover
+                    # from.
+                    children = yield calls
+                    for child in children:
+                        report.add_tool_usage("json-to-arrow", child.usage)
+                    stage.n_bytes_out = sum(p.stat().st_size for p in arrow_paths)
+
+            for i, (child, arrow_path) in enumerate(zip(children, arrow_paths)):
+                reader = pyarrow.ipc.open_file(arrow_path.as_posix())
+                table = reader.read_all()  # efficient -- RAM is mmapped
+                tables.append(table)
+                n_rows_left -= table.num_rows
+                n_text_bytes_left -= int(_text_n_bytes_per_row(table).sum())
+
+                n_records_read = table.num_rows
+                is_text_limit = False
+                for line in child.stdout.decode("utf-8").split("\n"):
+                    match = _SKIPPED_NON_OBJECTS.match(line)
+                    if match:
+                        n_records_read += int(match.group(1))
+                    if _TEXT_LIMIT_WARNING.match(line):
+                        is_text_limit = True
+                    # Drop each chunk's limit warnings: _enforce_limits() warns
+                    # about the whole table.
+                    if not line or _LIMIT_WARNING.match(line):
+                        continue
+                    warning = I18nMessage("TODO_i18n", {"text": line}, None)
+                    if warning not in warnings:  # chunks repeat them
+                        warnings.append(warning)
+
+                if n_records_read < n_records_per_chunk[i]:
+                    # json-to-arrow stopped early. One json-to-arrow would have
+                    # stopped here, too: ignore the rest of the file.
+                    if is_text_limit:
+                        with report.stage("count_records"):
+                            n_unread_text_rows = (
+                                n_records_per_chunk[i]
+                                - n_records_read
+                                + sum(n_records_per_chunk[i + 1 :])
+                                + _count_records(utf8_path, offset)
+                            )
+                    offset = n_bytes
+                    break
+
+        with report.stage("unify_chunks"):
+            raw_table = _unify_tables(tables)
+            raw_table, limit_warnings = _enforce_limits(
+                raw_table,
+                settings,
+                n_unread_rows=n_unread_rows,
+                n_unread_text_rows=n_unread_text_rows,
+            )
+            warnings.extend(limit_warnings)
+
+    table = _postprocess_table(raw_table, settings, report)
+    return ParseJsonResult(table, warnings)
+
+
+def _parse_jsonl_and_write_steps(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings,
+    encoding: Optional[str],
+    report: ParseReport,
+    zip_member: Optional[str] = None,
+) -> ToolSteps[List[I18nMessage]]:
+    table, warnings = yield from _parse_jsonl_steps(
+        path,
+        encoding=encoding,
+        settings=settings,
+        report=report,
+        zip_member=zip_member,
+    )
+    with report.stage("write", n_bytes_in=table.nbytes) as stage:
+        with pyarrow.ipc.RecordBatchFileWriter(
+            output_path.as_posix(), schema=table.schema
+        ) as writer:
+            writer.write_table(table)
+        stage.n_bytes_out = output_path.stat().st_size
+
+    return warnings
+
+
+def parse_jsonl(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings = DEFAULT_SETTINGS,
+    encoding: Optional[str],
+    report: Optional[ParseReport] = None,
+) -> List[I18nMessage]:
+    return run_tool_steps(
+        _parse_jsonl_and_write_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            report=(report or ParseReport()),
+        )
+    )
+
+
+async def parse_jsonl_async(
+    path: Path,
+    *,
+    output_path: Path,
+    settings: Settings = DEFAULT_SETTINGS,
+    encoding: Optional[str],
+    report: Optional[ParseReport] = None,
+) -> List[I18nMessage]:
+    return await run_tool_steps_async(
+        _parse_jsonl_and_write_steps(
+            path,
+            output_path=output_path,
+            settings=settings,
+            encoding=encoding,
+            report=(report or ParseReport()),
+        )
+    )
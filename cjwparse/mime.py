@@ -1,4 +1,76 @@
+import codecs
+import re
+import zipfile
 from enum import Enum
+from pathlib import Path
+from typing import Optional
+
+from .compression import DECOMPRESSION_ERRORS, detect_compression
+
+SNIFF_N_BYTES = 8 * 1024
+"""
+Number of bytes `MimeType.sniff()` reads (after decompressing, if needed).
+"""
+
+_OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_ZIP_MAGIC = b"PK\x03\x04"
+_TEXT_BOMS = [
+    # UTF-32 before UTF-16: the UTF-16LE BOM is a prefix of the UTF-32LE one
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+]
+_JSON_START = re.compile(rb"\A\s*(?:\{\s*[\"}]|\[\s*[\[\]{\"])")
+"""
+An object with a string key (or no keys), or an array of objects, arrays or
+strings.
+
+We don't accept arrays of numbers: "[1],[2]" may be CSV.
+"""
+_JSONL_START = re.compile(rb"\A\s*\{[^\n]*\}[ \t\r]*\n\s*\{")
+"""
+An object on one line, followed by another object.
+
+A pretty-printed JSON object spans lines; and two JSON objects in a row
+aren't JSON.
+"""
+_HTML_START = re.compile(
+    rb"\A\s*(?:<!--.*?-->\s*)*<(?:!doctype\s+html|html|head|body)[\s>]",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def _sniff_text(head: bytes) -> Optional["MimeType"]:
+    for bom, encoding in _TEXT_BOMS:
+        if head.startswith(bom):
+            # Decode (ignoring a character split at the end), so our patterns
+            # can match UTF-8
+            text = head[len(bom) :].decode(encoding, errors="ignore")
+            head = text.encode("utf-8")
+            break
+
+    if _JSONL_START.match(head):
+        return MimeType.JSONL
+    elif _JSON_START.match(head):
+        return MimeType.JSON
+    elif _HTML_START.match(head):
+        return MimeType.HTML
+    else:
+        return None
+
+
+def _is_xlsx(path: Path, head: bytes) -> bool:
+    if b"xl/" in head:
+        return True
+    # The head may hold only "[Content_Types].xml" and "_rels/". Read the
+    # central directory, at the end of the file.
+    try:
+        with zipfile.ZipFile(path) as zf:
+            return any(name.startswith("xl/") for name in zf.namelist())
+    except zipfile.BadZipFile:
+        return False
 
 
 class MimeType(Enum):
@@ -6,8 +78,17 @@ class MimeType(Enum):
     TSV = "text/tab-separated-values"
     TXT = "text/plain"
     JSON = "application/json"
+    JSONL = "application/x-ndjson"
+    """
+    JSON Lines (a.k.a. NDJSON): one JSON record per line.
+    """
     XLS = "application/vnd.ms-excel"
     XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ZIP = "application/zip"
+    HTML = "text/html"
+    """
+    A web page. We can't parse it: it's usually an error page someone saved.
+    """
 
     @classmethod
     def from_extension(cls, ext: str):
@@ -23,4 +104,43 @@ class MimeType(Enum):
             ".xls": MimeType.XLS,
             ".xlsx": MimeType.XLSX,
             ".json": MimeType.JSON,
+            ".jsonl": MimeType.JSONL,
+            ".ndjson": MimeType.JSONL,
+            ".zip": MimeType.ZIP,
         }[ext]
+
+    @classmethod
+    def sniff(cls, path: Path):
+        """
+        Guess MIME type from the first `SNIFF_N_BYTES` of `path`.
+
+        Recognize XLS (OLE2), XLSX (a ZIP with "xl/" files), other ZIP, JSON,
+        JSON Lines and HTML. Look through UTF-8, UTF-16 and UTF-32 byte-order
+        markers, and within gzip/bzip2/xz/zstd compression.
+
+        Return `None` for anything else -- notably, CSV, TSV and TXT, which
+        look alike.
+        """
+        with path.open("rb") as f:
+            head = f.read(SNIFF_N_BYTES)
+
+        if head.startswith(_OLE2_MAGIC):
+            return MimeType.XLS
+        elif head.startswith(_ZIP_MAGIC):
+            return MimeType.XLSX if _is_xlsx(path, head) else MimeType.ZIP
+
+        compression = detect_compression(path)
+        if compression is not None:
+            if not compression.is_supported:
+                return None
+            try:
+                with compression.open(path) as f:
+                    head = f.read(SNIFF_N_BYTES)
+            except DECOMPRESSION_ERRORS:
+                return None  # invalid input; the parser will warn
+            if head.startswith(_OLE2_MAGIC):
+                return MimeType.XLS
+            elif head.startswith(_ZIP_MAGIC):
+                return MimeType.XLSX if b"xl/" in head else MimeType.ZIP
+
+        return _sniff_text(head)
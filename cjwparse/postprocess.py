@@ -1,16 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import numpy as np
 import pyarrow
+import pyarrow.compute
 
 from .settings import Settings
 
 
-def _string_array_pylist_n_bytes(data: pyarrow.ChunkedArray) -> int:
-    text_buf = data.buffers()[-1]
-    if text_buf is None:
-        # All values are ""
-        n_text_bytes = 0
-    else:
-        n_text_bytes = text_buf.size
+def _utf8_array_n_text_bytes(array: pyarrow.Array) -> int:
+    """
+    Count the bytes of text in `array` (unlike `buffers()[-1].size`, which
+    includes text outside a slice).
+    """
+    _, offsets_buf, data_buf = array.buffers()
+    if len(array) == 0 or data_buf is None:
+        return 0
+    offsets = np.frombuffer(
+        offsets_buf, dtype="<i4", count=array.offset + len(array) + 1
+    )
+    return int(offsets[-1]) - int(offsets[array.offset])
+
 
+def _string_array_pylist_n_bytes(data: pyarrow.Array) -> int:
     return (
         # 8 bytes per value (each value is a 64-bit pointer)
         (8 * len(data))
@@ -18,41 +30,157 @@ def _string_array_pylist_n_bytes(data: pyarrow.ChunkedArray) -> int:
         # sys.getsizeof() if you disbelieve.
         + (50 * (len(data) - data.null_count))
         # ... and then count the actual bytes of data
-        + n_text_bytes
+        + _utf8_array_n_text_bytes(data)
     )
 
 
+def _chunked_string_array_pylist_n_bytes(data: pyarrow.ChunkedArray) -> int:
+    return sum(_string_array_pylist_n_bytes(chunk) for chunk in data.chunks)
+
+
+_DICTIONARY_PROBE_SLICE_LENGTH = 4096
+_DICTIONARY_PROBE_MAX_LENGTH = 65536
+
+
+def _dictionary_pylist_n_bytes_lower_bound(
+    data: pyarrow.ChunkedArray, limit: float
+) -> int:
+    """
+    Return a number no greater than the cost of `data`'s dictionary.
+
+    Every distinct value in `data` lands in its dictionary, so the cost of the
+    distinct values in a prefix is a lower bound. We read the prefix in slices
+    and return as soon as the bound exceeds `limit`: in a column of unique IDs,
+    that's after a few thousand values instead of a full hash-table build.
+    We also give up (returning a low bound) once a slice adds no new values:
+    the column is probably worth encoding, and probing further is waste.
+    """
+    distinct = pyarrow.array([], pyarrow.utf8())
+    n_bytes = 0
+    end = min(len(data), _DICTIONARY_PROBE_MAX_LENGTH)
+    for start in range(0, end, _DICTIONARY_PROBE_SLICE_LENGTH):
+        values = data.slice(start, min(_DICTIONARY_PROBE_SLICE_LENGTH, end - start))
+        n_distinct = len(distinct)
+        distinct = pyarrow.concat_arrays([distinct, values.unique()]).unique()
+        if start and len(distinct) == n_distinct:
+            break
+        n_values = len(distinct) - distinct.null_count  # dictionaries omit null
+        n_bytes = (8 + 50) * n_values + _utf8_array_n_text_bytes(distinct)
+        if n_bytes > limit:
+            break
+    return n_bytes
+
+
+def _unify_dictionaries(encoded: pyarrow.ChunkedArray) -> pyarrow.ChunkedArray:
+    """
+    Make every chunk of `encoded` share one dictionary.
+
+    Depending on pyarrow version, `ChunkedArray.dictionary_encode()` gives
+    each chunk the dictionary it had built _so far_, duplicating values in RAM
+    and on disk. Those are all prefixes of the last chunk's dictionary, so we
+    can reuse every chunk's indices. Otherwise, we re-encode.
+    """
+    dictionary = encoded.chunk(encoded.num_chunks - 1).dictionary
+    if all(
+        chunk.dictionary is dictionary
+        or dictionary.slice(0, len(chunk.dictionary)).equals(chunk.dictionary)
+        for chunk in encoded.chunks
+    ):
+        chunks = [
+            pyarrow.DictionaryArray.from_arrays(chunk.indices, dictionary)
+            for chunk in encoded.chunks
+        ]
+    else:
+        values = [chunk.dictionary.take(chunk.indices) for chunk in encoded.chunks]
+        dictionary = pyarrow.chunked_array(values, encoded.type.value_type).unique()
+        dictionary = dictionary.filter(pyarrow.compute.is_valid(dictionary))
+        chunks = [
+            pyarrow.DictionaryArray.from_arrays(
+                pyarrow.compute.index_in(chunk, value_set=dictionary).cast(
+                    encoded.type.index_type
+                ),
+                dictionary,
+            )
+            for chunk in values
+        ]
+    return pyarrow.chunked_array(chunks, encoded.type)
+
+
 def _maybe_dictionary_encode_column(
     data: pyarrow.ChunkedArray, *, settings: Settings
 ) -> pyarrow.ChunkedArray:
     if len(data) == 0 or data.null_count == len(data):
         return data
 
-    encoded = data.dictionary_encode()
+    old_cost = _chunked_string_array_pylist_n_bytes(data)
+
+    # Skip dictionary_encode() when a cheap probe proves we'd discard it
+    min_new_cost = _dictionary_pylist_n_bytes_lower_bound(
+        data,
+        min(
+            settings.MAX_DICTIONARY_PYLIST_N_BYTES,
+            old_cost / settings.MIN_DICTIONARY_COMPRESSION_RATIO_PYLIST_N_BYTES,
+        ),
+    )
+    if min_new_cost > settings.MAX_DICTIONARY_PYLIST_N_BYTES or (
+        min_new_cost
+        and old_cost / min_new_cost
+        < settings.MIN_DICTIONARY_COMPRESSION_RATIO_PYLIST_N_BYTES
+    ):
+        return data
+
+    encoded = _unify_dictionaries(data.dictionary_encode())
     new_cost = _string_array_pylist_n_bytes(encoded.chunk(0).dictionary)
 
     if new_cost > settings.MAX_DICTIONARY_PYLIST_N_BYTES:
         # abort! abort! dictionary is too large
         return data
 
-    old_cost = _string_array_pylist_n_bytes(data.chunk(0))
-
     if old_cost / new_cost >= settings.MIN_DICTIONARY_COMPRESSION_RATIO_PYLIST_N_BYTES:
         return encoded
     else:
         return data
 
 
+def map_columns(
+    table: pyarrow.Table,
+    fn: Callable[[pyarrow.ChunkedArray], pyarrow.ChunkedArray],
+    *,
+    settings: Settings,
+) -> pyarrow.Table:
+    """
+    Return a table with `fn(column)` for each column of `table`.
+
+    Columns are processed on up to `settings.POSTPROCESS_N_THREADS` threads.
+    The heavy lifting (`cast()`, `dictionary_encode()`, ...) happens in
+    pyarrow, which releases the GIL. Output column order always matches input
+    column order.
+    """
+    if (
+        settings.ARROW_CPU_COUNT is not None
+        and pyarrow.cpu_count() != settings.ARROW_CPU_COUNT
+    ):
+        pyarrow.set_cpu_count(settings.ARROW_CPU_COUNT)
+
+    n_threads = min(settings.POSTPROCESS_N_THREADS, table.num_columns)
+    if n_threads <= 1:
+        columns = [fn(column) for column in table.columns]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=n_threads, thread_name_prefix="cjwparse-postprocess"
+        ) as executor:
+            columns = list(executor.map(fn, table.columns))
+
+    return pyarrow.table(dict(zip(table.column_names, columns)))
+
+
 def dictionary_encode_columns(
     table: pyarrow.Table, *, settings: Settings
 ) -> pyarrow.Table:
-    return pyarrow.table(
-        {
-            name: (
-                _maybe_dictionary_encode_column(column, settings=settings)
-                if column.type == pyarrow.utf8()
-                else column
-            )
-            for name, column in zip(table.column_names, table.columns)
-        }
-    )
+    def encode(column: pyarrow.ChunkedArray) -> pyarrow.ChunkedArray:
+        if column.type == pyarrow.utf8():
+            return _maybe_dictionary_encode_column(column, settings=settings)
+        else:
+            return column
+
+    return map_columns(table, encode, settings=settings)
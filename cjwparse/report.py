@@ -0,0 +1,221 @@
+import contextlib
+import resource
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import pyarrow
+
+__all__ = ["ColumnReport", "ParseReport", "StageReport", "ToolUsage"]
+
+
+class StageReport(NamedTuple):
+    """
+    Time and bytes spent in one stage of a parse.
+
+    If a stage runs several times (say, for each chunk of a stream), these are
+    totals.
+    """
+
+    wall_time: float
+    """
+    Elapsed seconds.
+    """
+
+    cpu_time: float
+    """
+    Seconds of CPU our process spent (in all threads -- including threads
+    serving concurrent parses). arrow-tools programs' CPU is not included.
+    """
+
+    n_bytes_in: Optional[int] = None
+    n_bytes_out: Optional[int] = None
+
+
+class ToolUsage(NamedTuple):
+    """
+    Resources an arrow-tools program used, according to `os.wait4()`.
+
+    If a program runs several times, times and block counts are totals and
+    `max_rss` is the maximum.
+    """
+
+    max_rss: int
+    """
+    Peak resident set size, in bytes.
+    """
+
+    user_time: float
+    system_time: float
+
+    n_blocks_in: int
+    """
+    Number of times the filesystem performed input. (Reads served from the page
+    cache don't count.)
+    """
+
+    n_blocks_out: int
+
+
+class ColumnReport(NamedTuple):
+    name: str
+
+    type: str
+    """
+    Arrow type we output, such as "int8" or "dictionary<values=string,
+    indices=int32, ordered=0>".
+
+    For CSV, a numeric type means autocast chose it.
+    """
+
+    is_dictionary_encoded: bool
+
+
+class _StageBytes:
+    """
+    Byte counts a caller may set from within `ParseReport.stage()`.
+    """
+
+    def __init__(self, n_bytes_in: Optional[int]):
+        self.n_bytes_in = n_bytes_in
+        self.n_bytes_out: Optional[int] = None
+
+
+def _add_optional(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None:
+        return b
+    elif b is None:
+        return a
+    else:
+        return a + b
+
+
+class ParseReport:
+    """
+    Where a parse spent its time, and what it produced.
+
+    Pass a new `ParseReport` to `parse_file(..., report=report)` (or a
+    lower-level parse function) and read it afterwards. Stages appear in the
+    order they first ran. When we stream text to an arrow-tools program,
+    "transcode" overlaps with the program's stage.
+
+    `tools` holds each arrow-tools program's resource usage, and `max_rss`
+    our own process's peak RSS after postprocessing. That is a high-water
+    mark over the process's lifetime, so it may stem from earlier work (or
+    from concurrent parses).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, StageReport] = {}
+        self.tools: Dict[str, ToolUsage] = {}
+        self.max_rss: Optional[int] = None
+        self.n_rows: Optional[int] = None
+        self.n_columns: Optional[int] = None
+        self.columns: List[ColumnReport] = []
+
+    def add(
+        self,
+        name: str,
+        wall_time: float,
+        cpu_time: float,
+        *,
+        n_bytes_in: Optional[int] = None,
+        n_bytes_out: Optional[int] = None,
+    ) -> None:
+        """
+        Add measurements to stage `name`.
+        """
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = StageReport(
+                    wall_time, cpu_time, n_bytes_in, n_bytes_out
+                )
+            else:
+                self.stages[name] = StageReport(
+                    stage.wall_time + wall_time,
+                    stage.cpu_time + cpu_time,
+                    _add_optional(stage.n_bytes_in, n_bytes_in),
+                    _add_optional(stage.n_bytes_out, n_bytes_out),
+                )
+
+    def add_tool_usage(self, name: str, usage: ToolUsage) -> None:
+        """
+        Add the resources one run of program `name` used.
+        """
+        with self._lock:
+            total = self.tools.get(name)
+            if total is None:
+                self.tools[name] = usage
+            else:
+                self.tools[name] = ToolUsage(
+                    max(total.max_rss, usage.max_rss),
+                    total.user_time + usage.user_time,
+                    total.system_time + usage.system_time,
+                    total.n_blocks_in + usage.n_blocks_in,
+                    total.n_blocks_out + usage.n_blocks_out,
+                )
+
+    @contextlib.contextmanager
+    def stage(
+        self, name: str, *, n_bytes_in: Optional[int] = None
+    ) -> Iterator[_StageBytes]:
+        """
+        Time the `with` block as stage `name`.
+
+        Set `n_bytes_in` and `n_bytes_out` on the yielded object to record
+        byte counts known only within the block.
+        """
+        counts = _StageBytes(n_bytes_in)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield counts
+        finally:
+            self.add(
+                name,
+                time.perf_counter() - wall_start,
+                time.process_time() - cpu_start,
+                n_bytes_in=counts.n_bytes_in,
+                n_bytes_out=counts.n_bytes_out,
+            )
+
+    def timed_chunks(self, name: str, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """
+        Yield `chunks`, timing their production as stage `name`.
+
+        Each chunk's length counts towards the stage's `n_bytes_out`.
+        """
+        while True:
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            chunk = next(chunks, None)
+            self.add(
+                name,
+                time.perf_counter() - wall_start,
+                time.process_time() - cpu_start,
+                n_bytes_out=(0 if chunk is None else len(chunk)),
+            )
+            if chunk is None:
+                return
+            yield chunk
+
+    def record_table(self, table: pyarrow.Table) -> None:
+        """
+        Record the shape and column types of our output `table`.
+
+        Call this after postprocessing: we also record our own peak RSS.
+        """
+        # Linux reports KiB
+        self.max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.n_rows = table.num_rows
+        self.n_columns = table.num_columns
+        self.columns = [
+            ColumnReport(
+                field.name,
+                str(field.type),
+                pyarrow.types.is_dictionary(field.type),
+            )
+            for field in table.schema
+        ]
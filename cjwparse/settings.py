@@ -1,4 +1,6 @@
+import os
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
@@ -36,6 +38,15 @@ class Settings:
     than this in the worst case.)
     """
 
+    MAX_DECOMPRESSED_BYTES: int = 2 * 1024 * 1024 * 1024
+    """
+    How many bytes will we decompress from a gzip/bzip2/xz/zstd file?
+
+    A few kilobytes of compressed input can expand to terabytes. We stop
+    decompressing at this limit (or `MAX_CSV_BYTES`, for CSV, whichever is
+    smaller) and ignore the rest of the file.
+    """
+
     MAX_BYTES_TEXT_DATA: int = 1 * 1024 * 1024 * 1024  # 1GB
     """
     Maximum number of bytes of UTF-8 text data to hold in memory.
@@ -90,10 +101,104 @@ class Settings:
     Chunk size for chardet file encoding detection.
     """
 
+    ENCODING_DETECTION_MAX_BYTES: int = 1024 * 1024
+    """
+    Maximum number of bytes to read when detecting a file's encoding.
+
+    Larger files are sampled: a third of this from each of the head, middle
+    and tail. This bounds the time detection takes -- chardet may never become
+    confident, and it reads only a few MB per second.
+    """
+
     SEP_DETECT_CHUNK_SIZE: int = 1024 * 1024
     """
     Number of bytes used when detecting CSV/TSV/??? separator.
     """
 
+    STREAM_TEXT_TO_ARROW_TOOLS: bool = False
+    """
+    Pipe transcoded UTF-8 straight into `csv-to-arrow` and `json-to-arrow`.
+
+    When False, we write a UTF-8 copy of the input to a temporary file and the
+    arrow-tools program reads that file. When True, we transcode in a thread
+    and stream the output to the program's stdin: transcoding and parsing
+    overlap, and there is no temporary copy on disk.
+
+    Only enable this with arrow-tools programs that read their input
+    sequentially -- that is, programs that can read from a pipe.
+
+    This applies to all text we must copy: transcoded input, input truncated
+    to `MAX_CSV_BYTES`, and decompressed input (gzip, bzip2, xz, zstd, ZIP
+    members). When False, the temporary copy of decompressed input can be up
+    to `MAX_DECOMPRESSED_BYTES` on disk. (The in-process pyarrow CSV engine
+    reads copied text as a stream either way.)
+    """
+
+    TRANSCODE_N_PROCESSES: int = 1
+    """
+    Number of worker processes that transcode non-UTF-8 text.
+
+    Only stateless encodings split into independent pieces: single-byte
+    encodings (windows-1252, ISO-8859-*, ...) and multibyte ones in which
+    byte 0x0A is always a newline (Shift_JIS, GBK, GB18030, Big5, EUC-*, ...).
+    Each transcode starts its own processes, so this only pays off on large
+    files. Set to 1 to transcode on the calling thread.
+    """
+
+    CSV_ENGINE: str = "csv-to-arrow"
+    """
+    How to parse CSV: "csv-to-arrow", "pyarrow" or "auto".
+
+    "csv-to-arrow" runs `/usr/bin/csv-to-arrow` in a subprocess, which writes
+    an Arrow file we then read. "pyarrow" parses in-process with
+    `pyarrow.csv`: no process startup, no temporary Arrow file and
+    multithreaded parsing -- but the whole table sits in RAM. It falls back to
+    csv-to-arrow on input pyarrow can't parse identically (ragged rows,
+    misplaced quotation marks).
+
+    "auto" picks "pyarrow" for files up to `CSV_ENGINE_AUTO_MAX_BYTES`, and
+    "csv-to-arrow" for larger ones.
+    """
+
+    CSV_ENGINE_AUTO_MAX_BYTES: int = 32 * 1024 * 1024
+    """
+    Largest file (in bytes) `CSV_ENGINE="auto"` will parse with pyarrow.
+    """
+
+    JSONL_N_PROCESSES: int = os.cpu_count() or 1
+    """
+    Maximum number of `json-to-arrow` processes that parse one JSON Lines file.
+
+    We split the file on line boundaries and parse the pieces at the same
+    time, so large files parse faster with more processes. Set to 1 to parse
+    with a single process.
+    """
+
+    JSONL_MIN_CHUNK_BYTES: int = 16 * 1024 * 1024
+    """
+    Smallest piece of a JSON Lines file (in bytes) we parse in its own process.
+
+    Each process has a startup cost, and its own temporary Arrow file. Files
+    smaller than twice this size are parsed by a single process.
+    """
+
+    POSTPROCESS_N_THREADS: int = os.cpu_count() or 1
+    """
+    Number of threads that autocast and dictionary-encode columns.
+
+    Each column is processed independently, and pyarrow releases the GIL while
+    it works; so wide tables postprocess faster with more threads. Set to 1 to
+    process columns one at a time on the calling thread.
+    """
+
+    ARROW_CPU_COUNT: Optional[int] = None
+    """
+    Size of pyarrow's global CPU thread pool, or None to leave it alone.
+
+    This is process-wide: we call `pyarrow.set_cpu_count()` before
+    postprocessing. Lower it when `POSTPROCESS_N_THREADS` already keeps all
+    cores busy, to avoid oversubscription.
+    """
+
 
 DEFAULT_SETTINGS = Settings()
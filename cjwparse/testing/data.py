@@ -0,0 +1,226 @@
+"""
+Synthetic data files, for tests and benchmarks.
+
+Every generator is deterministic: the same `DataSpec` always produces the
+same bytes.
+"""
+import codecs
+import csv
+import io
+import json
+import random
+import zipfile
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+from xml.sax.saxutils import escape
+
+__all__ = [
+    "DataSpec",
+    "generate_rows",
+    "spec_for_size",
+    "write_csv",
+    "write_json",
+    "write_xlsx",
+]
+
+_WORDS = [
+    "apple",
+    "banana",
+    "café",
+    "naïve",
+    "Zürich",
+    "façade",
+    "déjà vu",
+    "smörgåsbord",
+    "a, b",
+    'say "hi"',
+]
+"""
+Text values. All are representable in windows-1252; some need CSV quoting.
+"""
+
+
+class DataSpec(NamedTuple):
+    n_rows: int = 1000
+    n_columns: int = 10
+
+    cardinality: Optional[int] = None
+    """
+    Number of distinct values in each text column, or `None` for (nearly)
+    all-distinct values.
+    """
+
+    numeric_ratio: float = 0.5
+    """
+    Fraction of columns that hold numbers (alternating integers and decimals).
+    The rest hold text.
+    """
+
+    seed: int = 0
+
+
+def _column_is_numeric(spec: DataSpec, column: int) -> bool:
+    # Spread numeric columns evenly: column i is numeric when the running
+    # count of numeric columns increases at i.
+    return int((column + 1) * spec.numeric_ratio) > int(column * spec.numeric_ratio)
+
+
+def _text_value(index: int) -> str:
+    return "%s %d" % (_WORDS[index % len(_WORDS)], index)
+
+
+def generate_rows(spec: DataSpec) -> List[List[str]]:
+    """
+    Return a header row followed by `spec.n_rows` rows of text values.
+    """
+    rng = random.Random(spec.seed)
+    header = ["Column %d" % i for i in range(spec.n_columns)]
+    generators = []
+    for column in range(spec.n_columns):
+        if _column_is_numeric(spec, column):
+            if column % 2:
+                generators.append(lambda: "%.2f" % rng.uniform(-1000, 1000))
+            else:
+                generators.append(lambda: str(rng.randint(-100000, 100000)))
+        else:
+            n_distinct = spec.cardinality or max(1, spec.n_rows * 10)
+            generators.append(lambda n=n_distinct: _text_value(rng.randrange(n)))
+    return [header] + [
+        [generate() for generate in generators] for _ in range(spec.n_rows)
+    ]
+
+
+def _encode(text: str, encoding: str) -> bytes:
+    if encoding.lower().replace("_", "-") in ("utf-16", "utf16"):
+        return codecs.BOM_UTF16_LE + text.encode("utf-16-le")
+    else:
+        return text.encode(encoding)
+
+
+def write_csv(
+    path: Path, spec: DataSpec, *, delimiter: str = ",", encoding: str = "utf-8"
+) -> None:
+    """
+    Write `spec` as delimiter-separated text (CSV or TSV) to `path`.
+
+    "utf-16" output starts with a little-endian byte-order marker.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=delimiter, lineterminator="\n")
+    writer.writerows(generate_rows(spec))
+    path.write_bytes(_encode(out.getvalue(), encoding))
+
+
+def write_json(
+    path: Path, spec: DataSpec, *, encoding: str = "utf-8", lines: bool = False
+) -> None:
+    """
+    Write `spec` as a JSON array of records to `path` -- or, with `lines`, as
+    JSON Lines: one record per line.
+
+    Numeric columns become JSON numbers.
+    """
+    header, *rows = generate_rows(spec)
+    numeric = [_column_is_numeric(spec, i) for i in range(spec.n_columns)]
+    records = [
+        {
+            name: (json.loads(value) if is_numeric else value)
+            for name, value, is_numeric in zip(header, row, numeric)
+        }
+        for row in rows
+    ]
+    if lines:
+        text = "".join(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in records
+        )
+    else:
+        text = json.dumps(records, ensure_ascii=False)
+    path.write_bytes(_encode(text, encoding))
+
+
+_XLSX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/><Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>%s</Types>"""
+_XLSX_CONTENT_TYPE_SHEET = """<Override PartName="/xl/worksheets/sheet%d.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>"""
+
+_XLSX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>"""
+
+_XLSX_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>%s</sheets></workbook>"""
+_XLSX_WORKBOOK_SHEET = """<sheet name="Sheet%d" sheetId="%d" r:id="rId%d"/>"""
+
+_XLSX_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">%s</Relationships>"""
+_XLSX_WORKBOOK_RELS_SHEET = """<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet%d.xml"/>"""
+
+
+def _xlsx_cell(value: str, is_numeric: bool) -> str:
+    if is_numeric:
+        return "<c><v>%s</v></c>" % value
+    else:
+        return '<c t="inlineStr"><is><t>%s</t></is></c>' % escape(value)
+
+
+def _xlsx_sheet(spec: DataSpec) -> str:
+    header, *rows = generate_rows(spec)
+    numeric = [_column_is_numeric(spec, i) for i in range(spec.n_columns)]
+    sheet = io.StringIO()
+    sheet.write(
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        "<sheetData>"
+    )
+    sheet.write("<row>%s</row>" % "".join(_xlsx_cell(v, False) for v in header))
+    for row in rows:
+        sheet.write(
+            "<row>%s</row>" % "".join(_xlsx_cell(v, n) for v, n in zip(row, numeric))
+        )
+    sheet.write("</sheetData></worksheet>")
+    return sheet.getvalue()
+
+
+def write_xlsx(path: Path, spec: DataSpec, *, n_sheets: int = 1) -> None:
+    """
+    Write `spec` as an Excel workbook to `path`.
+
+    Numeric columns hold number cells; text uses inline strings. With
+    `n_sheets > 1`, sheet N holds the same shape of data as sheet 1, with
+    `seed` incremented by N - 1.
+    """
+    numbers = range(1, n_sheets + 1)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(
+            "[Content_Types].xml",
+            _XLSX_CONTENT_TYPES
+            % "".join(_XLSX_CONTENT_TYPE_SHEET % n for n in numbers),
+        )
+        zf.writestr("_rels/.rels", _XLSX_RELS)
+        zf.writestr(
+            "xl/workbook.xml",
+            _XLSX_WORKBOOK % "".join(_XLSX_WORKBOOK_SHEET % (n, n, n) for n in numbers),
+        )
+        zf.writestr(
+            "xl/_rels/workbook.xml.rels",
+            _XLSX_WORKBOOK_RELS
+            % "".join(_XLSX_WORKBOOK_RELS_SHEET % (n, n) for n in numbers),
+        )
+        for n in numbers:
+            zf.writestr(
+                "xl/worksheets/sheet%d.xml" % n,
+                _xlsx_sheet(spec._replace(seed=spec.seed + n - 1)),
+            )
+
+
+def spec_for_size(spec: DataSpec, n_bytes: int) -> DataSpec:
+    """
+    Return `spec` with `n_rows` chosen so UTF-8 CSV output is about `n_bytes`.
+
+    Other formats and encodings are larger or smaller, in proportion.
+    """
+    n_sample_rows = 100
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerows(
+        generate_rows(spec._replace(n_rows=n_sample_rows))[1:]
+    )
+    bytes_per_row = len(out.getvalue().encode("utf-8")) / n_sample_rows
+    return spec._replace(n_rows=max(1, round(n_bytes / bytes_per_row)))
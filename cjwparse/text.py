@@ -1,16 +1,102 @@
 import codecs
+import collections
+import concurrent.futures
+import contextlib
 import io
+import itertools
+import mmap
+import multiprocessing
+import struct
+import zipfile
 from pathlib import Path
-from typing import List, Optional
+from typing import (
+    BinaryIO,
+    ContextManager,
+    Deque,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 import cchardet as chardet
+import pyarrow
 
 from cjwmodule.i18n import I18nMessage
 
+from ._transcode import SplittableCodec, decode_to_utf8, lookup_splittable_codec
+from ._util import STDIN_PATH, tempfile_context
+from .compression import DecompressingReader, detect_compression
 from .i18n import _trans_cjwparse
+from .report import ParseReport
 from .settings import DEFAULT_SETTINGS, Settings
 
 UNICODE_BOM = "\uFFFE"
+BUFFER_SIZE = 1024 * 1024
+_MAX_TRANSCODE_PIECE_SIZE = 16 * BUFFER_SIZE
+
+
+_BOM_ENCODINGS = [
+    # UTF-32 before UTF-16: the UTF-16LE BOM is a prefix of the UTF-32LE one
+    (codecs.BOM_UTF32_LE, "UTF-32"),
+    (codecs.BOM_UTF32_BE, "UTF-32"),
+    (codecs.BOM_UTF8, "UTF-8"),
+    (codecs.BOM_UTF16_LE, "UTF-16"),
+    (codecs.BOM_UTF16_BE, "UTF-16"),
+]
+
+
+def _read_encoding_samples(bytesio: BinaryIO, settings: Settings) -> List[bytes]:
+    """
+    Read all of `bytesio` -- or, if it is too large, its head, middle and tail.
+
+    Samples start at multiples of 4 bytes, so UTF-16 and UTF-32 stay aligned.
+    """
+    n_bytes = bytesio.seek(0, io.SEEK_END)
+    max_n_bytes = settings.ENCODING_DETECTION_MAX_BYTES
+    if n_bytes <= max_n_bytes:
+        starts = [0]
+        sample_size = n_bytes
+    else:
+        sample_size = max_n_bytes // 3 // 4 * 4
+        starts = [
+            0,
+            (n_bytes - sample_size) // 2 // 4 * 4,
+            (n_bytes - sample_size) // 4 * 4,
+        ]
+
+    samples = []
+    for start in starts:
+        bytesio.seek(start)
+        samples.append(bytesio.read(sample_size))
+    bytesio.seek(0)
+    return samples
+
+
+_UTF8_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+
+def _is_utf8_sample(sample: bytes, *, is_start: bool, is_end: bool) -> bool:
+    """
+    Return True if `sample` is valid UTF-8 with no NUL bytes.
+
+    Unless `is_start`, `sample` may begin mid-character; unless `is_end`, it
+    may end mid-character.
+    """
+    if b"\x00" in sample:
+        return False  # UTF-16 or UTF-32 without a byte-order marker
+    if not is_start:
+        # Skip the tail of a character that began before the sample
+        text = sample.lstrip(_UTF8_CONTINUATION_BYTES)
+        if len(sample) - len(text) > 3:
+            return False
+        sample = text
+    try:
+        codecs.utf_8_decode(sample, "strict", is_end)
+        return True
+    except UnicodeDecodeError:
+        return False
 
 
 def detect_encoding(
@@ -21,21 +107,42 @@ def detect_encoding(
 
     Peculiarities:
 
-    * Reads file by CHARDET_CHUNK_SIZE defined in settings.py
-    * Stops seeking when detector.done flag True
+    * A UTF-8, UTF-16 or UTF-32 byte-order marker decides the encoding
+    * Reads at most ENCODING_DETECTION_MAX_BYTES defined in settings.py: the
+      whole file if it is small enough; otherwise, samples from its head,
+      middle and tail
+    * Returns "UTF-8" if the samples are valid UTF-8, without consulting
+      chardet
+    * Otherwise, feeds samples to chardet by CHARDET_CHUNK_SIZE, and stops
+      when detector.done flag True
     * Seeks back to beginning of file for downstream usage
-    * Returns "utf-8" in case of empty file or ASCII -- since the parse
+    * Returns "UTF-8" in case of empty file or ASCII -- since the parse
       framework is designed to be UTF-native.
     """
+    bytesio.seek(0)
+    head = bytesio.read(4)
+    bytesio.seek(0)
+    for bom, encoding in _BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+
+    samples = _read_encoding_samples(bytesio, settings)
+    if all(
+        _is_utf8_sample(sample, is_start=(i == 0), is_end=(i == len(samples) - 1))
+        for i, sample in enumerate(samples)
+    ):
+        return "UTF-8"
+
     detector = chardet.UniversalDetector()
-    while not detector.done:
-        chunk = bytesio.read(settings.CHARDET_CHUNK_SIZE)
-        if not chunk:
-            break  # EOF
-        detector.feed(chunk)
+    for sample in samples:
+        for start in range(0, len(sample), settings.CHARDET_CHUNK_SIZE):
+            detector.feed(sample[start : start + settings.CHARDET_CHUNK_SIZE])
+            if detector.done:
+                break
+        if detector.done:
+            break
 
     detector.close()
-    bytesio.seek(0)
     encoding = detector.result["encoding"]
     if encoding is None:
         # There isn't enough data for chardet
@@ -46,6 +153,205 @@ def detect_encoding(
         return encoding
 
 
+class _Transcoder:
+    """
+    Incremental decoder that yields UTF-8 and warns about (and repairs) the
+    first error.
+
+    `pos` is the number of input bytes consumed.
+
+    If `passthrough_ascii` is set, `encoding` must be stateless and map ASCII
+    to ASCII: we copy ASCII-only buffers without decoding.
+    """
+
+    def __init__(
+        self,
+        encoding: str,
+        warnings: List[I18nMessage],
+        *,
+        passthrough_ascii: bool = False,
+    ):
+        # Start with a `strict` decoder. Judging by codecs.py's innards,
+        # we're allowed to change .errors later if we run into an error.
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+        self.decoder.errors = "strict"
+        self.pos = 0  # to build warnings
+        self.warnings = warnings
+        self.n_warnings = len(warnings)
+        self.passthrough_ascii = passthrough_ascii
+
+    def _decode_and_maybe_warn(self, buf: bytes, final: bool) -> str:
+        try:
+            # raise UnicodeError
+            return self.decoder.decode(buf, final)
+        except UnicodeDecodeError as err:
+            # UnicodeDecodeError we can fix with errors='replace'
+            assert (
+                self.decoder.errors == "strict"
+                and len(self.warnings) == self.n_warnings
+            )
+            decoder_state_buf = self.decoder.getstate()[0]
+            self.warnings.append(
+                _trans_cjwparse(
+                    "text.repaired_encoding",
+                    "Encoding error: byte {byte} is invalid {encoding} at position {position}. We replaced invalid bytes with “�”.",
+                    {
+                        "byte": "0x%02X" % (decoder_state_buf + buf)[err.start],
+                        "encoding": err.encoding,
+                        "position": (self.pos - len(decoder_state_buf) + err.start),
+                    },
+                )
+            )
+            self.decoder.errors = "replace"
+            return self.decoder.decode(buf, final)
+        # Any other UnicodeError will be raised
+
+    def transcode(self, buf: bytes) -> bytes:
+        if self.passthrough_ascii and buf.isascii():
+            self.pos += len(buf)
+            return buf
+
+        s = self._decode_and_maybe_warn(buf, False)
+
+        # Remove Unicode byte-order marker (no matter what input encoding)
+        if self.pos == 0 and s.startswith(UNICODE_BOM):
+            s = s[1:]
+
+        self.pos += len(buf)
+        return codecs.utf_8_encode(s)[0]
+
+    def finish(self) -> bytes:
+        return codecs.utf_8_encode(self._decode_and_maybe_warn(b"", True))[0]
+
+
+def _transcode_serially(src_f: BinaryIO, transcoder: _Transcoder) -> Iterator[bytes]:
+    while True:
+        buf = src_f.read(BUFFER_SIZE)
+        if not len(buf):
+            # end of file -- the only way to exit the loop
+            chunk = transcoder.finish()
+            if chunk:
+                yield chunk
+            return
+
+        chunk = transcoder.transcode(buf)
+        if chunk:
+            yield chunk
+
+
+def _transcode_in_parallel(
+    src_f: BinaryIO,
+    transcoder: _Transcoder,
+    codec: SplittableCodec,
+    n_processes: int,
+) -> Iterator[bytes]:
+    """
+    Split `src_f` into pieces and decode them on `n_processes` processes.
+
+    When a piece is invalid, finish with `transcoder` (starting at that
+    piece), so warnings and replacements are the same as ever.
+    """
+    utf8_bom = codecs.utf_8_encode(UNICODE_BOM)[0]
+    # "spawn", not "fork": the caller may be running threads
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_processes, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        pending: Deque[Tuple[bytes, concurrent.futures.Future]] = collections.deque()
+        carry = b""  # bytes after the last split
+        done_reading = False
+        while True:
+            while not done_reading and len(pending) < 2 * n_processes:
+                buf = src_f.read(BUFFER_SIZE)
+                if buf:
+                    data = carry + buf
+                    split = codec.find_split(data)
+                    if split == 0 and len(data) >= _MAX_TRANSCODE_PIECE_SIZE:
+                        # A giant line: don't buffer it. Decode the rest serially.
+                        done_reading = True
+                    piece, carry = data[:split], data[split:]
+                else:
+                    done_reading = True
+                    piece, carry = carry, b""
+                if piece:
+                    future = executor.submit(decode_to_utf8, piece, codec)
+                    pending.append((piece, future))
+
+            if not pending:
+                break
+
+            piece, future = pending.popleft()
+            chunk = future.result()
+            if chunk is None:
+                # Invalid input. Repair it the slow way.
+                for _, future in pending:
+                    future.cancel()
+                pieces = [piece] + [p for p, _ in pending] + [carry]
+                pending.clear()
+                carry = b""
+                for piece in pieces:
+                    chunk = transcoder.transcode(piece)
+                    if chunk:
+                        yield chunk
+                break
+
+            if transcoder.pos == 0 and chunk.startswith(utf8_bom):
+                chunk = chunk[len(utf8_bom) :]
+            transcoder.pos += len(piece)
+            if chunk:
+                yield chunk
+
+    if carry:
+        chunk = transcoder.transcode(carry)
+        if chunk:
+            yield chunk
+    yield from _transcode_serially(src_f, transcoder)
+
+
+def transcode_to_utf8_chunks_and_warn(
+    src_f: BinaryIO,
+    encoding: Optional[str],
+    *,
+    settings: Settings,
+    warnings: List[I18nMessage],
+) -> Iterator[bytes]:
+    """
+    Yield UTF-8 chunks of `src_f`, transcoded if it has a different encoding.
+
+    Remove a starting U+FFFE Unicode byte-order marker, if it exists.
+
+    Recover from errors by inserting U+FFFD. If a recovery occurs, append an
+    I18nMessage to `warnings`.
+
+    With `settings.TRANSCODE_N_PROCESSES > 1`, decode stateless encodings
+    (single-byte ones, Shift_JIS, GBK, Big5, EUC-*, ...) on that many worker
+    processes. Output and warnings are the same either way.
+
+    This is a generator: it reads `src_f` lazily, and it raises lazily.
+
+    Raise LookupError for an `encoding` Python cannot handle.
+
+    Raise UnicodeError upon reaching an unrecoverable error (such as missing
+    byte-order marker in "UTF-16").
+    """
+    if encoding is None:
+        encoding = detect_encoding(src_f, settings=settings)
+
+    codec = lookup_splittable_codec(encoding)
+    transcoder = _Transcoder(
+        encoding,
+        warnings,
+        passthrough_ascii=(
+            codec is not None and codec.is_single_byte and codec.is_ascii_compatible
+        ),
+    )
+    if codec is not None and settings.TRANSCODE_N_PROCESSES > 1:
+        yield from _transcode_in_parallel(
+            src_f, transcoder, codec, settings.TRANSCODE_N_PROCESSES
+        )
+    else:
+        yield from _transcode_serially(src_f, transcoder)
+
+
 def transcode_to_utf8_and_warn(
     src: Path, dest: Path, encoding: Optional[str], *, settings: Settings
 ) -> List[I18nMessage]:
@@ -62,57 +368,405 @@ def transcode_to_utf8_and_warn(
     Raise UnicodeError upon reaching an unrecoverable error (such as missing
     byte-order marker in "UTF-16").
     """
-    BUFFER_SIZE = 1024 * 1024
     warnings = []
 
     with src.open("rb") as src_f, dest.open("wb") as dest_f:
-        if encoding is None:
-            encoding = detect_encoding(src_f, settings=settings)
+        for chunk in transcode_to_utf8_chunks_and_warn(
+            src_f, encoding, settings=settings, warnings=warnings
+        ):
+            dest_f.write(chunk)
 
-        # Start with a `strict` decoder. Judging by codecs.py's innards,
-        # we're allowed to change .errors later if we run into an error.
-        decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
-        decoder.errors = "strict"
-        pos = 0  # to build warnings
-
-        def decode_and_maybe_warn(buf: bytes, final: bool) -> str:
-            nonlocal warnings
-            try:
-                # raise UnicodeError
-                return decoder.decode(buf, final)
-            except UnicodeDecodeError as err:
-                # UnicodeDecodeError we can fix with errors='replace'
-                assert decoder.errors == "strict" and len(warnings) == 0
-                decoder_state_buf = decoder.getstate()[0]
-                warnings.append(
-                    _trans_cjwparse(
-                        "text.repaired_encoding",
-                        "Encoding error: byte {byte} is invalid {encoding} at position {position}. We replaced invalid bytes with “�”.",
-                        {
-                            "byte": "0x%02X" % (decoder_state_buf + buf)[err.start],
-                            "encoding": err.encoding,
-                            "position": (pos - len(decoder_state_buf) + err.start),
-                        },
+    return warnings
+
+
+def peek_chunks(chunks: Iterator[bytes], n_bytes: int) -> Tuple[bytes, Iterator[bytes]]:
+    """
+    Read at least `n_bytes` (or all bytes) from `chunks`.
+
+    Return those bytes, plus an iterator over _all_ the bytes (starting with
+    the ones we just read).
+    """
+    head_chunks = []
+    n_head_bytes = 0
+    for chunk in chunks:
+        head_chunks.append(chunk)
+        n_head_bytes += len(chunk)
+        if n_head_bytes >= n_bytes:
+            break
+    head = b"".join(head_chunks)
+    return head, itertools.chain([head], chunks)
+
+
+def _is_valid_utf8(buf) -> bool:
+    """
+    Return True if `buf` (any buffer-protocol object) holds valid UTF-8.
+
+    This is a single pass over `buf` in Arrow's C++ UTF-8 validator. It does not
+    copy or decode.
+    """
+    # A one-value large_string array whose value is the entire buffer
+    offsets = pyarrow.py_buffer(struct.pack("<qq", 0, len(buf)))
+    array = pyarrow.LargeStringArray.from_buffers(1, offsets, pyarrow.py_buffer(buf))
+    try:
+        array.validate(full=True)
+        return True
+    except pyarrow.ArrowInvalid:
+        return False
+
+
+def _utf8_character_boundary(buf, n: int) -> int:
+    """
+    Return the last offset at or before `n` that doesn't split a UTF-8
+    character in `buf`. (`n` must be less than `len(buf)`.)
+
+    If `buf` isn't valid UTF-8 there, return `n`: the validator will reject it.
+    """
+    for offset in range(n, max(0, n - 3) - 1, -1):
+        if buf[offset] & 0xC0 != 0x80:  # not a continuation byte
+            return offset
+    return n
+
+
+def _find_utf8_text_range(
+    path: Path, encoding: Optional[str], max_n_bytes: Optional[int]
+) -> Optional[Tuple[int, int]]:
+    """
+    Return where UTF-8 text starts and ends in `path`, or `None` if we must
+    transcode.
+
+    The start is 3 if the file starts with a UTF-8 byte-order marker, else 0.
+
+    The end is the file size -- or, if the file is longer than `max_n_bytes`,
+    the last character boundary at or before `max_n_bytes`. We only validate
+    the bytes before the end.
+
+    We only consider `path` to be UTF-8 if `encoding` says it is -- or if
+    `encoding` is `None` (meaning, "detect") and the file is valid UTF-8 with no
+    NUL bytes. (UTF-16 text without a byte-order marker can be valid UTF-8, but
+    it is riddled with NUL bytes.)
+    """
+    if encoding is not None and codecs.lookup(encoding).name not in (
+        "utf-8",
+        "utf-8-sig",
+    ):
+        return None
+
+    with path.open("rb") as f:
+        n_bytes = path.stat().st_size
+        if n_bytes == 0:
+            return 0, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if max_n_bytes is not None and n_bytes > max_n_bytes:
+                end = _utf8_character_boundary(mm, max_n_bytes)
+            else:
+                end = n_bytes
+            if encoding is None and mm.find(b"\x00", 0, end) != -1:
+                return None
+            with memoryview(mm) as view, view[:end] as text:
+                if not _is_valid_utf8(text):
+                    return None
+            if mm[: min(end, len(codecs.BOM_UTF8))] == codecs.BOM_UTF8:
+                return len(codecs.BOM_UTF8), end
+            else:
+                return 0, end
+
+
+class _PrefixReader:
+    """
+    Read-only view of the first `n_bytes` bytes of binary file `f`.
+
+    Supports just what our readers need: `read()`, `seek()` and `tell()`.
+    """
+
+    def __init__(self, f: BinaryIO, n_bytes: int):
+        self._f = f
+        self._n_bytes = n_bytes
+
+    def read(self, size: int = -1) -> bytes:
+        n_remaining = max(0, self._n_bytes - self._f.tell())
+        if size < 0 or size > n_remaining:
+            size = n_remaining
+        return self._f.read(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_END:
+            return self._f.seek(self._n_bytes + offset)
+        return self._f.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+
+class Utf8Input(NamedTuple):
+    """
+    UTF-8 input for an arrow-tools program.
+    """
+
+    path: str
+    """
+    Path to pass to the program. May be `STDIN_PATH`.
+    """
+
+    head: bytes
+    """
+    Some bytes from the beginning of the UTF-8 text, for sniffing.
+    """
+
+    stdin_chunks: Optional[Iterator[bytes]]
+    """
+    Chunks of UTF-8 to stream to the program's stdin, if `path` is `STDIN_PATH`.
+    """
+
+    encoding: str
+    """
+    Encoding we read the input as: the caller's, or the one we detected.
+    """
+
+
+@contextlib.contextmanager
+def utf8_input_context(
+    path: Path,
+    encoding: Optional[str],
+    *,
+    settings: Settings,
+    warnings: List[I18nMessage],
+    n_head_bytes: int,
+    max_n_bytes: Optional[int] = None,
+    report: Optional[ParseReport] = None,
+    zip_member: Optional[str] = None,
+    seekable: bool = False,
+) -> ContextManager[Utf8Input]:
+    """
+    Provide the text file at `path` as UTF-8 for an arrow-tools program.
+
+    If `max_n_bytes` is set, only read that many bytes of `path`. (The caller
+    should warn if this truncates anything.) If those bytes are UTF-8, we cut
+    at the last character boundary, so the text stays valid; otherwise we
+    truncate while transcoding.
+
+    If `path` is gzip-, bzip2-, xz- or zstd-compressed (judging by its first
+    bytes), we decompress it as we transcode. Then `max_n_bytes` (capped at
+    `settings.MAX_DECOMPRESSED_BYTES`) counts decompressed bytes: we stop
+    decompressing there, and append a warning to `warnings` if we stopped
+    early.
+
+    If `zip_member` is set, `path` is a ZIP archive: read the member of that
+    name, decompressing it the same way.
+
+    If compressed input (or a ZIP member) is corrupt or truncated, we stop
+    decompressing at the error, keep the text before it, and append a warning
+    to `warnings`.
+
+    If `seekable` is set, the caller needs a file it can seek within: never
+    stream.
+
+    In order of preference:
+
+    1. If `path` is valid UTF-8 (with no byte-order marker) and isn't
+       truncated, the program reads `path` itself. We don't copy or decode
+       anything.
+    2. If `path` is valid UTF-8 with a byte-order marker, or is truncated, we
+       copy the UTF-8 bytes as they are: after the marker, up to the cut.
+    3. Otherwise, we transcode (see `transcode_to_utf8_chunks_and_warn()`),
+       appending any warnings to `warnings`.
+
+    Cases 2 and 3 -- and all compressed input -- write to a temporary file;
+    or, with `settings.STREAM_TEXT_TO_ARROW_TOOLS` (and not `seekable`),
+    stream to the program's stdin.
+
+    If `report` is set, record "validate_utf8", "detect_encoding" and
+    "transcode" stages in it.
+
+    Raise LookupError for an `encoding` Python cannot handle.
+
+    Raise UnicodeError upon reaching an unrecoverable error (such as missing
+    byte-order marker in "UTF-16").
+
+    Raise ImportError for zstd input when the `zstandard` module is missing.
+    """
+    if report is None:
+        report = ParseReport()
+
+    if zip_member is not None:
+        compression = None
+    else:
+        compression = detect_compression(path)
+    if zip_member is not None or compression is not None:
+        if max_n_bytes is None:
+            max_n_bytes = settings.MAX_DECOMPRESSED_BYTES
+        else:
+            max_n_bytes = min(max_n_bytes, settings.MAX_DECOMPRESSED_BYTES)
+        with contextlib.ExitStack() as ctx:
+            if zip_member is not None:
+                zf = ctx.enter_context(zipfile.ZipFile(path))
+                try:
+                    compressed_f = ctx.enter_context(zf.open(zip_member))
+                except zipfile.BadZipFile as err:
+                    # e.g., corrupt local file header: parse nothing
+                    warnings.append(
+                        _trans_cjwparse(
+                            "file.invalid_zip",
+                            "This ZIP file is invalid. Please try a different file. (Debugging message: “{message}”)",
+                            {"message": str(err)},
+                        )
                     )
+                    compressed_f = io.BytesIO()
+            else:
+                compressed_f = ctx.enter_context(compression.open(path))
+            yield ctx.enter_context(
+                _decompressed_utf8_input_context(
+                    compressed_f,
+                    encoding,
+                    settings=settings,
+                    warnings=warnings,
+                    n_head_bytes=n_head_bytes,
+                    max_n_bytes=max_n_bytes,
+                    report=report,
+                    stream=settings.STREAM_TEXT_TO_ARROW_TOOLS and not seekable,
                 )
-                decoder.errors = "replace"
-                return decoder.decode(buf, final)
-            # Any other UnicodeError will be raised
+            )
+        return
 
-        while True:
-            buf = src_f.read(BUFFER_SIZE)
-            if not len(buf):
-                # end of file -- the only way to exit the loop
-                s = decode_and_maybe_warn(b"", True)
-                dest_f.write(codecs.utf_8_encode(s)[0])
-                return warnings
+    with contextlib.ExitStack() as ctx:
+        n_bytes = path.stat().st_size
+        is_truncated = max_n_bytes is not None and n_bytes > max_n_bytes
+        if is_truncated:
+            n_bytes = max_n_bytes
+        with report.stage("validate_utf8", n_bytes_in=n_bytes):
+            text_range = _find_utf8_text_range(path, encoding, max_n_bytes)
+
+        if not is_truncated and text_range == (0, n_bytes):
+            with path.open("rb") as f:
+                head = f.read(n_head_bytes)
+            yield Utf8Input(path.as_posix(), head, None, encoding or "utf-8")
+            return
+
+        src_f = ctx.enter_context(path.open("rb"))
+        if text_range is None:
+            if is_truncated:
+                src_f = _PrefixReader(src_f, max_n_bytes)
+            if encoding is None:
+                with report.stage("detect_encoding"):
+                    encoding = detect_encoding(src_f, settings=settings)
+            chunks = transcode_to_utf8_chunks_and_warn(
+                src_f, encoding, settings=settings, warnings=warnings
+            )
+        else:
+            if encoding is None:
+                encoding = "utf-8"
+            start, end = text_range
+            src_f = _PrefixReader(src_f, end)
+            src_f.seek(start)
+            chunks = iter(lambda: src_f.read(BUFFER_SIZE), b"")
+        report.add("transcode", 0.0, 0.0, n_bytes_in=n_bytes)
+        chunks = report.timed_chunks("transcode", chunks)
+
+        yield ctx.enter_context(
+            _utf8_chunks_input_context(
+                chunks,
+                encoding,
+                stream=settings.STREAM_TEXT_TO_ARROW_TOOLS and not seekable,
+                n_head_bytes=n_head_bytes,
+            )
+        )
 
-            s = decode_and_maybe_warn(buf, False)
 
-            # Remove Unicode byte-order marker (no matter what input encoding)
-            if pos == 0 and s[0] == UNICODE_BOM:
-                s = s[1:]
+@contextlib.contextmanager
+def _utf8_chunks_input_context(
+    chunks: Iterator[bytes],
+    encoding: str,
+    *,
+    stream: bool,
+    n_head_bytes: int,
+) -> ContextManager[Utf8Input]:
+    """
+    Provide UTF-8 `chunks` to an arrow-tools program: as a temporary file or,
+    if `stream`, as stdin.
+    """
+    # raises LookupError, UnicodeError -- in this thread, before any
+    # arrow-tools program starts
+    head, chunks = peek_chunks(chunks, n_head_bytes)
+
+    if stream:
+        yield Utf8Input(STDIN_PATH, head, chunks, encoding)
+    else:
+        with tempfile_context(prefix="utf8-", suffix=".txt") as utf8_path:
+            with utf8_path.open("wb") as dest_f:
+                for chunk in chunks:
+                    dest_f.write(chunk)
+            yield Utf8Input(utf8_path.as_posix(), head, None, encoding)
+
 
-            dest_f.write(codecs.utf_8_encode(s)[0])
+def _report_decompressed_chunks(
+    chunks: Iterator[bytes],
+    src_f: DecompressingReader,
+    *,
+    warnings: List[I18nMessage],
+    report: ParseReport,
+) -> Iterator[bytes]:
+    """
+    Yield `chunks`; then record how many bytes we decompressed, and warn if
+    we stopped early.
+    """
+    yield from chunks
+    report.add("transcode", 0.0, 0.0, n_bytes_in=src_f.n_bytes)
+    if src_f.is_truncated:
+        warnings.append(
+            _trans_cjwparse(
+                "text.truncated_decompressed_file",
+                "Stopped decompressing after {max_n_bytes} bytes (the maximum) and ignored the rest of the file",
+                {"max_n_bytes": src_f.n_bytes},
+            )
+        )
+    if src_f.error is not None:
+        warnings.append(
+            _trans_cjwparse(
+                "text.corrupt_compressed_file",
+                "Stopped decompressing after {n_bytes} bytes, because the file is corrupt or truncated. (Debugging message: “{message}”)",
+                {"n_bytes": src_f.n_bytes, "message": str(src_f.error)},
+            )
+        )
+
+
+@contextlib.contextmanager
+def _decompressed_utf8_input_context(
+    compressed_f: BinaryIO,
+    encoding: Optional[str],
+    *,
+    settings: Settings,
+    warnings: List[I18nMessage],
+    n_head_bytes: int,
+    max_n_bytes: int,
+    report: ParseReport,
+    stream: bool,
+) -> ContextManager[Utf8Input]:
+    """
+    `utf8_input_context()` for a decompressing file object.
+
+    We can't seek within compressed input, so we detect its encoding from its
+    first bytes; and we always transcode, because we can't hand the program a
+    UTF-8 file without writing one. If `stream`, we don't write one: the
+    program reads the text from stdin.
+    """
+    src_f = DecompressingReader(compressed_f, max_n_bytes)
+    if encoding is None:
+        with report.stage("detect_encoding"):
+            head = src_f.peek(settings.ENCODING_DETECTION_MAX_BYTES)
+            encoding = detect_encoding(io.BytesIO(head), settings=settings)
+    if codecs.lookup(encoding).name == "utf-8":
+        # The uncompressed path skips a UTF-8 byte-order marker; so do we
+        transcode_encoding = "utf-8-sig"
+    else:
+        transcode_encoding = encoding
 
-            pos += len(buf)
+    chunks = transcode_to_utf8_chunks_and_warn(
+        src_f, transcode_encoding, settings=settings, warnings=warnings
+    )
+    chunks = report.timed_chunks("transcode", chunks)
+    chunks = _report_decompressed_chunks(
+        chunks, src_f, warnings=warnings, report=report
+    )
+    with _utf8_chunks_input_context(
+        chunks, encoding, stream=stream, n_head_bytes=n_head_bytes
+    ) as utf8_input:
+        yield utf8_input
@@ -0,0 +1,290 @@
+"""
+Time every parse path on synthetic data from `cjwparse.testing.data`.
+
+Usage: `python3 -m maintenance.benchmark [--filter REGEX] [--repeat N]
+[--output results.json] [--compare baseline.json]`
+
+Each benchmark is an asv-style `time_*` function: setup (writing data files)
+happens outside the timed region, and we record the minimum and median of
+`--repeat` runs. Results go to a JSON file (with the cjwparse version, git
+commit and machine details), so runs can be compared over time:
+
+    python3 -m maintenance.benchmark --output before.json
+    # ... change code ...
+    python3 -m maintenance.benchmark --output after.json --compare before.json
+
+Benchmarks that need a missing arrow-tools program are reported as
+unavailable.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, NamedTuple
+
+import pyarrow
+
+import cjwparse
+from cjwparse._util import tempfile_context
+from cjwparse.api import parse_file
+from cjwparse.csv import (
+    _autocast_column,
+    _nix_utf8_chunk_empty_strings,
+    detect_delimiter,
+)
+from cjwparse.excel import probe_xlsx
+from cjwparse.postprocess import dictionary_encode_columns
+from cjwparse.settings import DEFAULT_SETTINGS, Settings
+from cjwparse.testing.data import (
+    DataSpec,
+    generate_rows,
+    spec_for_size,
+    write_csv,
+    write_json,
+    write_xlsx,
+)
+from cjwparse.text import detect_encoding, transcode_to_utf8_and_warn
+
+MEDIUM = spec_for_size(DataSpec(n_columns=10), 10 * 1024 * 1024)
+LOW_CARDINALITY = MEDIUM._replace(cardinality=20)
+TEXT_ONLY = MEDIUM._replace(numeric_ratio=0.0)
+NUMBERS_ONLY = MEDIUM._replace(numeric_ratio=1.0)
+WIDE = spec_for_size(DataSpec(n_columns=500), 10 * 1024 * 1024)
+
+
+class Benchmark(NamedTuple):
+    name: str
+    setup: Callable[[], ContextManager[Callable[[], Any]]]
+    """
+    Context manager that prepares data and yields the function to time.
+    """
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str):
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name, contextlib.contextmanager(setup)))
+        return setup
+
+    return decorator
+
+
+@contextlib.contextmanager
+def _data_file(suffix: str, write: Callable[[Path], None]) -> Iterator[Path]:
+    with tempfile_context(suffix=suffix) as path:
+        write(path)
+        yield path
+
+
+def _parse_file_benchmark(
+    name: str,
+    suffix: str,
+    write: Callable[[Path], None],
+    settings: Settings = DEFAULT_SETTINGS,
+) -> None:
+    @benchmark("time_parse_file." + name)
+    def setup():
+        with _data_file(suffix, write) as path, tempfile_context() as output_path:
+            yield lambda: parse_file(path, output_path=output_path, settings=settings)
+
+
+_parse_file_benchmark("csv_utf8", ".csv", lambda p: write_csv(p, MEDIUM))
+_parse_file_benchmark(
+    "csv_utf8_pyarrow",
+    ".csv",
+    lambda p: write_csv(p, MEDIUM),
+    Settings(CSV_ENGINE="pyarrow"),
+)
+_parse_file_benchmark(
+    "csv_windows1252",
+    ".csv",
+    lambda p: write_csv(p, MEDIUM, encoding="windows-1252"),
+)
+_parse_file_benchmark(
+    "tsv_utf16",
+    ".tsv",
+    lambda p: write_csv(p, MEDIUM, delimiter="\t", encoding="utf-16"),
+)
+_parse_file_benchmark(
+    "csv_low_cardinality", ".csv", lambda p: write_csv(p, LOW_CARDINALITY)
+)
+_parse_file_benchmark("csv_wide", ".csv", lambda p: write_csv(p, WIDE))
+_parse_file_benchmark(
+    "txt_sniff_delimiter", ".txt", lambda p: write_csv(p, MEDIUM, delimiter=";")
+)
+_parse_file_benchmark("json", ".json", lambda p: write_json(p, MEDIUM))
+_parse_file_benchmark("jsonl", ".jsonl", lambda p: write_json(p, MEDIUM, lines=True))
+_parse_file_benchmark(
+    "jsonl_1_process",
+    ".jsonl",
+    lambda p: write_json(p, MEDIUM, lines=True),
+    Settings(JSONL_N_PROCESSES=1),
+)
+_parse_file_benchmark(
+    "xlsx", ".xlsx", lambda p: write_xlsx(p, MEDIUM._replace(n_rows=20000))
+)
+
+
+def _text_column(spec: DataSpec, index: int) -> pyarrow.ChunkedArray:
+    rows = generate_rows(spec)[1:]
+    return pyarrow.chunked_array([[row[index] for row in rows]], pyarrow.utf8())
+
+
+@benchmark("time_autocast_column.numbers")
+def setup_autocast_numbers():
+    column = _text_column(NUMBERS_ONLY, 0)
+    yield lambda: _autocast_column(column)
+
+
+@benchmark("time_autocast_column.text")
+def setup_autocast_text():
+    column = _text_column(TEXT_ONLY, 0)
+    yield lambda: _autocast_column(column)
+
+
+@benchmark("time_nix_utf8_chunk_empty_strings")
+def setup_nix_empty_strings():
+    chunk = pyarrow.array(
+        [("" if i % 3 == 0 else str(i)) for i in range(MEDIUM.n_rows)], pyarrow.utf8()
+    )
+    yield lambda: _nix_utf8_chunk_empty_strings(chunk)
+
+
+@benchmark("time_dictionary_encode_columns.low_cardinality")
+def setup_dictionary_encode_low_cardinality():
+    rows = generate_rows(LOW_CARDINALITY._replace(numeric_ratio=0.0))
+    table = pyarrow.table(
+        {name: [row[i] for row in rows[1:]] for i, name in enumerate(rows[0])}
+    )
+    yield lambda: dictionary_encode_columns(table, settings=DEFAULT_SETTINGS)
+
+
+@benchmark("time_dictionary_encode_columns.high_cardinality")
+def setup_dictionary_encode_high_cardinality():
+    rows = generate_rows(TEXT_ONLY)
+    table = pyarrow.table(
+        {name: [row[i] for row in rows[1:]] for i, name in enumerate(rows[0])}
+    )
+    yield lambda: dictionary_encode_columns(table, settings=DEFAULT_SETTINGS)
+
+
+@benchmark("time_detect_encoding.windows1252")
+def setup_detect_encoding():
+    with _data_file(
+        ".csv", lambda p: write_csv(p, MEDIUM, encoding="windows-1252")
+    ) as path:
+        with path.open("rb") as f:
+            yield lambda: detect_encoding(f)
+
+
+@benchmark("time_detect_delimiter")
+def setup_detect_delimiter():
+    with _data_file(".txt", lambda p: write_csv(p, MEDIUM, delimiter=";")) as path:
+        yield lambda: detect_delimiter(path, DEFAULT_SETTINGS)
+
+
+@benchmark("time_transcode_to_utf8_and_warn.windows1252")
+def setup_transcode():
+    with _data_file(
+        ".csv", lambda p: write_csv(p, MEDIUM, encoding="windows-1252")
+    ) as path, tempfile_context() as dest:
+        yield lambda: transcode_to_utf8_and_warn(
+            path, dest, "windows-1252", settings=DEFAULT_SETTINGS
+        )
+
+
+@benchmark("time_probe_xlsx")
+def setup_probe_xlsx():
+    with _data_file(
+        ".xlsx", lambda p: write_xlsx(p, MEDIUM._replace(n_rows=20000))
+    ) as path:
+        yield lambda: probe_xlsx(path)
+
+
+def _run(bench: Benchmark, n_repeats: int) -> Dict[str, Any]:
+    with bench.setup() as fn:
+        durations = []
+        for _ in range(n_repeats):
+            start = time.perf_counter()
+            try:
+                fn()
+            except FileNotFoundError as err:
+                return {"unavailable": str(err)}  # missing arrow-tools program
+            durations.append(time.perf_counter() - start)
+    return {
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "n_repeats": n_repeats,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _format_result(result: Dict[str, Any]) -> str:
+    if "unavailable" in result:
+        return "unavailable"
+    return "%9.2fms (min %9.2fms)" % (result["median"] * 1000, result["min"] * 1000)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--filter", default="", help="regex of benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="JSON results to compare to")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())["results"]
+
+    results = {}
+    for bench in BENCHMARKS:
+        if not re.search(args.filter, bench.name):
+            continue
+        result = _run(bench, args.repeat)
+        results[bench.name] = result
+        line = "%-50s %s" % (bench.name, _format_result(result))
+        old = baseline.get(bench.name, {})
+        if "median" in old and "median" in result:
+            line += "  %5.2fx baseline" % (result["median"] / old["median"])
+        print(line, flush=True)
+
+    if args.output:
+        document = {
+            "cjwparse_version": cjwparse.__version__,
+            "git_commit": _git_commit(),
+            "date": datetime.datetime.utcnow().isoformat() + "Z",
+            "machine": {
+                "python": platform.python_version(),
+                "pyarrow": pyarrow.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "results": results,
+        }
+        args.output.write_text(json.dumps(document, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare `Settings.CSV_ENGINE="pyarrow"` with `"csv-to-arrow"`.
+
+Usage: `python3 -m maintenance.benchmark_csv_engines [N_REPEATS]`
+
+Prints median `_parse_csv()` latency for synthetic CSVs of several sizes.
+The "csv-to-arrow" engine needs `/usr/bin/csv-to-arrow`; without it, we only
+time "pyarrow".
+"""
+import dataclasses
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from cjwparse._util import tempfile_context
+from cjwparse.csv import _parse_csv
+from cjwparse.settings import Settings
+
+SIZES = [
+    ("tiny", 10, 3),
+    ("small", 1000, 10),
+    ("medium", 100_000, 10),
+    ("wide", 10_000, 500),
+]
+
+
+def _generate_csv(path: Path, n_rows: int, n_columns: int) -> None:
+    rng = random.Random(1)
+    words = ["foo", "bar", '"quoted, value"', "1", "2.5", "-3", ""]
+    with path.open("w", encoding="utf-8") as f:
+        f.write(",".join("Column %d" % i for i in range(n_columns)) + "\n")
+        for _ in range(n_rows):
+            f.write(",".join(rng.choice(words) for _ in range(n_columns)) + "\n")
+
+
+def _time_engine(path: Path, engine: str, n_repeats: int) -> Optional[float]:
+    settings = dataclasses.replace(Settings(), CSV_ENGINE=engine)
+    durations = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        try:
+            _parse_csv(
+                path,
+                settings=settings,
+                encoding="utf-8",
+                delimiter=",",
+                has_header=True,
+                autoconvert_text_to_numbers=True,
+            )
+        except FileNotFoundError:
+            return None  # no /usr/bin/csv-to-arrow
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main(n_repeats: int = 5) -> None:
+    for name, n_rows, n_columns in SIZES:
+        with tempfile_context(suffix=".csv") as path:
+            _generate_csv(path, n_rows, n_columns)
+            n_bytes = path.stat().st_size
+            results = []
+            for engine in ["pyarrow", "csv-to-arrow"]:
+                duration = _time_engine(path, engine, n_repeats)
+                if duration is None:
+                    results.append("%s: unavailable" % engine)
+                else:
+                    results.append("%s: %8.2fms" % (engine, duration * 1000))
+            print("%-7s %10d bytes  %s" % (name, n_bytes, "  ".join(results)))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,95 @@
+"""
+Compare `cjwparse.csv.detect_dialect()` with `csv.Sniffer` on synthetic CSVs.
+
+Usage: `python3 -m maintenance.benchmark_detect_delimiter [N_SAMPLES]`
+
+Prints accuracy (did we guess the delimiter we generated with?) and median
+latency for both detectors.
+"""
+import csv
+import io
+import random
+import statistics
+import sys
+import time
+from typing import Callable, List, Tuple
+
+from cjwparse.csv import detect_dialect
+
+DELIMITERS = [",", "\t", ";"]
+LINETERMINATORS = ["\n", "\r\n"]
+WORDS = ["foo", "bar", "Baz", "a b", "1", "2.5", "-3", "2021-05-04", "x;y", "p,q"]
+
+
+def _generate_csv(rng: random.Random) -> Tuple[str, str]:
+    """
+    Return (delimiter, csv_text).
+    """
+    delimiter = rng.choice(DELIMITERS)
+    n_columns = rng.randint(1, 60)
+    n_rows = rng.randint(1, 200)
+    ragged = rng.random() < 0.2
+    out = io.StringIO()
+    writer = csv.writer(
+        out,
+        delimiter=delimiter,
+        lineterminator=rng.choice(LINETERMINATORS),
+        quoting=rng.choice([csv.QUOTE_MINIMAL, csv.QUOTE_ALL]),
+    )
+    for _ in range(n_rows):
+        n = rng.randint(1, n_columns) if ragged else n_columns
+        row = [rng.choice(WORDS) for _ in range(n)]
+        if rng.random() < 0.05:
+            row[0] += "\nwith newline"
+        writer.writerow(row)
+    return delimiter, out.getvalue()
+
+
+def _sniff(text: str) -> str:
+    try:
+        return csv.Sniffer().sniff(text, ",;\t").delimiter
+    except csv.Error:
+        return ","
+
+
+def _detect(text: str) -> str:
+    return detect_dialect(text.encode("utf-8")).delimiter
+
+
+def _measure(
+    detector: Callable[[str], str], samples: List[Tuple[str, str]]
+) -> Tuple[float, float]:
+    """
+    Return (accuracy, median_seconds).
+    """
+    n_correct = 0
+    durations = []
+    for expected, text in samples:
+        start = time.perf_counter()
+        actual = detector(text)
+        durations.append(time.perf_counter() - start)
+        if actual == expected:
+            n_correct += 1
+    return n_correct / len(samples), statistics.median(durations)
+
+
+def main(n_samples: int = 500) -> None:
+    rng = random.Random(1)
+    samples = [_generate_csv(rng) for _ in range(n_samples)]
+    # A few 1MB-ish wide samples, to measure worst-case latency
+    wide = [
+        (",", (",".join(["value"] * 2000) + "\n") * 50),
+        (";", (";".join(['"quoted, value"'] * 2000) + "\n") * 30),
+    ]
+
+    for name, detector in [("detect_dialect", _detect), ("csv.Sniffer", _sniff)]:
+        accuracy, median = _measure(detector, samples)
+        _, wide_median = _measure(detector, wide)
+        print(
+            "%-15s accuracy %5.1f%%  median %8.3fms  wide-sample median %8.3fms"
+            % (name, accuracy * 100, median * 1000, wide_median * 1000)
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
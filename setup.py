@@ -65,6 +65,7 @@ setup(
     extras_require={
         "tests": ["numpy", "pytest~=6.0", "pytest-asyncio~=0.14.0"],
         "maintenance": ["babel~=2.9.0"],
+        "zstd": ["zstandard"],
     },
     cmdclass={"extract_messages": ExtractMessagesCommand},
 )
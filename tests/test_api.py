@@ -1,14 +1,26 @@
+import asyncio
+import bz2
+import concurrent.futures
 import contextlib
+import gzip
+import lzma
+import os
 import unittest
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import ContextManager, List, Tuple
+from typing import ContextManager, Dict, List, Tuple
+from unittest.mock import patch
 
 import pyarrow
 
+import cjwparse.api
+import cjwparse.text
 from cjwmodule.i18n import I18nMessage
 from cjwparse._util import tempfile_context
-from cjwparse.api import parse_file
+from cjwparse.api import ParseFilesJob, parse_file, parse_file_async, parse_files
 from cjwparse.mime import MimeType
+from cjwparse.settings import Settings
 
 from .util import assert_arrow_table_equals
 
@@ -33,6 +45,17 @@ def _data_file(b: bytes, *, suffix: str = "") -> ContextManager[Path]:
         yield data_path
 
 
+@contextlib.contextmanager
+def _zip_file(
+    members: Dict[str, bytes], *, compression: int = zipfile.ZIP_DEFLATED
+) -> ContextManager[Path]:
+    with tempfile_context(".input", suffix=".zip") as zip_path:
+        with zipfile.ZipFile(zip_path, "w", compression) as zf:
+            for name, data in members.items():
+                zf.writestr(name, data)
+        yield zip_path
+
+
 class ApiTests(unittest.TestCase):
     def test_detect_csv_by_suffix(self):
         with _data_file(b"A,B\nx,y\nz,a", suffix=".csv") as csv_path:
@@ -134,9 +157,416 @@ class ApiTests(unittest.TestCase):
             errors, [I18nMessage("file.unknown_ext", {"ext": ".bin"}, "cjwparse")]
         )
 
+    def test_detect_csv_gz_by_suffix(self):
+        with _data_file(gzip.compress(b"A,B\nx,y"), suffix=".csv.gz") as path:
+            table, errors = call_parse_file(
+                path, settings=Settings(CSV_ENGINE="pyarrow")
+            )
+        assert_arrow_table_equals(table, {"A": ["x"], "B": ["y"]})
+        self.assertEqual(errors, [])
+
+    def test_decompress_bzip2_and_xz(self):
+        for compress in (bz2.compress, lzma.compress):
+            with self.subTest(compress=compress):
+                with _data_file(compress(b"A\tB\nx\ty"), suffix=".tsv") as path:
+                    table, errors = call_parse_file(
+                        path, settings=Settings(CSV_ENGINE="pyarrow")
+                    )
+                assert_arrow_table_equals(table, {"A": ["x"], "B": ["y"]})
+                self.assertEqual(errors, [])
+
+    def test_decompress_and_detect_encoding(self):
+        with _data_file(
+            gzip.compress("A\ncafé".encode("windows-1252")), suffix=".csv"
+        ) as path:
+            table, errors = call_parse_file(
+                path, settings=Settings(CSV_ENGINE="pyarrow")
+            )
+        assert_arrow_table_equals(table, {"A": ["café"]})
+        self.assertEqual(errors, [])
+
+    def test_decompress_and_skip_utf8_bom(self):
+        with _data_file(gzip.compress(b"\xef\xbb\xbfA\nx"), suffix=".csv") as path:
+            table, errors = call_parse_file(
+                path, settings=Settings(CSV_ENGINE="pyarrow")
+            )
+        assert_arrow_table_equals(table, {"A": ["x"]})
+        self.assertEqual(errors, [])
+
+    def test_decompress_max_csv_bytes(self):
+        with _data_file(gzip.compress(b"A\n" + b"x\n" * 1000), suffix=".csv") as path:
+            table, errors = call_parse_file(
+                path, settings=Settings(CSV_ENGINE="pyarrow", MAX_CSV_BYTES=6)
+            )
+        self.assertEqual(table["A"].to_pylist(), ["x", "x"])
+        self.assertEqual(
+            errors,
+            [
+                I18nMessage(
+                    "text.truncated_decompressed_file", {"max_n_bytes": 6}, "cjwparse"
+                )
+            ],
+        )
+
+    def test_decompress_truncated_file(self):
+        data = b"A\n" + b"".join(b"%d\n" % i for i in range(100000))
+        for compress in (
+            gzip.compress,
+            lambda b: bz2.compress(b, 1),  # many blocks: we keep the first ones
+            lzma.compress,
+        ):
+            with self.subTest(compress=compress):
+                compressed = compress(data)
+                with _data_file(
+                    compressed[: len(compressed) // 2], suffix=".csv"
+                ) as path:
+                    table, errors = call_parse_file(
+                        path, settings=Settings(CSV_ENGINE="pyarrow")
+                    )
+                values = table["A"].to_pylist()
+                self.assertGreater(len(values), 0)
+                # The last row may be cut mid-number
+                self.assertEqual(values[:-1], list(range(len(values) - 1)))
+                self.assertTrue(str(len(values) - 1).startswith(str(values[-1])))
+                self.assertEqual(
+                    [error.id for error in errors], ["text.corrupt_compressed_file"]
+                )
+                self.assertEqual(
+                    errors[0].arguments["message"],
+                    "Compressed file ended before the end-of-stream marker was reached",
+                )
+
+    def test_decompress_corrupt_gzip(self):
+        with _data_file(b"\x1f\x8b" + b"garbage" * 10, suffix=".csv.gz") as path:
+            table, errors = call_parse_file(path)  # default engine
+        assert_arrow_table_equals(table, {})
+        self.assertEqual(
+            errors,
+            [
+                I18nMessage(
+                    "text.corrupt_compressed_file",
+                    {"n_bytes": 0, "message": "Unknown compression method"},
+                    "cjwparse",
+                )
+            ],
+        )
+
+    def test_compressed_xlsx_is_unsupported(self):
+        xlsx = (TestDataPath / "test.xlsx").read_bytes()
+        with _data_file(gzip.compress(xlsx), suffix=".xlsx.gz") as path:
+            table, errors = call_parse_file(path)
+        assert_arrow_table_equals(table, {})
+        self.assertEqual(
+            errors,
+            [
+                I18nMessage(
+                    "file.unsupported_compression", {"compression": "gzip"}, "cjwparse"
+                )
+            ],
+        )
+
+    def test_parse_largest_zip_member(self):
+        with _zip_file(
+            {"notes.pdf": b"x" * 100, "a.csv": b"A\nx", "b.tsv": b"B\tC\ny\tz"}
+        ) as path:
+            table, errors = call_parse_file(
+                path, settings=Settings(CSV_ENGINE="pyarrow")
+            )
+        assert_arrow_table_equals(table, {"B": ["y"], "C": ["z"]})
+        self.assertEqual(errors, [])
+
+    def test_parse_zip_member_by_name(self):
+        with _zip_file({"a.csv": b"A\nx", "b.tsv": b"B\tC\ny\tz"}) as path:
+            table, errors = call_parse_file(
+                path, zip_member="a.csv", settings=Settings(CSV_ENGINE="pyarrow")
+            )
+        assert_arrow_table_equals(table, {"A": ["x"]})
+        self.assertEqual(errors, [])
+
+    def test_stream_zip_member_without_extracting_it(self):
+        with _zip_file({"a.csv": b"A\nx"}) as path:
+            with patch.object(
+                cjwparse.text,
+                "tempfile_context",
+                side_effect=AssertionError("extracted the ZIP member"),
+            ):
+                table, errors = call_parse_file(
+                    path, settings=Settings(CSV_ENGINE="pyarrow")
+                )
+        assert_arrow_table_equals(table, {"A": ["x"]})
+        self.assertEqual(errors, [])
+
+    def test_zip_member_not_found(self):
+        with _zip_file({"a.csv": b"A\nx"}) as path:
+            table, errors = call_parse_file(path, zip_member="b.csv")
+        assert_arrow_table_equals(table, {})
+        self.assertEqual(
+            errors,
+            [I18nMessage("file.zip_member_not_found", {"name": "b.csv"}, "cjwparse")],
+        )
+
+    def test_zip_without_data_file(self):
+        with _zip_file({"notes.pdf": b"%PDF"}) as path:
+            table, errors = call_parse_file(path)
+        assert_arrow_table_equals(table, {})
+        self.assertEqual(errors, [I18nMessage("file.zip_no_data_file", {}, "cjwparse")])
+
+    def test_zip_excel_member_is_unsupported(self):
+        xlsx = (TestDataPath / "test.xlsx").read_bytes()
+        with _zip_file({"a.xlsx": xlsx}) as path:
+            table, errors = call_parse_file(path, zip_member="a.xlsx")
+        assert_arrow_table_equals(table, {})
+        self.assertEqual(
+            errors,
+            [
+                I18nMessage(
+                    "file.unsupported_zip_member", {"name": "a.xlsx"}, "cjwparse"
+                )
+            ],
+        )
+
+    def test_invalid_zip(self):
+        with _data_file(b"A,B\nx,y", suffix=".zip") as path:
+            table, errors = call_parse_file(path)
+        assert_arrow_table_equals(table, {})
+        self.assertEqual([error.id for error in errors], ["file.invalid_zip"])
+
+    def _corrupt_zip_member(self, path: Path, offset: int, mask: int) -> None:
+        b = bytearray(path.read_bytes())
+        b[30 + len("a.csv") + offset] ^= mask  # offset into member data
+        path.write_bytes(bytes(b))
+
+    def test_zip_member_corrupt_deflate_stream(self):
+        data = b"A\n" + b"".join(b"%d\n" % i for i in range(20000))
+        with _zip_file({"a.csv": data}) as path:
+            self._corrupt_zip_member(path, 2000, 0xFF)
+            table, errors = call_parse_file(
+                path, settings=Settings(CSV_ENGINE="pyarrow")
+            )
+        self.assertEqual(
+            errors,
+            [
+                I18nMessage(
+                    "text.corrupt_compressed_file",
+                    {
+                        "n_bytes": 0,
+                        "message": "Error -3 while decompressing data: invalid distance too far back",
+                    },
+                    "cjwparse",
+                )
+            ],
+        )
+
+    def test_zip_member_bad_crc(self):
+        with _zip_file({"a.csv": b"A\nx\ny"}, compression=zipfile.ZIP_STORED) as path:
+            self._corrupt_zip_member(path, 2, 0x01)  # "x" => "y"
+            table, errors = call_parse_file(
+                path, settings=Settings(CSV_ENGINE="pyarrow")
+            )
+        self.assertEqual(
+            errors,
+            [
+                I18nMessage(
+                    "text.corrupt_compressed_file",
+                    {"n_bytes": 0, "message": "Bad CRC-32 for file 'a.csv'"},
+                    "cjwparse",
+                )
+            ],
+        )
+
+    def test_zip_member_corrupt_local_header(self):
+        with _zip_file({"a.csv": b"A\nx"}) as path:
+            self._corrupt_zip_member(path, -30 - len("a.csv"), 0xFF)  # magic
+            table, errors = call_parse_file(
+                path, settings=Settings(CSV_ENGINE="pyarrow")
+            )
+        assert_arrow_table_equals(table, {})
+        self.assertEqual(
+            errors,
+            [
+                I18nMessage(
+                    "file.invalid_zip",
+                    {"message": "Bad magic number for file header"},
+                    "cjwparse",
+                )
+            ],
+        )
+
+    def test_detect_json_by_content(self):
+        with _data_file(b'[{"X":"x"}]', suffix=".txt") as path:
+            table, errors = call_parse_file(path)
+        assert_arrow_table_equals(table, {"X": ["x"]})
+        self.assertEqual(errors, [])
+
+    def test_detect_jsonl_by_content(self):
+        with _data_file(b'{"X":"x"}\n{"X":"y"}\n', suffix=".txt") as path:
+            table, errors = call_parse_file(path)
+        assert_arrow_table_equals(table, {"X": ["x", "y"]})
+        self.assertEqual(errors, [])
+
+    def test_jsonl_suffix_overrides_json_content(self):
+        # one record: it looks like JSON
+        with _data_file(b'{"X":"x"}\n', suffix=".jsonl") as path:
+            table, errors = call_parse_file(path)
+        assert_arrow_table_equals(table, {"X": ["x"]})
+        self.assertEqual(errors, [])
+
+    def test_content_overrides_mime_type(self):
+        with _data_file(b"<!DOCTYPE html><html>404</html>", suffix=".csv") as path:
+            table, errors = call_parse_file(path, mime_type=MimeType.CSV)
+        assert_arrow_table_equals(table, {})
+        self.assertEqual(errors, [I18nMessage("file.html", {}, "cjwparse")])
+
     def test_mime_type_overrides_suffix(self):
         # File is ".csv" but we parse as ".json" because mime_type=MimeType.JSON
         with _data_file(b'[{"X":"x"}]', suffix=".csv") as json_path:
             table, errors = call_parse_file(json_path, mime_type=MimeType.JSON)
         assert_arrow_table_equals(table, {"X": ["x"]})
         self.assertEqual(errors, [])
+
+
+def _crash_worker_or_parse(job: ParseFilesJob) -> List[I18nMessage]:
+    # Runs in a parse_files() worker process, where cjwparse.api is unpatched
+    if job.path.name.startswith("crash"):
+        os._exit(1)
+    return cjwparse.api._parse_files_job(job)
+
+
+class ParseFileAsyncTests(unittest.TestCase):
+    def _call(self, path: Path, **kwargs) -> Tuple[pyarrow.Table, List[I18nMessage]]:
+        with tempfile_context(suffix=".arrow") as output_path:
+            errors = asyncio.run(
+                parse_file_async(path, output_path=output_path, **kwargs)
+            )
+            if output_path.stat().st_size == 0:
+                table = pyarrow.table({})
+            else:
+                with pyarrow.ipc.open_file(output_path) as reader:
+                    table = reader.read_all()
+        return table, errors
+
+    def test_parse_csv_in_process(self):
+        with _data_file(b"A,B\nx,y\nz,a", suffix=".csv") as path:
+            table, errors = self._call(path, settings=Settings(CSV_ENGINE="pyarrow"))
+        assert_arrow_table_equals(table, {"A": ["x", "z"], "B": ["y", "a"]})
+        self.assertEqual(errors, [])
+
+    def test_parse_csv_with_csv_to_arrow(self):
+        with _data_file("A\ncafé".encode("windows-1252"), suffix=".csv") as path:
+            table, errors = self._call(path)
+        assert_arrow_table_equals(table, {"A": ["café"]})
+        self.assertEqual(errors, [])
+
+    def test_parse_json(self):
+        with _data_file(b'[{"A": "a"}]', suffix=".json") as path:
+            table, errors = self._call(path)
+        assert_arrow_table_equals(table, {"A": ["a"]})
+        self.assertEqual(errors, [])
+
+    def test_detect_unknown_file_extension(self):
+        with _data_file(b"A,B\nx,y", suffix=".bin") as path:
+            table, errors = self._call(path)
+        assert_arrow_table_equals(table, {})
+        self.assertEqual(
+            errors,
+            [I18nMessage("file.unknown_ext", {"ext": ".bin"}, "cjwparse")],
+        )
+
+
+class ParseFilesTests(unittest.TestCase):
+    # Parse in-process, so these tests don't depend on csv-to-arrow
+    SETTINGS = Settings(CSV_ENGINE="pyarrow")
+
+    def test_parse_many_files(self):
+        with contextlib.ExitStack() as ctx:
+            jobs = []
+            for i in range(5):
+                path = ctx.enter_context(_data_file(b"A,B\n%d,x" % i, suffix=".csv"))
+                output_path = ctx.enter_context(tempfile_context(suffix=".arrow"))
+                jobs.append(ParseFilesJob(path, output_path))
+
+            results = list(
+                parse_files(iter(jobs), settings=self.SETTINGS, max_workers=2)
+            )
+            self.assertEqual(set(result.job for result in results), set(jobs))
+            for result in results:
+                self.assertIsNone(result.error)
+                self.assertEqual(result.warnings, [])
+                with pyarrow.ipc.open_file(result.job.output_path) as reader:
+                    table = reader.read_all()
+                i = jobs.index(result.job)
+                assert_arrow_table_equals(
+                    table, {"A": pyarrow.array([i], pyarrow.int8()), "B": ["x"]}
+                )
+
+    def test_isolate_errors(self):
+        with _data_file(b"A\na", suffix=".csv") as path:
+            with tempfile_context(suffix=".arrow") as output_path:
+                ok_job = ParseFilesJob(path, output_path)
+                bad_job = ParseFilesJob(
+                    Path("/does-not-exist.csv"), output_path.with_suffix(".bad")
+                )
+                results = {
+                    result.job: result
+                    for result in parse_files(
+                        [bad_job, ok_job], settings=self.SETTINGS, max_workers=2
+                    )
+                }
+        self.assertIsNone(results[ok_job].error)
+        self.assertIsInstance(results[bad_job].error, FileNotFoundError)
+        self.assertEqual(results[bad_job].warnings, [])
+
+    def test_max_memory_still_runs_jobs_that_exceed_it(self):
+        with _data_file(b"A\na", suffix=".csv") as path:
+            with tempfile_context(suffix=".arrow") as output_path:
+                results = list(
+                    parse_files(
+                        [ParseFilesJob(path, output_path)] * 3,
+                        settings=self.SETTINGS,
+                        max_workers=2,
+                        max_memory=1,
+                    )
+                )
+        self.assertEqual([result.error for result in results], [None, None, None])
+
+    def test_split_parallelism_among_workers(self):
+        executor_class = concurrent.futures.ProcessPoolExecutor
+        with patch.object(
+            concurrent.futures, "ProcessPoolExecutor", side_effect=executor_class
+        ) as executor:
+            list(
+                parse_files(
+                    [],
+                    settings=Settings(
+                        POSTPROCESS_N_THREADS=8,
+                        TRANSCODE_N_PROCESSES=8,
+                        JSONL_N_PROCESSES=8,
+                        ARROW_CPU_COUNT=8,
+                    ),
+                    max_workers=4,
+                )
+            )
+        (worker_settings,) = executor.call_args.kwargs["initargs"]
+        self.assertEqual(worker_settings.POSTPROCESS_N_THREADS, 2)
+        self.assertEqual(worker_settings.TRANSCODE_N_PROCESSES, 2)
+        self.assertEqual(worker_settings.JSONL_N_PROCESSES, 2)
+        self.assertEqual(worker_settings.ARROW_CPU_COUNT, 8)  # caller's choice
+
+    def test_isolate_worker_crash(self):
+        with contextlib.ExitStack() as ctx:
+            ok_path = ctx.enter_context(_data_file(b"A\na", suffix=".csv"))
+            crash_path = ctx.enter_context(tempfile_context(prefix="crash"))
+            output_path = ctx.enter_context(tempfile_context(suffix=".arrow"))
+            jobs = [ParseFilesJob(ok_path, output_path)] * 3 + [
+                ParseFilesJob(crash_path, output_path)
+            ]
+            with patch.object(cjwparse.api, "_parse_files_job", _crash_worker_or_parse):
+                results = list(parse_files(jobs, settings=self.SETTINGS, max_workers=2))
+        errors = [
+            type(result.error) if result.error else None
+            for result in results
+            if result.job.path == ok_path
+        ]
+        self.assertEqual(errors, [None, None, None])
+        crash_result = next(r for r in results if r.job.path == crash_path)
+        self.assertIsInstance(crash_result.error, BrokenProcessPool)
@@ -0,0 +1,58 @@
+import unittest
+import zipfile
+
+from cjwparse._util import tempfile_context
+from cjwparse.archive import ZipMember, choose_zip_member, list_zip_members
+from cjwparse.mime import MimeType
+
+
+class ListZipMembersTests(unittest.TestCase):
+    def test_list_members(self):
+        with tempfile_context(suffix=".zip") as path:
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr("data/a.CSV", b"A\n1")
+                zf.writestr("data/readme.pdf", b"%PDF")
+                zf.writestr("data/", b"")
+                zf.writestr("__MACOSX/data/._a.CSV", b"junk")
+                zf.writestr("data/.DS_Store", b"junk")
+            members = list_zip_members(path)
+        self.assertEqual(
+            members,
+            [
+                ZipMember("data/a.CSV", 3, MimeType.CSV),
+                ZipMember("data/readme.pdf", 4, None),
+            ],
+        )
+
+    def test_bad_zip_file(self):
+        with tempfile_context(suffix=".zip") as path:
+            path.write_bytes(b"A,B\n1,2")
+            with self.assertRaises(zipfile.BadZipFile):
+                list_zip_members(path)
+
+
+class ChooseZipMemberTests(unittest.TestCase):
+    MEMBERS = [
+        ZipMember("small.csv", 10, MimeType.CSV),
+        ZipMember("big.xlsx", 1000, MimeType.XLSX),
+        ZipMember("big.json", 100, MimeType.JSON),
+        ZipMember("notes.pdf", 500, None),
+    ]
+
+    def test_choose_largest_text_member(self):
+        self.assertEqual(
+            choose_zip_member(self.MEMBERS, None),
+            ZipMember("big.json", 100, MimeType.JSON),
+        )
+
+    def test_choose_by_name(self):
+        self.assertEqual(
+            choose_zip_member(self.MEMBERS, "small.csv"),
+            ZipMember("small.csv", 10, MimeType.CSV),
+        )
+
+    def test_choose_missing_name(self):
+        self.assertIsNone(choose_zip_member(self.MEMBERS, "missing.csv"))
+
+    def test_no_text_member(self):
+        self.assertIsNone(choose_zip_member(self.MEMBERS[1:2], None))
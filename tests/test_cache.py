@@ -0,0 +1,277 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import pyarrow as pa
+
+import cjwparse.csv
+from cjwmodule.i18n import I18nMessage
+from cjwparse._util import tempfile_context
+from cjwparse.api import parse_file
+from cjwparse.cache import CacheStats, ParseCache
+from cjwparse.csv import _parse_csv
+from cjwparse.mime import MimeType
+from cjwparse.settings import Settings
+
+from .test_api import call_parse_file
+from .util import assert_arrow_table_equals
+
+# Parse in-process, so these tests don't depend on csv-to-arrow
+SETTINGS = Settings(CSV_ENGINE="pyarrow")
+
+
+class ParseCacheTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = Path(tempfile.mkdtemp())
+        self.cache = ParseCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super().tearDown()
+
+    def _key(self, data: bytes, **kwargs) -> str:
+        with tempfile_context() as path:
+            path.write_bytes(data)
+            return self.cache.key(
+                self.cache.file_digest(path),
+                **{
+                    "settings": SETTINGS,
+                    "encoding": None,
+                    "mime_type": MimeType.CSV,
+                    "has_header": True,
+                    **kwargs,
+                }
+            )
+
+    def test_key_depends_on_content_and_arguments(self):
+        key = self._key(b"A,B\na,b")
+        self.assertEqual(self._key(b"A,B\na,b"), key)
+        self.assertNotEqual(self._key(b"A,B\na,c"), key)
+        self.assertNotEqual(self._key(b"A,B\na,b", has_header=False), key)
+        self.assertNotEqual(self._key(b"A,B\na,b", encoding="latin1"), key)
+        self.assertNotEqual(self._key(b"A,B\na,b", mime_type=MimeType.TSV), key)
+        self.assertNotEqual(
+            self._key(b"A,B\na,b", settings=Settings(MAX_ROWS_PER_TABLE=2)), key
+        )
+
+    def test_key_ignores_settings_that_do_not_affect_output(self):
+        self.assertEqual(
+            self._key(b"A,B\na,b", settings=Settings(POSTPROCESS_N_THREADS=3)),
+            self._key(b"A,B\na,b", settings=Settings(CSV_ENGINE="csv-to-arrow")),
+        )
+        self.assertEqual(
+            self._key(b"A,B\na,b", settings=Settings(TRANSCODE_N_PROCESSES=4)),
+            self._key(b"A,B\na,b", settings=Settings(TRANSCODE_N_PROCESSES=1)),
+        )
+        self.assertEqual(
+            self._key(b'{"A":1}\n', settings=Settings(JSONL_N_PROCESSES=8)),
+            self._key(b'{"A":1}\n', settings=Settings(JSONL_N_PROCESSES=1)),
+        )
+
+    def test_miss(self):
+        with tempfile_context() as output_path:
+            output_path.write_bytes(b"untouched")
+            self.assertIsNone(self.cache.get("abc", output_path))
+            self.assertEqual(output_path.read_bytes(), b"untouched")
+        self.assertEqual(self.cache.stats, CacheStats(0, 1))
+
+    def test_put_and_get(self):
+        warnings = [I18nMessage("x", {"a": 1, "b": "c"}, "cjwparse")]
+        with tempfile_context() as table_path:
+            table_path.write_bytes(b"table")
+            self.cache.put("abc", table_path, warnings)
+        with tempfile_context() as output_path:
+            self.assertEqual(self.cache.get("abc", output_path), warnings)
+            self.assertEqual(output_path.read_bytes(), b"table")
+            self.assertEqual(output_path.stat().st_mode & 0o222, 0)  # read-only
+        self.assertEqual(self.cache.stats, CacheStats(1, 0))
+
+    def test_put_existing_key(self):
+        with tempfile_context() as table_path:
+            table_path.write_bytes(b"table")
+            self.cache.put("abc", table_path, [])
+            self.cache.put("abc", table_path, [])
+        self.assertEqual(
+            [p.name for p in self.cache_dir.iterdir() if not p.name.startswith(".")],
+            ["abc"],
+        )
+
+    def test_evict_least_recently_used(self):
+        cache = ParseCache(self.cache_dir, max_n_bytes=250)
+        with tempfile_context() as table_path:
+            table_path.write_bytes(b"x" * 100)
+            cache.put("a", table_path, [])
+            cache.put("b", table_path, [])
+            os.utime(self.cache_dir / "a", (1, 1))
+            os.utime(self.cache_dir / "b", (2, 2))
+            cache.put("c", table_path, [])
+        with tempfile_context() as output_path:
+            self.assertIsNone(cache.get("a", output_path))
+            self.assertIsNotNone(cache.get("b", output_path))
+            self.assertIsNotNone(cache.get("c", output_path))
+
+
+class ParseFileCacheTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super().tearDown()
+
+    def test_reuse_result(self):
+        cache = ParseCache(self.cache_dir)
+        settings = Settings(CSV_ENGINE="pyarrow", MAX_ROWS_PER_TABLE=2)
+        with tempfile_context(suffix=".csv") as path:
+            path.write_bytes(b"A,B\na,b\nc,d")
+            table1, warnings1 = call_parse_file(path, settings=settings, cache=cache)
+            table2, warnings2 = call_parse_file(path, settings=settings, cache=cache)
+        self.assertEqual(cache.stats, CacheStats(1, 1, 0, 1))
+        assert_arrow_table_equals(table1, {"A": ["a"], "B": ["b"]})
+        assert_arrow_table_equals(table2, table1)
+        self.assertEqual(warnings2, warnings1)
+        self.assertEqual(
+            warnings2,
+            [
+                I18nMessage(
+                    "warning.skipped_rows", dict(n_rows=1, max_n_rows=2), "cjwparse"
+                )
+            ],
+        )
+
+    def test_hash_input_once_per_parse(self):
+        cache = ParseCache(self.cache_dir)
+        with tempfile_context(suffix=".csv") as path:
+            path.write_bytes(b"A,B\na,b")
+            with patch.object(
+                cache, "file_digest", wraps=cache.file_digest
+            ) as file_digest:
+                call_parse_file(path, settings=SETTINGS, cache=cache)
+        file_digest.assert_called_once_with(path)
+
+    def test_rewritten_file_with_same_stat_is_a_miss(self):
+        cache = ParseCache(self.cache_dir)
+        with tempfile_context(suffix=".csv") as path:
+            path.write_bytes(b"A,B\na,b")
+            stat = path.stat()
+            table1, _ = call_parse_file(path, settings=SETTINGS, cache=cache)
+            path.write_bytes(b"A,B\nc,d")  # same size
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            table2, _ = call_parse_file(path, settings=SETTINGS, cache=cache)
+        assert_arrow_table_equals(table1, {"A": ["a"], "B": ["b"]})
+        assert_arrow_table_equals(table2, {"A": ["c"], "B": ["d"]})
+
+    def test_unknown_extension_is_not_cached(self):
+        cache = ParseCache(self.cache_dir)
+        with tempfile_context(suffix=".bin") as path:
+            with tempfile_context() as output_path:
+                parse_file(path, output_path=output_path, cache=cache)
+        self.assertEqual(cache.stats, CacheStats(0, 0))
+
+
+class RawCsvCacheTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = Path(tempfile.mkdtemp())
+        self.cache = ParseCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super().tearDown()
+
+    def _parse_csv(self, path: Path, **kwargs):
+        return _parse_csv(
+            path,
+            **{
+                "settings": SETTINGS,
+                "encoding": None,
+                "delimiter": None,
+                "has_header": True,
+                "autoconvert_text_to_numbers": True,
+                "cache": self.cache,
+                **kwargs,
+            }
+        )
+
+    def test_reuse_raw_table_when_postprocessing_changes(self):
+        with tempfile_context(suffix=".csv") as path:
+            path.write_bytes("A;B\n1;é\n".encode("latin1"))
+            result1 = self._parse_csv(path, encoding="windows-1252")
+            with patch.object(cjwparse.csv, "utf8_input_context") as utf8_input:
+                result2 = self._parse_csv(
+                    path,
+                    encoding="windows-1252",
+                    has_header=False,
+                    autoconvert_text_to_numbers=False,
+                )
+            utf8_input.assert_not_called()
+        self.assertEqual(self.cache.stats.n_raw_csv_hits, 1)
+        assert_arrow_table_equals(
+            result1.table, {"A": pa.array([1], pa.int8()), "B": ["é"]}
+        )
+        assert_arrow_table_equals(
+            result2.table, {"Column 1": ["A", "1"], "Column 2": ["B", "é"]}
+        )
+        self.assertEqual(result2.warnings, result1.warnings)
+
+    def test_record_detected_encoding_and_delimiter(self):
+        with tempfile_context(suffix=".csv") as path:
+            path.write_bytes("A;B\nb;é\n".encode("utf-8"))
+            self._parse_csv(path)
+            key = self.cache.raw_csv_key(
+                self.cache.file_digest(path),
+                settings=SETTINGS,
+                encoding=None,
+                delimiter=None,
+            )
+            raw_csv = self.cache.get_raw_csv(key)
+            self.assertEqual(raw_csv.encoding, "utf-8")
+            self.assertEqual(raw_csv.delimiter, ";")
+
+            # A caller passing the detected values hits the cache, too
+            self._parse_csv(path, encoding="utf-8", delimiter=";")
+        self.assertEqual(self.cache.stats.n_raw_csv_hits, 2)
+        self.assertEqual(self.cache.stats.n_raw_csv_misses, 1)
+
+    def test_limit_settings_change_key(self):
+        with tempfile_context(suffix=".csv") as path:
+            path.write_bytes(b"A,B\na,b\nc,d")
+            self._parse_csv(path)
+            result = self._parse_csv(
+                path, settings=Settings(CSV_ENGINE="pyarrow", MAX_ROWS_PER_TABLE=2)
+            )
+        self.assertEqual(self.cache.stats.n_raw_csv_hits, 0)
+        assert_arrow_table_equals(result.table, {"A": ["a"], "B": ["b"]})
+
+    def test_decompression_limit_changes_key(self):
+        with tempfile_context(suffix=".csv.gz") as path:
+            path.write_bytes(
+                gzip.compress(b"A\n" + b"".join(b"%d\n" % i for i in range(1000)))
+            )
+            self._parse_csv(
+                path,
+                settings=Settings(CSV_ENGINE="pyarrow", MAX_DECOMPRESSED_BYTES=100),
+            )
+            result = self._parse_csv(path)
+        self.assertEqual(self.cache.stats.n_raw_csv_hits, 0)
+        self.assertEqual(result.table.num_rows, 1000)
+
+    def test_encoding_detection_limit_changes_key(self):
+        with tempfile_context(suffix=".csv") as path:
+            path.write_bytes(b"A\nb")
+            keys = [
+                self.cache.raw_csv_key(
+                    self.cache.file_digest(path),
+                    settings=settings,
+                    encoding=None,
+                    delimiter=None,
+                )
+                for settings in [SETTINGS, Settings(ENCODING_DETECTION_MAX_BYTES=10)]
+            ]
+        self.assertNotEqual(keys[0], keys[1])
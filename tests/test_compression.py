@@ -0,0 +1,64 @@
+import bz2
+import gzip
+import io
+import lzma
+import unittest
+
+from cjwparse._util import tempfile_context
+from cjwparse.compression import Compression, DecompressingReader, detect_compression
+
+
+class DetectCompressionTests(unittest.TestCase):
+    def _detect(self, b: bytes, suffix: str = ""):
+        with tempfile_context(suffix=suffix) as path:
+            path.write_bytes(b)
+            return detect_compression(path)
+
+    def test_gzip(self):
+        self.assertEqual(self._detect(gzip.compress(b"A\n1")), Compression.GZIP)
+
+    def test_bzip2(self):
+        self.assertEqual(self._detect(bz2.compress(b"A\n1")), Compression.BZIP2)
+
+    def test_xz(self):
+        self.assertEqual(self._detect(lzma.compress(b"A\n1")), Compression.XZ)
+
+    def test_zstd(self):
+        self.assertEqual(
+            self._detect(b"\x28\xb5\x2f\xfd\x00\x00\x00"), Compression.ZSTD
+        )
+
+    def test_ignore_extension(self):
+        self.assertIsNone(self._detect(b"A,B\n1,2", suffix=".csv.gz"))
+
+    def test_empty_file(self):
+        self.assertIsNone(self._detect(b""))
+
+
+class DecompressingReaderTests(unittest.TestCase):
+    def test_read_all(self):
+        reader = DecompressingReader(io.BytesIO(b"abcdef"), 10)
+        self.assertEqual(reader.read(4), b"abcd")
+        self.assertEqual(reader.read(4), b"ef")
+        self.assertEqual(reader.read(4), b"")
+        self.assertEqual(reader.n_bytes, 6)
+        self.assertFalse(reader.is_truncated)
+
+    def test_stop_at_max_n_bytes(self):
+        reader = DecompressingReader(io.BytesIO(b"abcdef"), 4)
+        self.assertEqual(reader.read(), b"abcd")
+        self.assertEqual(reader.read(), b"")
+        self.assertTrue(reader.is_truncated)
+
+    def test_exactly_max_n_bytes_is_not_truncated(self):
+        reader = DecompressingReader(io.BytesIO(b"abcd"), 4)
+        self.assertEqual(reader.read(), b"abcd")
+        self.assertFalse(reader.is_truncated)
+
+    def test_peek_does_not_consume(self):
+        reader = DecompressingReader(io.BytesIO(b"abcdef"), 10)
+        self.assertEqual(reader.peek(3), b"abc")
+        self.assertEqual(reader.peek(4), b"abcd")
+        self.assertEqual(reader.read(2), b"ab")
+        self.assertEqual(reader.read(), b"cd")
+        self.assertEqual(reader.read(), b"ef")
@@ -1,13 +1,24 @@
 import contextlib
+import dataclasses
+import gzip
+import subprocess
 import unittest
 from pathlib import Path
 from typing import ContextManager, Optional, Union
+from unittest.mock import patch
 
 import pyarrow as pa
 
 from cjwmodule.i18n import I18nMessage
 from cjwparse._util import tempfile_context
-from cjwparse.csv import ParseCsvResult, _parse_csv
+from cjwparse.csv import (
+    CsvDialect,
+    ParseCsvResult,
+    _autocast_column,
+    _nix_utf8_chunk_empty_strings,
+    _parse_csv,
+    detect_dialect,
+)
 from cjwparse.settings import DEFAULT_SETTINGS, Settings
 
 from .util import assert_arrow_table_equals
@@ -265,6 +276,28 @@ class ParseCsvInternalTests(unittest.TestCase):
                 ParseCsvResult(pa.table({"A": ["a", ""], "B": ["", "b"]}), []),
             )
 
+    def test_stream_text_to_arrow_tools(self):
+        with _temp_csv("A;B\nfôo;b\ncafé;d".encode("windows-1252")) as path:
+            assert_csv_result_equals(
+                _internal_parse_csv(
+                    path,
+                    encoding="utf-8",
+                    delimiter=None,
+                    has_header=True,
+                    settings=Settings(STREAM_TEXT_TO_ARROW_TOOLS=True),
+                ),
+                ParseCsvResult(
+                    pa.table({"A": ["f�o", "caf�"], "B": ["b", "d"]}),
+                    [
+                        I18nMessage(
+                            "text.repaired_encoding",
+                            dict(encoding="utf-8", byte="0xF4", position=5),
+                            "cjwparse",
+                        )
+                    ],
+                ),
+            )
+
     def test_detect_character_set(self):
         # tests that `chardet` is invoked
         with _temp_csv("A\nfôo\nbar".encode("windows-1252")) as path:
@@ -554,25 +587,21 @@ class ParseCsvInternalTests(unittest.TestCase):
                 ),
             )
 
-    def test_truncate_csv_repair_utf8(self):
+    def test_truncate_csv_before_split_character(self):
         with _temp_csv("A,B\na,b\nc,d\né,f\ng,h") as path:
             assert_csv_result_equals(
                 _internal_parse_csv(
                     path, has_header=True, settings=Settings(MAX_CSV_BYTES=13)
                 ),
                 ParseCsvResult(
-                    pa.table({"A": ["a", "c", "�"], "B": ["b", "d", None]}),
+                    # The cut would split "é": cut before it instead
+                    pa.table({"A": ["a", "c"], "B": ["b", "d"]}),
                     [
                         I18nMessage(
                             "csv.truncated_file",
                             dict(n_bytes_truncated=7, max_n_bytes=13),
                             "cjwparse",
-                        ),
-                        I18nMessage(
-                            "text.repaired_encoding",
-                            dict(encoding="utf-8", byte="0xC3", position=12),
-                            "cjwparse",
-                        ),
+                        )
                     ],
                 ),
             )
@@ -645,3 +674,232 @@ class ParseCsvInternalTests(unittest.TestCase):
                     ],
                 ),
             )
+
+
+class CsvEngineTests(unittest.TestCase):
+    # Differential tests: "pyarrow" must produce exactly what "csv-to-arrow"
+    # produces -- either by parsing, or by falling back to csv-to-arrow.
+    INPUTS = [
+        "",
+        "\n\n",
+        "A,B",
+        "A,B\na,b\nc,d",
+        "A,B\r\na,b\r\n\r\nc,d\r\n",
+        "A,B\n1,2\n3,4.5\n,6",
+        'A,B\n"a,b","c\nd"\n"e""f",""',
+        "A,B\na\nb,c",  # ragged
+        'A,B\n"x" y,"z""" a',  # misplaced quotes
+        'A,B\nx,"y\nz',  # unterminated quote
+        "A,A,\na,b,c",
+        "A\tB\na\tb",
+        "A,B,C,D\na,b,c,d\ne,f,g,h",
+        "AAAAxxxx,B\nAAA\u00A2,b\nA\U00010348,AA\U00010348",
+        "\n".join(["A"] + [str(i) for i in range(20)]),
+    ]
+    SETTINGS = [
+        Settings(),
+        Settings(MAX_ROWS_PER_TABLE=5),
+        Settings(MAX_COLUMNS_PER_TABLE=2),
+        Settings(MAX_BYTES_PER_VALUE=4),
+        Settings(MAX_CSV_BYTES=13),
+    ]
+
+    def _parse(self, path: Path, engine: str, settings: Settings, **kwargs):
+        return _internal_parse_csv(
+            path,
+            settings=dataclasses.replace(settings, CSV_ENGINE=engine),
+            **kwargs,
+        )
+
+    def test_pyarrow_matches_csv_to_arrow(self):
+        for data in self.INPUTS:
+            for settings in self.SETTINGS:
+                for has_header in (False, True):
+                    kwargs = dict(
+                        delimiter=None,
+                        has_header=has_header,
+                        autoconvert_text_to_numbers=True,
+                    )
+                    with _temp_csv(data) as path:
+                        expected = self._parse(path, "csv-to-arrow", settings, **kwargs)
+                        actual = self._parse(path, "pyarrow", settings, **kwargs)
+                    try:
+                        assert_csv_result_equals(actual, expected)
+                    except AssertionError as err:
+                        raise AssertionError(
+                            "Engines differ on %r with %r, has_header=%r"
+                            % (data, settings, has_header)
+                        ) from err
+
+    def test_pyarrow_matches_csv_to_arrow_when_decompressing(self):
+        # pyarrow reads decompressed text from a stream. When it gives up, we
+        # decompress again for csv-to-arrow: into a temporary file, or (with
+        # STREAM_TEXT_TO_ARROW_TOOLS) into its stdin.
+        for data in self.INPUTS:
+            for settings in (
+                Settings(),
+                Settings(STREAM_TEXT_TO_ARROW_TOOLS=True),
+                Settings(MAX_CSV_BYTES=13),
+                Settings(MAX_CSV_BYTES=13, STREAM_TEXT_TO_ARROW_TOOLS=True),
+            ):
+                with _temp_csv(gzip.compress(data.encode("utf-8"))) as path:
+                    expected = self._parse(path, "csv-to-arrow", settings)
+                    actual = self._parse(path, "pyarrow", settings)
+                try:
+                    assert_csv_result_equals(actual, expected)
+                except AssertionError as err:
+                    raise AssertionError(
+                        "Engines differ on %r with %r" % (data, settings)
+                    ) from err
+
+    def test_auto_parses_small_file_with_pyarrow(self):
+        with _temp_csv("A,B\na,b") as path:
+            with patch.object(subprocess, "Popen") as popen:
+                result = self._parse(path, "auto", Settings(), has_header=True)
+            popen.assert_not_called()
+        assert_csv_result_equals(
+            result, ParseCsvResult(pa.table({"A": ["a"], "B": ["b"]}), [])
+        )
+
+    def test_auto_parses_large_file_with_csv_to_arrow(self):
+        with _temp_csv("A,B\na,b") as path:
+            with patch.object(
+                subprocess, "Popen", side_effect=RuntimeError("ran csv-to-arrow")
+            ):
+                with self.assertRaisesRegex(RuntimeError, "ran csv-to-arrow"):
+                    self._parse(path, "auto", Settings(CSV_ENGINE_AUTO_MAX_BYTES=3))
+
+    def test_invalid_engine(self):
+        with _temp_csv("A,B\na,b") as path:
+            with self.assertRaises(ValueError):
+                self._parse(path, "csv-to-parquet", Settings())
+
+
+class NixUtf8ChunkEmptyStringsTests(unittest.TestCase):
+    def test_empty_strings_become_null(self):
+        result = _nix_utf8_chunk_empty_strings(pa.array(["a", "", "b", None]))
+        self.assertEqual(result.to_pylist(), ["a", None, "b", None])
+        self.assertEqual(result.null_count, 2)
+        result.validate(full=True)
+
+    def test_no_validity_bitmap_when_no_nulls(self):
+        result = _nix_utf8_chunk_empty_strings(pa.array(["a", "b", "c"]))
+        self.assertEqual(result.to_pylist(), ["a", "b", "c"])
+        self.assertEqual(result.null_count, 0)
+        self.assertIsNone(result.buffers()[0])
+
+    def test_ignore_values_before_offset(self):
+        # e.g., after has_header slices away row 0
+        result = _nix_utf8_chunk_empty_strings(pa.array(["", "a", "", "b"]).slice(1))
+        self.assertEqual(result.to_pylist(), ["a", None, "b"])
+        self.assertEqual(result.null_count, 1)
+        result.validate(full=True)
+
+    def test_ignore_values_after_length(self):
+        result = _nix_utf8_chunk_empty_strings(
+            pa.array(["a", "", "b", "", ""]).slice(0, 3)
+        )
+        self.assertEqual(result.to_pylist(), ["a", None, "b"])
+        self.assertEqual(result.null_count, 1)
+
+    def test_many_values(self):
+        values = ["x" if i % 3 else "" for i in range(1000)]
+        result = _nix_utf8_chunk_empty_strings(pa.array(values).slice(5))
+        self.assertEqual(result.to_pylist(), [v or None for v in values[5:]])
+        self.assertEqual(result.null_count, sum(1 for v in values[5:] if not v))
+
+
+class AutocastColumnTests(unittest.TestCase):
+    def _autocast(self, *chunks):
+        return _autocast_column(
+            pa.chunked_array([pa.array(chunk, pa.utf8()) for chunk in chunks])
+        )
+
+    def test_text_stays_text(self):
+        result = self._autocast(["1", "2", "x"])
+        self.assertEqual(result.type, pa.utf8())
+        self.assertEqual(result.to_pylist(), ["1", "2", "x"])
+
+    def test_text_in_later_chunk_stays_text(self):
+        result = self._autocast(["1", "2"], ["3", "x"])
+        self.assertEqual(result.type, pa.utf8())
+
+    def test_narrowest_int(self):
+        self.assertEqual(self._autocast(["1", "-128", ""]).type, pa.int8())
+        self.assertEqual(self._autocast(["1", "128"]).type, pa.int16())
+        self.assertEqual(self._autocast(["1", "-32769"]).type, pa.int32())
+
+    def test_int64_is_exact(self):
+        # e.g., Twitter IDs -- float64 would lose precision
+        result = self._autocast(["1093943422262697985", None])
+        self.assertEqual(result.type, pa.int64())
+        self.assertEqual(result.to_pylist(), [1093943422262697985, None])
+
+    def test_int64_overflow_is_float64(self):
+        result = self._autocast(["9223372036854775808"])
+        self.assertEqual(result.type, pa.float64())
+        self.assertEqual(result.to_pylist(), [9223372036854775808.0])
+
+    def test_float(self):
+        result = self._autocast(["1.5", "", "-2e3"])
+        self.assertEqual(result.type, pa.float64())
+        self.assertEqual(result.to_pylist(), [1.5, None, -2000.0])
+
+    def test_integral_float_is_int(self):
+        result = self._autocast(["1.0", "+2", "3e2"])
+        self.assertEqual(result.type, pa.int16())
+        self.assertEqual(result.to_pylist(), [1, 2, 300])
+
+    def test_float_overflow_is_text(self):
+        self.assertEqual(self._autocast(["1", "1e400"]).type, pa.utf8())
+
+    def test_lone_minus_is_text(self):
+        self.assertEqual(self._autocast(["1", "-"]).type, pa.utf8())
+
+    def test_all_empty_chunks_are_text(self):
+        result = self._autocast(["", None], [""])
+        self.assertEqual(result.type, pa.utf8())
+        self.assertEqual(result.to_pylist(), ["", None, ""])
+
+    def test_empty_chunk_does_not_prevent_conversion(self):
+        result = self._autocast(["", ""], ["1", "2"])
+        self.assertEqual(result.type, pa.int8())
+        self.assertEqual(result.to_pylist(), [None, None, 1, 2])
+
+
+class DetectDialectTests(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(detect_dialect(b""), CsvDialect(",", '"', "\n"))
+
+    def test_no_delimiter_means_comma(self):
+        self.assertEqual(detect_dialect(b"A B\na b c").delimiter, ",")
+
+    def test_most_lines(self):
+        self.assertEqual(detect_dialect(b"A;B\na,b;c").delimiter, ";")
+
+    def test_ragged_rows(self):
+        self.assertEqual(
+            detect_dialect(b"a\tb\tc\nd\ne\tf,g\nh\ti\tj\tk").delimiter, "\t"
+        )
+
+    def test_ignore_delimiters_in_quotes(self):
+        self.assertEqual(
+            detect_dialect(b'"a;b;c";d\n"e\n;;;";f\n').delimiter,
+            ";",
+        )
+        self.assertEqual(
+            detect_dialect(b'a,"b;c;d;e",f\ng,"h;i;j;k",l\n').delimiter, ","
+        )
+
+    def test_quotechar(self):
+        self.assertEqual(detect_dialect(b"'a';'b'\n'c';'d'").quotechar, "'")
+
+    def test_lineterminator(self):
+        self.assertEqual(detect_dialect(b"a;b\r\nc;d\r\n").lineterminator, "\r\n")
+        self.assertEqual(detect_dialect(b"a;b\rc;d\r").lineterminator, "\r")
+        self.assertEqual(detect_dialect(b"a;b\rc;d\r").delimiter, ";")
+
+    def test_prefix_ignores_partial_last_line(self):
+        sample = b"a;b\ne,f"
+        self.assertEqual(detect_dialect(sample).delimiter, ",")  # tie
+        self.assertEqual(detect_dialect(sample, is_prefix=True).delimiter, ";")
@@ -1,4 +1,6 @@
+import subprocess
 import unittest
+import zipfile
 from pathlib import Path
 from typing import List, Tuple
 
@@ -6,8 +8,22 @@ import pyarrow
 
 from cjwmodule.i18n import I18nMessage
 from cjwparse._util import tempfile_context
-from cjwparse.excel import parse_xls, parse_xlsx
+from cjwparse.excel import (
+    ParseSheetResult,
+    XlsxProbe,
+    XlsxSheetProbe,
+    _read_xlsx_workbook,
+    _run_sheet_jobs,
+    _SheetJob,
+    _write_single_sheet_xlsx,
+    parse_xls,
+    parse_xls_sheets,
+    parse_xlsx,
+    parse_xlsx_sheets,
+    probe_xlsx,
+)
 from cjwparse.settings import DEFAULT_SETTINGS, Settings
+from cjwparse.testing.data import DataSpec, write_xlsx
 
 from .util import assert_arrow_table_equals
 
@@ -137,3 +153,179 @@ class ParseExcelTests(unittest.TestCase):
                 )
             ],
         )
+
+
+class ProbeXlsxTests(unittest.TestCase):
+    def test_dimension(self):
+        self.assertEqual(
+            probe_xlsx(TestDataPath / "test.xlsx"),
+            XlsxProbe(
+                [XlsxSheetProbe("Sheet1", False, 3, 2, 1036)],
+                n_shared_strings=4,
+                shared_strings_n_bytes=241,
+                warnings=[],
+            ),
+        )
+
+    def test_count_rows_without_dimension(self):
+        with tempfile_context(suffix=".xlsx") as path:
+            write_xlsx(path, DataSpec(n_rows=20, n_columns=3))
+            result = probe_xlsx(path)
+        self.assertEqual(
+            [(sheet.name, sheet.n_rows, sheet.n_columns) for sheet in result.sheets],
+            [("Sheet1", 21, 3)],
+        )
+        self.assertIsNone(result.n_shared_strings)
+
+    def test_extrapolate_rows_without_dimension(self):
+        with tempfile_context(suffix=".xlsx") as path:
+            write_xlsx(path, DataSpec(n_rows=20000, n_columns=3))
+            result = probe_xlsx(path)
+        self.assertAlmostEqual(result.sheets[0].n_rows / 20001, 1.0, delta=0.05)
+        self.assertEqual(result.sheets[0].n_columns, 3)
+
+    def test_refuse_xml_entities(self):
+        # "billion laughs": expanding &lol9; would take gigabytes
+        entities = '<!ENTITY lol0 "lol">' + "".join(
+            '<!ENTITY lol%d "%s">' % (i, "&lol%d;" % (i - 1) * 10) for i in range(1, 10)
+        )
+        with tempfile_context(suffix=".xlsx") as src, tempfile_context(
+            suffix=".xlsx"
+        ) as path:
+            write_xlsx(src, DataSpec(n_rows=2, n_columns=1))
+            with zipfile.ZipFile(src) as src_zf, zipfile.ZipFile(path, "w") as zf:
+                for info in src_zf.infolist():
+                    data = src_zf.read(info)
+                    if info.filename == "xl/workbook.xml":
+                        data = (
+                            '<?xml version="1.0"?><!DOCTYPE workbook [%s]>'
+                            "<workbook><sheets>&lol9;</sheets></workbook>" % entities
+                        ).encode("utf-8")
+                    zf.writestr(info, data)
+            result = probe_xlsx(path)
+        self.assertEqual(result.sheets, [])
+        self.assertEqual(
+            result.warnings,
+            [
+                I18nMessage(
+                    "excel.invalid_file",
+                    {"message": "XML declares a DTD, which XLSX forbids"},
+                    "cjwparse",
+                )
+            ],
+        )
+
+    def test_invalid_file(self):
+        result = probe_xlsx(TestDataPath / "example.xls")
+        self.assertEqual(result.sheets, [])
+        self.assertEqual(
+            [warning.id for warning in result.warnings], ["excel.invalid_file"]
+        )
+
+
+class WriteSingleSheetXlsxTests(unittest.TestCase):
+    def test_keep_one_sheet(self):
+        with tempfile_context(suffix=".xlsx") as path, tempfile_context(
+            suffix=".xlsx"
+        ) as dest:
+            write_xlsx(path, DataSpec(n_rows=20, n_columns=3), n_sheets=3)
+            with zipfile.ZipFile(path) as zf:
+                workbook = _read_xlsx_workbook(zf)
+                _write_single_sheet_xlsx(
+                    zf, workbook, workbook.sheets[1], dest, shared_strings_path=None
+                )
+            result = probe_xlsx(dest)
+            with zipfile.ZipFile(dest) as zf:
+                names = zf.namelist()
+                content_types = zf.read("[Content_Types].xml")
+        self.assertEqual(
+            [(sheet.name, sheet.n_rows, sheet.n_columns) for sheet in result.sheets],
+            [("Sheet2", 21, 3)],
+        )
+        self.assertEqual(result.warnings, [])
+        self.assertIn("xl/worksheets/sheet2.xml", names)
+        self.assertNotIn("xl/worksheets/sheet1.xml", names)
+        self.assertNotIn("xl/worksheets/sheet3.xml", names)
+        self.assertNotIn(b"sheet1.xml", content_types)
+        self.assertIn(b"sheet2.xml", content_types)
+
+
+class ParseSheetsTests(unittest.TestCase):
+    def test_xlsx_sheets(self):
+        with tempfile_context(suffix=".xlsx") as path, tempfile_context(
+            suffix=".arrow"
+        ) as output1, tempfile_context(suffix=".arrow") as output2:
+            write_xlsx(path, DataSpec(n_rows=5, n_columns=2), n_sheets=2)
+            results = parse_xlsx_sheets(
+                path, sheets={0: output1, 1: output2}, has_header=True
+            )
+            self.assertEqual(
+                {i: (r.warnings, r.error) for i, r in results.items()},
+                {0: ([], None), 1: ([], None)},
+            )
+            with pyarrow.ipc.open_file(output2) as reader:
+                table = reader.read_all()
+        self.assertEqual(results[1].report.n_rows, 5)
+        self.assertIn("write_single_sheet_xlsx", results[1].report.stages)
+        self.assertNotIn("write_single_sheet_xlsx", results[0].report.stages)
+        self.assertEqual(table.num_rows, 5)
+
+    def test_xlsx_sheet_not_found(self):
+        with tempfile_context(suffix=".xlsx") as path, tempfile_context(
+            suffix=".arrow"
+        ) as output_path:
+            write_xlsx(path, DataSpec(n_rows=5, n_columns=2))
+            results = parse_xlsx_sheets(path, sheets={3: output_path}, has_header=True)
+            self.assertEqual(output_path.read_bytes(), b"")
+        self.assertEqual(
+            results[3].warnings,
+            [I18nMessage("excel.sheet_not_found", {"sheet_number": 4}, "cjwparse")],
+        )
+        self.assertIsNone(results[3].error)
+
+    def test_xls_other_sheet_unsupported(self):
+        with tempfile_context(suffix=".arrow") as output_path:
+            results = parse_xls_sheets(
+                TestDataPath / "example.xls",
+                sheets={1: output_path},
+                has_header=True,
+            )
+            self.assertEqual(output_path.read_bytes(), b"")
+        self.assertEqual(
+            results[1].warnings,
+            [
+                I18nMessage(
+                    "excel.xls_sheet_unsupported", {"sheet_number": 2}, "cjwparse"
+                )
+            ],
+        )
+        self.assertIsNone(results[1].error)
+
+    def test_isolate_sheet_errors(self):
+        warning = I18nMessage("x", {}, "cjwparse")
+
+        def fail(report):
+            with report.stage("xlsx-to-arrow"):
+                raise subprocess.CalledProcessError(1, ["xlsx-to-arrow"])
+
+        def succeed(report):
+            with report.stage("xlsx-to-arrow"):
+                report.n_rows = 3
+            return [warning]
+
+        results = _run_sheet_jobs(
+            [
+                _SheetJob(0, Path("0.arrow"), 0, fail),
+                _SheetJob(1, Path("1.arrow"), 0, succeed),
+            ],
+            max_workers=2,
+            max_memory=None,
+        )
+        self.assertEqual(
+            results[1], ParseSheetResult([warning], None, results[1].report)
+        )
+        self.assertEqual(results[1].report.n_rows, 3)
+        self.assertEqual(results[0].warnings, [])
+        self.assertIsInstance(results[0].error, subprocess.CalledProcessError)
+        self.assertIsNone(results[0].report.n_rows)
+        self.assertIsNot(results[0].report, results[1].report)
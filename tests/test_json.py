@@ -1,4 +1,5 @@
 import contextlib
+import gzip
 import json
 import unittest
 from pathlib import Path
@@ -246,6 +247,36 @@ class ParseJsonTests(unittest.TestCase):
             ),
         )
 
+    def test_stream_text_to_arrow_tools(self):
+        assert_json_result_equals(
+            _parse_json_with_defaults(
+                '[{"x": "café"}]'.encode("windows-1252"),
+                encoding="utf-8",
+                settings=Settings(STREAM_TEXT_TO_ARROW_TOOLS=True),
+            ),
+            ParseJsonResult(
+                pyarrow.table({"x": ["caf�"]}),
+                [
+                    I18nMessage(
+                        "text.repaired_encoding",
+                        dict(encoding="utf-8", byte="0xE9", position=11),
+                        "cjwparse",
+                    )
+                ],
+            ),
+        )
+
+    def test_decompress_with_and_without_streaming(self):
+        for settings in (DEFAULT_SETTINGS, Settings(STREAM_TEXT_TO_ARROW_TOOLS=True)):
+            with self.subTest(settings=settings):
+                assert_json_result_equals(
+                    _parse_json_with_defaults(
+                        gzip.compress('[{"x": "café"}]'.encode("utf-8")),
+                        settings=settings,
+                    ),
+                    ParseJsonResult(pyarrow.table({"x": ["café"]}), []),
+                )
+
     def test_json_empty(self):
         assert_json_result_equals(
             _parse_json_with_defaults("[]"), ParseJsonResult(pyarrow.table({}), [])
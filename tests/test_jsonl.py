@@ -0,0 +1,249 @@
+import unittest
+
+import pyarrow
+
+from cjwmodule.i18n import I18nMessage
+from cjwparse._util import tempfile_context
+from cjwparse.jsonl import (
+    _count_records,
+    _enforce_limits,
+    _parse_jsonl,
+    _split_lines,
+    _unify_tables,
+    _write_json_array,
+)
+from cjwparse.settings import Settings
+
+from .util import assert_arrow_table_equals
+
+
+class SplitLinesTests(unittest.TestCase):
+    def _split(self, b: bytes, n_chunks: int, *args):
+        with tempfile_context(suffix=".jsonl") as path:
+            path.write_bytes(b)
+            return [b[start:end] for start, end in _split_lines(path, n_chunks, *args)]
+
+    def test_split_after_newlines(self):
+        self.assertEqual(
+            self._split(b'{"A":1}\n{"A":2}\n{"A":3}\n{"A":4}\n', 2),
+            [b'{"A":1}\n{"A":2}\n', b'{"A":3}\n{"A":4}\n'],
+        )
+
+    def test_split_range_and_finish_last_line(self):
+        self.assertEqual(
+            self._split(b'{"A":1}\n{"A":2}\n{"A":3}\n{"A":4}\n', 2, 8, 20),
+            [b'{"A":2}\n', b'{"A":3}\n'],
+        )
+
+    def test_fewer_chunks_than_requested(self):
+        self.assertEqual(
+            self._split(b'{"A":"long value"}\n{"A":2}', 4),
+            [b'{"A":"long value"}\n', b'{"A":2}'],
+        )
+
+    def test_empty(self):
+        self.assertEqual(self._split(b"", 4), [])
+
+
+class WriteJsonArrayTests(unittest.TestCase):
+    def _write(self, b: bytes, start: int, end: int, max_n_records: int):
+        with tempfile_context(suffix=".jsonl") as path:
+            path.write_bytes(b)
+            with tempfile_context(suffix=".json") as json_path:
+                n_records, offset = _write_json_array(
+                    path, start, end, json_path, max_n_records
+                )
+                return json_path.read_bytes(), n_records, offset
+
+    def test_skip_blank_lines(self):
+        self.assertEqual(
+            self._write(b'{"A":1}\r\n\n  \n{"A":2}', 0, 20, 10),
+            (b'[{"A":1}\r,{"A":2}]', 2, 20),
+        )
+
+    def test_range(self):
+        self.assertEqual(
+            self._write(b'{"A":1}\n{"A":2}\n{"A":3}\n', 8, 16, 10),
+            (b'[{"A":2}]', 1, 16),
+        )
+
+    def test_stop_at_max_n_records(self):
+        self.assertEqual(
+            self._write(b'{"A":1}\n\n{"A":2}\n{"A":3}\n', 0, 25, 2),
+            (b'[{"A":1},{"A":2}]', 2, 17),
+        )
+
+
+class CountRecordsTests(unittest.TestCase):
+    def test_skip_blank_lines(self):
+        with tempfile_context(suffix=".jsonl") as path:
+            path.write_bytes(b'{"A":1}\n{"A":2}\n\n \n{"A":3}')
+            self.assertEqual(_count_records(path, 8), 2)
+
+
+class UnifyTablesTests(unittest.TestCase):
+    def test_order_columns_by_first_appearance(self):
+        result = _unify_tables(
+            [
+                pyarrow.table({"A": ["a"], "B": ["b"]}),
+                pyarrow.table({"C": ["c"], "A": ["d"]}),
+            ]
+        )
+        assert_arrow_table_equals(
+            result, {"A": ["a", "d"], "B": ["b", None], "C": [None, "c"]}
+        )
+
+    def test_unify_types(self):
+        result = _unify_tables(
+            [
+                pyarrow.table({"A": [1], "B": [1], "C": [1], "D": [None]}),
+                pyarrow.table({"A": [2], "B": [2.5], "C": ["x"], "D": ["y"]}),
+            ]
+        )
+        assert_arrow_table_equals(
+            result,
+            {
+                "A": pyarrow.array([1, 2], pyarrow.int64()),
+                "B": [1.0, 2.5],
+                "C": ["1", "x"],
+                "D": [None, "y"],
+            },
+        )
+
+
+class EnforceLimitsTests(unittest.TestCase):
+    def test_skip_columns_and_rows(self):
+        table, warnings = _enforce_limits(
+            pyarrow.table({"A": [1, 2, 3], "B": [4, 5, 6]}),
+            Settings(MAX_COLUMNS_PER_TABLE=1, MAX_ROWS_PER_TABLE=2),
+        )
+        assert_arrow_table_equals(table, {"A": [1, 2]})
+        self.assertEqual(
+            warnings,
+            [
+                I18nMessage(
+                    "warning.skipped_columns",
+                    {"n_columns": 1, "max_n_columns": 1},
+                    "cjwparse",
+                ),
+                I18nMessage(
+                    "warning.skipped_rows", {"n_rows": 1, "max_n_rows": 2}, "cjwparse"
+                ),
+            ],
+        )
+
+    def test_skip_rows_after_text_limit(self):
+        table, warnings = _enforce_limits(
+            pyarrow.table({"A": ["abc", None, "de", "f"], "B": ["x", "y", "z", "w"]}),
+            Settings(MAX_BYTES_TEXT_DATA=6),
+        )
+        assert_arrow_table_equals(table, {"A": ["abc", None], "B": ["x", "y"]})
+        self.assertEqual(
+            warnings,
+            [
+                I18nMessage(
+                    "jsonl.skipped_rows_text_limit",
+                    {"n_rows": 2, "max_n_bytes": 6},
+                    "cjwparse",
+                )
+            ],
+        )
+
+    def test_count_unread_rows(self):
+        table, warnings = _enforce_limits(
+            pyarrow.table({"A": [1, 2]}),
+            Settings(MAX_ROWS_PER_TABLE=2),
+            n_unread_rows=3,
+        )
+        assert_arrow_table_equals(table, {"A": [1, 2]})
+        self.assertEqual(
+            warnings,
+            [
+                I18nMessage(
+                    "warning.skipped_rows", {"n_rows": 3, "max_n_rows": 2}, "cjwparse"
+                )
+            ],
+        )
+
+    def test_count_unread_text_rows(self):
+        table, warnings = _enforce_limits(
+            pyarrow.table({"A": ["abc", "de", "f"]}),
+            Settings(MAX_BYTES_TEXT_DATA=5),
+            n_unread_text_rows=3,
+        )
+        assert_arrow_table_equals(table, {"A": ["abc", "de"]})
+        self.assertEqual(
+            warnings,
+            [
+                I18nMessage(
+                    "jsonl.skipped_rows_text_limit",
+                    {"n_rows": 4, "max_n_bytes": 5},
+                    "cjwparse",
+                )
+            ],
+        )
+
+
+class ParseJsonlTests(unittest.TestCase):
+    def _parse(self, b: bytes, settings: Settings):
+        with tempfile_context(suffix=".jsonl") as path:
+            path.write_bytes(b)
+            return _parse_jsonl(path, encoding="utf-8", settings=settings)
+
+    def test_parse_chunks_in_parallel(self):
+        result = self._parse(
+            b'{"A":"a"}\n{"A":"b","B":1}\n{"B":2}\n{"A":"d"}\n',
+            Settings(JSONL_N_PROCESSES=2, JSONL_MIN_CHUNK_BYTES=1),
+        )
+        assert_arrow_table_equals(
+            result.table, {"A": ["a", "b", None, "d"], "B": [None, 1, 2, None]}
+        )
+        self.assertEqual(result.warnings, [])
+
+    def test_row_limit_spans_chunks(self):
+        result = self._parse(
+            b'{"A":"a"}\n{"A":"b"}\n{"A":"c"}\n{"A":"d"}\n',
+            Settings(
+                JSONL_N_PROCESSES=2, JSONL_MIN_CHUNK_BYTES=1, MAX_ROWS_PER_TABLE=3
+            ),
+        )
+        assert_arrow_table_equals(result.table, {"A": ["a", "b", "c"]})
+        # One warning about the whole table -- not one per chunk
+        self.assertEqual(
+            result.warnings,
+            [
+                I18nMessage(
+                    "warning.skipped_rows", {"n_rows": 1, "max_n_rows": 3}, "cjwparse"
+                )
+            ],
+        )
+
+    def test_text_limit_spans_chunks(self):
+        result = self._parse(
+            b'{"A":"aaaa"}\n{"A":"bbbb"}\n{"A":"cccc"}\n{"A":"dddd"}\n',
+            Settings(
+                JSONL_N_PROCESSES=2, JSONL_MIN_CHUNK_BYTES=1, MAX_BYTES_TEXT_DATA=6
+            ),
+        )
+        assert_arrow_table_equals(result.table, {"A": ["aaaa"]})
+        self.assertEqual(
+            result.warnings,
+            [
+                I18nMessage(
+                    "jsonl.skipped_rows_text_limit",
+                    {"n_rows": 3, "max_n_bytes": 6},
+                    "cjwparse",
+                )
+            ],
+        )
+
+    def test_invalid_record_ignores_later_chunks(self):
+        # One json-to-arrow would stop at the invalid record. So do we: we
+        # ignore "c", though another process parsed it.
+        result = self._parse(
+            b'{"A":"a"}\n{"A":\n{"A":"c"}\n',
+            Settings(JSONL_N_PROCESSES=2, JSONL_MIN_CHUNK_BYTES=1),
+        )
+        assert_arrow_table_equals(result.table, {"A": ["a"]})
+        self.assertEqual(len(result.warnings), 1)
+        self.assertRegex(result.warnings[0].arguments["text"], "^JSON parse error")
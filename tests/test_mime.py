@@ -0,0 +1,68 @@
+import codecs
+import gzip
+import unittest
+import zipfile
+from pathlib import Path
+
+from cjwparse._util import tempfile_context
+from cjwparse.mime import MimeType
+
+TestDataPath = Path(__file__).parent / "files"
+
+
+class SniffTests(unittest.TestCase):
+    def _sniff(self, b: bytes):
+        with tempfile_context() as path:
+            path.write_bytes(b)
+            return MimeType.sniff(path)
+
+    def test_xls(self):
+        self.assertEqual(MimeType.sniff(TestDataPath / "example.xls"), MimeType.XLS)
+
+    def test_xlsx(self):
+        self.assertEqual(MimeType.sniff(TestDataPath / "test.xlsx"), MimeType.XLSX)
+
+    def test_xlsx_with_xl_files_after_head(self):
+        with tempfile_context() as path:
+            with zipfile.ZipFile(path, "w") as zf:
+                zf.writestr("[Content_Types].xml", b"x" * 10000)
+                zf.writestr("xl/workbook.xml", b"<workbook/>")
+            self.assertEqual(MimeType.sniff(path), MimeType.XLSX)
+
+    def test_zip(self):
+        with tempfile_context() as path:
+            with zipfile.ZipFile(path, "w") as zf:
+                zf.writestr("data.csv", b"A\n1")
+            self.assertEqual(MimeType.sniff(path), MimeType.ZIP)
+
+    def test_json(self):
+        self.assertEqual(self._sniff(b'  [\n  {"A": 1}]'), MimeType.JSON)
+        self.assertEqual(self._sniff(b'{"data": []}'), MimeType.JSON)
+
+    def test_jsonl(self):
+        self.assertEqual(self._sniff(b'{"A": 1}\n{"A": 2}\n'), MimeType.JSONL)
+        self.assertEqual(self._sniff(b'{"A": 1}\r\n\n{"A": 2}'), MimeType.JSONL)
+        # a pretty-printed object is JSON
+        self.assertEqual(self._sniff(b'{\n  "A": 1\n}\n'), MimeType.JSON)
+
+    def test_json_utf16_bom(self):
+        self.assertEqual(
+            self._sniff(codecs.BOM_UTF16_LE + '[{"A": 1}]'.encode("utf-16-le")),
+            MimeType.JSON,
+        )
+
+    def test_json_gzip(self):
+        self.assertEqual(self._sniff(gzip.compress(b'[{"A": 1}]')), MimeType.JSON)
+
+    def test_html(self):
+        self.assertEqual(
+            self._sniff(b"\n<!DOCTYPE html>\n<html><body>404</body></html>"),
+            MimeType.HTML,
+        )
+        self.assertEqual(self._sniff(b"<!-- error -->\n<HTML>"), MimeType.HTML)
+
+    def test_csv_is_unknown(self):
+        self.assertIsNone(self._sniff(b"A,B\n1,2"))
+        self.assertIsNone(self._sniff(b"[1],[2]\n3,4"))
+        self.assertIsNone(self._sniff(b"<b>,c\n1,2"))
+        self.assertIsNone(self._sniff(b""))
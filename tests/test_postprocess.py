@@ -0,0 +1,196 @@
+import threading
+import unittest
+
+import pyarrow as pa
+
+from cjwparse.postprocess import (
+    _dictionary_pylist_n_bytes_lower_bound,
+    _string_array_pylist_n_bytes,
+    _unify_dictionaries,
+    dictionary_encode_columns,
+    map_columns,
+)
+from cjwparse.settings import Settings
+
+from .util import assert_arrow_table_equals
+
+
+class MapColumnsTests(unittest.TestCase):
+    def test_preserve_column_order(self):
+        table = pa.table({str(i): [i] for i in range(50)})
+        result = map_columns(
+            table, lambda column: column.cast(pa.int64()), settings=Settings()
+        )
+        self.assertEqual(result.column_names, table.column_names)
+        self.assertEqual(
+            [column.to_pylist() for column in result.columns],
+            [[i] for i in range(50)],
+        )
+
+    def test_use_threads(self):
+        thread_names = set()
+
+        def fn(column):
+            thread_names.add(threading.current_thread().name)
+            return column
+
+        map_columns(
+            pa.table({str(i): [i] for i in range(20)}),
+            fn,
+            settings=Settings(POSTPROCESS_N_THREADS=4),
+        )
+        self.assertTrue(
+            all(name.startswith("cjwparse-postprocess") for name in thread_names)
+        )
+
+    def test_one_thread_means_calling_thread(self):
+        thread_names = set()
+
+        def fn(column):
+            thread_names.add(threading.current_thread().name)
+            return column
+
+        map_columns(
+            pa.table({"A": [1], "B": [2]}),
+            fn,
+            settings=Settings(POSTPROCESS_N_THREADS=1),
+        )
+        self.assertEqual(thread_names, {threading.current_thread().name})
+
+    def test_zero_columns(self):
+        result = map_columns(pa.table({}), lambda column: column, settings=Settings())
+        self.assertEqual(result.num_columns, 0)
+
+    def test_propagate_error(self):
+        def fn(column):
+            raise ValueError("boom")
+
+        with self.assertRaisesRegex(ValueError, "boom"):
+            map_columns(
+                pa.table({"A": [1], "B": [2]}),
+                fn,
+                settings=Settings(POSTPROCESS_N_THREADS=2),
+            )
+
+
+class DictionaryEncodeColumnsTests(unittest.TestCase):
+    def test_threaded_matches_serial(self):
+        table = pa.table(
+            {
+                **{"text%d" % i: ["a", "b", "a", "a"] * 10 for i in range(10)},
+                **{"unique%d" % i: [str(j) for j in range(40)] for i in range(10)},
+                "number": list(range(40)),
+            }
+        )
+        assert_arrow_table_equals(
+            dictionary_encode_columns(
+                table, settings=Settings(POSTPROCESS_N_THREADS=8)
+            ),
+            dictionary_encode_columns(
+                table, settings=Settings(POSTPROCESS_N_THREADS=1)
+            ),
+        )
+
+    def test_probe_matches_exact_decision(self):
+        def exact(column, settings):
+            # The decision we'd make after a full dictionary_encode()
+            encoded = column.combine_chunks().dictionary_encode()
+            new_cost = _string_array_pylist_n_bytes(encoded.dictionary)
+            old_cost = sum(_string_array_pylist_n_bytes(c) for c in column.chunks)
+            return (
+                new_cost <= settings.MAX_DICTIONARY_PYLIST_N_BYTES
+                and old_cost / new_cost
+                >= settings.MIN_DICTIONARY_COMPRESSION_RATIO_PYLIST_N_BYTES
+            )
+
+        columns = {
+            "unique": [str(i) for i in range(100000)],
+            "unique-tail": ["a"] * 70000 + [str(i) for i in range(30000)],
+            "low-cardinality": [str(i % 20) for i in range(100000)],
+            "near-limit": [("%05d" % (i % 1700)) for i in range(100000)],
+            "nulls": [None, "a", None, "b", "a"] * 1000,
+            "ratio-below-2": ["a", "b", "c", "a"],
+            "ratio-2": ["a", "b", "a", "b"],
+            "empty-strings": ["", "", "x", None] * 10,
+            "long-unique": ["x" * 1000 + str(i) for i in range(200)],
+        }
+        for settings in (
+            Settings(),
+            Settings(MAX_DICTIONARY_PYLIST_N_BYTES=1000),
+            Settings(MIN_DICTIONARY_COMPRESSION_RATIO_PYLIST_N_BYTES=1.0),
+        ):
+            for name, values in columns.items():
+                for column in (
+                    pa.chunked_array([values], pa.utf8()),
+                    pa.chunked_array([pa.array(["pad"] + values).slice(1)]),
+                    pa.chunked_array([values[:3], values[3:]], pa.utf8()),
+                ):
+                    with self.subTest(name=name, settings=settings):
+                        result = dictionary_encode_columns(
+                            pa.table({"A": column}), settings=settings
+                        )
+                        self.assertEqual(
+                            pa.types.is_dictionary(result["A"].type),
+                            exact(column, settings),
+                        )
+                        self.assertEqual(result["A"].to_pylist(), values)
+
+    def test_unified_dictionary(self):
+        column = pa.chunked_array([["a", "b", None], [], ["c", "a", "a", "c"]])
+        result = dictionary_encode_columns(
+            pa.table({"A": column}), settings=Settings()
+        )["A"]
+        self.assertEqual(result.to_pylist(), column.to_pylist())
+        self.assertEqual(result.chunk(0).dictionary.to_pylist(), ["a", "b", "c"])
+        for chunk in result.chunks:
+            self.assertEqual(chunk.type.index_type, pa.int32())
+            self.assertEqual(
+                chunk.dictionary.buffers()[2].address,
+                result.chunk(0).dictionary.buffers()[2].address,
+            )
+
+    def test_unify_per_chunk_dictionaries(self):
+        # Older pyarrow gives each chunk the dictionary it had built so far
+        encoded = pa.chunked_array(
+            [
+                pa.DictionaryArray.from_arrays([0, 1, 0], ["a", "b"]),
+                pa.DictionaryArray.from_arrays([2, None, 0], ["a", "b", "c"]),
+            ]
+        )
+        result = _unify_dictionaries(encoded)
+        self.assertEqual(result.to_pylist(), encoded.to_pylist())
+        for chunk in result.chunks:
+            self.assertEqual(chunk.dictionary.to_pylist(), ["a", "b", "c"])
+
+    def test_unify_independent_dictionaries(self):
+        encoded = pa.chunked_array(
+            [
+                pa.DictionaryArray.from_arrays([0, 1, None], ["b", "a"]),
+                pa.DictionaryArray.from_arrays([0, 1], ["c", "a"]),
+            ]
+        )
+        result = _unify_dictionaries(encoded)
+        self.assertEqual(result.to_pylist(), encoded.to_pylist())
+        for chunk in result.chunks:
+            self.assertEqual(chunk.dictionary.to_pylist(), ["b", "a", "c"])
+
+    def test_decision_counts_all_chunks(self):
+        # chunk 0 alone would compress 2:1; the whole column is all-unique
+        column = pa.chunked_array([["a", "a"], [str(i) for i in range(100)]])
+        result = dictionary_encode_columns(
+            pa.table({"A": column}), settings=Settings()
+        )["A"]
+        self.assertEqual(result.type, pa.utf8())
+
+    def test_probe_stops_early(self):
+        chunk = pa.array([str(i) for i in range(1000000)])
+        n_bytes = _dictionary_pylist_n_bytes_lower_bound(chunk, 100000)
+        self.assertGreater(n_bytes, 100000)
+        self.assertLess(n_bytes, 4096 * 70)  # we read one slice
+
+    def test_probe_lower_bound_ignores_null(self):
+        chunk = pa.array(["a", None, "b", None])
+        self.assertEqual(
+            _dictionary_pylist_n_bytes_lower_bound(chunk, 1000),
+            _string_array_pylist_n_bytes(chunk.dictionary_encode().dictionary),
+        )
@@ -0,0 +1,130 @@
+import contextlib
+import unittest
+from pathlib import Path
+from typing import ContextManager
+
+from cjwparse._pyarrow_csv import csv_to_arrow, csv_to_arrow_from_chunks
+from cjwparse._util import tempfile_context
+from cjwparse.settings import DEFAULT_SETTINGS, Settings
+
+from .util import assert_arrow_table_equals
+
+
+@contextlib.contextmanager
+def _temp_csv(data: bytes) -> ContextManager[Path]:
+    with tempfile_context(suffix=".csv") as path:
+        path.write_bytes(data)
+        yield path
+
+
+class CsvToArrowTests(unittest.TestCase):
+    def _csv_to_arrow(
+        self,
+        data: bytes,
+        *,
+        delimiter: str = ",",
+        settings: Settings = DEFAULT_SETTINGS,
+    ):
+        with _temp_csv(data) as path:
+            return csv_to_arrow(path, delimiter=delimiter, settings=settings)
+
+    def test_all_text(self):
+        result = self._csv_to_arrow(b"A,B\n1,2\n,x")
+        assert_arrow_table_equals(
+            result.table, {"f0": ["A", "1", ""], "f1": ["B", "2", "x"]}
+        )
+        self.assertEqual(result.stdout, "")
+
+    def test_empty_file(self):
+        result = self._csv_to_arrow(b"")
+        assert_arrow_table_equals(result.table, {})
+
+    def test_only_newlines(self):
+        result = self._csv_to_arrow(b"\n\r\n\n")
+        assert_arrow_table_equals(result.table, {})
+
+    def test_one_line_without_newline(self):
+        result = self._csv_to_arrow(b"A,B")
+        assert_arrow_table_equals(result.table, {"f0": ["A"], "f1": ["B"]})
+
+    def test_skip_empty_lines(self):
+        result = self._csv_to_arrow(b"\nA,B\r\n\r\na,b\r\n")
+        assert_arrow_table_equals(result.table, {"f0": ["A", "a"], "f1": ["B", "b"]})
+
+    def test_quoted_values(self):
+        result = self._csv_to_arrow(b'"a,b","c\n""d"""\n"",e')
+        assert_arrow_table_equals(
+            result.table, {"f0": ["a,b", ""], "f1": ['c\n"d"', "e"]}
+        )
+        self.assertEqual(result.stdout, "")
+
+    def test_delimiter(self):
+        result = self._csv_to_arrow(b"a\tb,c", delimiter="\t")
+        assert_arrow_table_equals(result.table, {"f0": ["a"], "f1": ["b,c"]})
+
+    def test_ragged_rows_means_none(self):
+        self.assertIsNone(self._csv_to_arrow(b"A,B\na\nb,c"))
+
+    def test_misplaced_quote_means_none(self):
+        self.assertIsNone(self._csv_to_arrow(b'A,B\n"x" y,z'))
+        self.assertIsNone(self._csv_to_arrow(b'A,B\nx y,z"a"'))
+
+    def test_unterminated_quote_means_none(self):
+        self.assertIsNone(self._csv_to_arrow(b'A,B\nx,"y\nz'))
+
+    def test_skip_rows(self):
+        result = self._csv_to_arrow(
+            b"A\na\nb\nc\nd", settings=Settings(MAX_ROWS_PER_TABLE=3)
+        )
+        assert_arrow_table_equals(result.table, {"f0": ["A", "a", "b"]})
+        self.assertEqual(result.stdout, "skipped 2 rows (after row limit of 3)\n")
+
+    def test_skip_columns(self):
+        result = self._csv_to_arrow(
+            b"A,B,C,D\na,b,c,d", settings=Settings(MAX_COLUMNS_PER_TABLE=2)
+        )
+        assert_arrow_table_equals(result.table, {"f0": ["A", "a"], "f1": ["B", "b"]})
+        self.assertEqual(result.stdout, "skipped 2 columns (after column limit of 2)\n")
+
+    def test_truncate_values_without_splitting_characters(self):
+        result = self._csv_to_arrow(
+            "AAAAx,A\nAA¢,AAA¢\nA\U00010348,\U00010348".encode("utf-8"),
+            settings=Settings(MAX_BYTES_PER_VALUE=4),
+        )
+        assert_arrow_table_equals(
+            result.table,
+            {"f0": ["AAAA", "AA¢", "A"], "f1": ["A", "AAA", "\U00010348"]},
+        )
+        self.assertEqual(
+            result.stdout,
+            "truncated 3 values (value byte limit is 4; see row 0 column 0)\n",
+        )
+
+    def test_truncate_values_report_first_row_then_first_column(self):
+        result = self._csv_to_arrow(
+            b"a,b,c\nd,eeee,ffff\ngggg,h,i", settings=Settings(MAX_BYTES_PER_VALUE=2)
+        )
+        self.assertEqual(
+            result.stdout,
+            "truncated 3 values (value byte limit is 2; see row 1 column 1)\n",
+        )
+
+
+class CsvToArrowFromChunksTests(CsvToArrowTests):
+    def _csv_to_arrow(
+        self,
+        data: bytes,
+        *,
+        delimiter: str = ",",
+        settings: Settings = DEFAULT_SETTINGS,
+    ):
+        # Tiny chunks, so quotes and records straddle chunk boundaries
+        chunks = (data[i : i + 2] for i in range(0, len(data), 2))
+        return csv_to_arrow_from_chunks(chunks, delimiter=delimiter, settings=settings)
+
+    def test_misplaced_quote_after_first_chunk_means_none(self):
+        self.assertIsNone(
+            csv_to_arrow_from_chunks(
+                iter([b"A,B\n", b'x"y",z']), delimiter=",", settings=DEFAULT_SETTINGS
+            )
+        )
@@ -0,0 +1,108 @@
+import unittest
+
+import pyarrow as pa
+
+from cjwparse._util import tempfile_context
+from cjwparse.api import parse_file
+from cjwparse.report import ColumnReport, ParseReport, StageReport, ToolUsage
+from cjwparse.settings import Settings
+
+
+class ParseReportTests(unittest.TestCase):
+    def test_add_sums_by_stage(self):
+        report = ParseReport()
+        report.add("a", 1.0, 0.5, n_bytes_in=10)
+        report.add("b", 2.0, 1.0)
+        report.add("a", 1.0, 0.5, n_bytes_in=5, n_bytes_out=3)
+        self.assertEqual(
+            report.stages,
+            {"a": StageReport(2.0, 1.0, 15, 3), "b": StageReport(2.0, 1.0)},
+        )
+        self.assertEqual(list(report.stages), ["a", "b"])
+
+    def test_add_tool_usage_sums_times_and_maxes_rss(self):
+        report = ParseReport()
+        report.add_tool_usage("a", ToolUsage(100, 1.0, 0.5, 1, 2))
+        report.add_tool_usage("a", ToolUsage(50, 1.0, 0.5, 1, 2))
+        self.assertEqual(report.tools, {"a": ToolUsage(100, 2.0, 1.0, 2, 4)})
+
+    def test_stage_records_bytes_set_within(self):
+        report = ParseReport()
+        with report.stage("a", n_bytes_in=10) as stage:
+            stage.n_bytes_out = 4
+        self.assertEqual(report.stages["a"].n_bytes_in, 10)
+        self.assertEqual(report.stages["a"].n_bytes_out, 4)
+        self.assertGreaterEqual(report.stages["a"].wall_time, 0.0)
+
+    def test_stage_records_on_error(self):
+        report = ParseReport()
+        with self.assertRaises(ValueError):
+            with report.stage("a"):
+                raise ValueError
+        self.assertIn("a", report.stages)
+
+    def test_timed_chunks(self):
+        report = ParseReport()
+        chunks = report.timed_chunks("a", iter([b"ab", b"cde"]))
+        self.assertEqual(list(chunks), [b"ab", b"cde"])
+        self.assertEqual(report.stages["a"].n_bytes_out, 5)
+
+    def test_record_table(self):
+        report = ParseReport()
+        report.record_table(
+            pa.table(
+                {
+                    "A": pa.array([1, 2], pa.int8()),
+                    "B": pa.array(["x", "x"]).dictionary_encode(),
+                }
+            )
+        )
+        self.assertEqual(report.n_rows, 2)
+        self.assertEqual(report.n_columns, 2)
+        self.assertEqual(report.columns[0], ColumnReport("A", "int8", False))
+        self.assertEqual(report.columns[1].name, "B")
+        self.assertTrue(report.columns[1].is_dictionary_encoded)
+
+
+class ParseFileReportTests(unittest.TestCase):
+    def test_csv_stages_and_columns(self):
+        report = ParseReport()
+        with tempfile_context(suffix=".txt") as path, tempfile_context() as output:
+            path.write_bytes("A;B\n1;é\n2;é\n".encode("windows-1252"))
+            parse_file(
+                path,
+                output_path=output,
+                settings=Settings(CSV_ENGINE="pyarrow"),
+                encoding="windows-1252",
+                report=report,
+            )
+            output_size = output.stat().st_size
+        self.assertEqual(
+            list(report.stages),
+            [
+                "validate_utf8",
+                "transcode",
+                "detect_delimiter",
+                "pyarrow.csv",
+                "name_columns",
+                "autocast",
+                "dictionary_encode",
+                "write",
+            ],
+        )
+        self.assertEqual(report.stages["transcode"].n_bytes_in, 12)
+        self.assertEqual(report.stages["transcode"].n_bytes_out, 14)
+        self.assertEqual(report.stages["write"].n_bytes_out, output_size)
+        self.assertEqual((report.n_rows, report.n_columns), (2, 2))
+        self.assertEqual(report.tools, {})  # we parsed in-process
+        self.assertGreater(report.max_rss, 0)
+        self.assertEqual(report.columns[0], ColumnReport("A", "int8", False))
+        self.assertTrue(report.columns[1].is_dictionary_encoded)
+
+    def test_csv_to_arrow_usage(self):
+        report = ParseReport()
+        with tempfile_context(suffix=".csv") as path, tempfile_context() as output:
+            path.write_bytes(b"A,B\na,b\n")
+            parse_file(path, output_path=output, report=report)
+        self.assertEqual(list(report.tools), ["csv-to-arrow"])
+        self.assertGreater(report.tools["csv-to-arrow"].max_rss, 0)
@@ -0,0 +1,96 @@
+import codecs
+import json
+import unittest
+import zipfile
+
+from cjwparse._util import tempfile_context
+from cjwparse.api import parse_file
+from cjwparse.settings import Settings
+from cjwparse.testing.data import (
+    DataSpec,
+    generate_rows,
+    spec_for_size,
+    write_csv,
+    write_json,
+    write_xlsx,
+)
+
+
+class GenerateRowsTests(unittest.TestCase):
+    def test_deterministic(self):
+        spec = DataSpec(n_rows=20, n_columns=4)
+        self.assertEqual(generate_rows(spec), generate_rows(spec))
+        self.assertNotEqual(generate_rows(spec), generate_rows(spec._replace(seed=1)))
+
+    def test_shape_and_header(self):
+        rows = generate_rows(DataSpec(n_rows=3, n_columns=2))
+        self.assertEqual(rows[0], ["Column 0", "Column 1"])
+        self.assertEqual([len(row) for row in rows], [2, 2, 2, 2])
+
+    def test_cardinality(self):
+        rows = generate_rows(
+            DataSpec(n_rows=1000, n_columns=1, cardinality=5, numeric_ratio=0.0)
+        )
+        self.assertLessEqual(len(set(row[0] for row in rows[1:])), 5)
+
+    def test_numeric_ratio(self):
+        rows = generate_rows(DataSpec(n_rows=10, n_columns=4, numeric_ratio=0.5))
+        numeric = [all(_is_number(row[i]) for row in rows[1:]) for i in range(4)]
+        self.assertEqual(numeric.count(True), 2)
+
+    def test_spec_for_size(self):
+        spec = spec_for_size(DataSpec(n_columns=5), 100000)
+        with tempfile_context() as path:
+            write_csv(path, spec)
+            self.assertAlmostEqual(path.stat().st_size / 100000, 1.0, delta=0.1)
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+class WriteTests(unittest.TestCase):
+    def test_csv_utf16_has_bom(self):
+        with tempfile_context() as path:
+            write_csv(path, DataSpec(n_rows=2), encoding="utf-16")
+            data = path.read_bytes()
+        self.assertTrue(data.startswith(codecs.BOM_UTF16_LE))
+        self.assertTrue(data[2:].decode("utf-16-le").startswith("Column 0,"))
+
+    def test_csv_parses(self):
+        spec = DataSpec(n_rows=50, n_columns=4)
+        with tempfile_context(suffix=".tsv") as path, tempfile_context() as output:
+            write_csv(path, spec, delimiter="\t", encoding="windows-1252")
+            warnings = parse_file(
+                path,
+                output_path=output,
+                encoding="windows-1252",
+                settings=Settings(CSV_ENGINE="pyarrow"),
+            )
+        self.assertEqual(warnings, [])
+
+    def test_json_numbers(self):
+        with tempfile_context() as path:
+            write_json(path, DataSpec(n_rows=2, n_columns=2, numeric_ratio=0.5))
+            records = json.loads(path.read_text(encoding="utf-8"))
+        self.assertEqual(len(records), 2)
+        self.assertIsInstance(records[0]["Column 0"], str)
+        self.assertIsInstance(records[0]["Column 1"], float)
+
+    def test_json_lines(self):
+        with tempfile_context() as path:
+            write_json(path, DataSpec(n_rows=2, n_columns=2), lines=True)
+            lines = path.read_text(encoding="utf-8").splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(list(json.loads(lines[0])), ["Column 0", "Column 1"])
+
+    def test_xlsx_is_a_workbook(self):
+        with tempfile_context() as path:
+            write_xlsx(path, DataSpec(n_rows=2, n_columns=2))
+            with zipfile.ZipFile(path) as zf:
+                sheet = zf.read("xl/worksheets/sheet1.xml").decode("utf-8")
+        self.assertEqual(sheet.count("<row>"), 3)
@@ -1,7 +1,18 @@
+import codecs
+import gzip
 import io
 import unittest
+import zipfile
+from unittest.mock import patch
 
-from cjwparse.text import detect_encoding
+from cjwmodule.i18n import I18nMessage
+from cjwparse._util import STDIN_PATH, tempfile_context
+from cjwparse.settings import DEFAULT_SETTINGS, Settings
+from cjwparse.text import (
+    detect_encoding,
+    transcode_to_utf8_chunks_and_warn,
+    utf8_input_context,
+)
 
 
 class DetectEncodingTest(unittest.TestCase):
@@ -44,3 +55,369 @@ class DetectEncodingTest(unittest.TestCase):
             # https://github.com/freedesktop/uchardet/commit/e5234d6b6181bb3bd022c2a67064a290011d9c14
             "UTF-16",
         )
+
+    def test_utf32_bom(self):
+        self.assertEqual(
+            detect_encoding(io.BytesIO("café".encode("utf-32"))),
+            "UTF-32",
+        )
+
+    def test_utf8_bom_short_circuits(self):
+        # The rest is invalid UTF-8; the byte-order marker wins anyway
+        self.assertEqual(
+            detect_encoding(io.BytesIO(codecs.BOM_UTF8 + b"caf\xe9")), "UTF-8"
+        )
+
+    def test_seek_to_start(self):
+        bytesio = io.BytesIO("mon café latté coûte 5€".encode("windows-1252"))
+        detect_encoding(bytesio)
+        self.assertEqual(bytesio.tell(), 0)
+
+    def test_sample_large_file(self):
+        class CountingBytesIO(io.BytesIO):
+            n_bytes_read = 0
+
+            def read(self, size=-1):
+                data = super().read(size)
+                self.n_bytes_read += len(data)
+                return data
+
+        text = "mon café latté coûte 5€, et la crème brûlée à côté\n" * 40
+        bytesio = CountingBytesIO(b"a,b\n" * 100000 + text.encode("windows-1252"))
+        self.assertEqual(
+            detect_encoding(
+                bytesio, settings=Settings(ENCODING_DETECTION_MAX_BYTES=6000)
+            ),
+            "WINDOWS-1252",  # we sampled the tail
+        )
+        self.assertLessEqual(bytesio.n_bytes_read, 6004)
+
+    def test_sample_utf8_split_mid_character(self):
+        self.assertEqual(
+            detect_encoding(
+                io.BytesIO("éàü€".encode("utf-8") * 5000),
+                settings=Settings(ENCODING_DETECTION_MAX_BYTES=301),
+            ),
+            "UTF-8",
+        )
+
+
+class TranscodeToUtf8ChunksAndWarnTests(unittest.TestCase):
+    def _transcode(self, b: bytes, encoding, warnings=None):
+        if warnings is None:
+            warnings = []
+        chunks = transcode_to_utf8_chunks_and_warn(
+            io.BytesIO(b), encoding, settings=DEFAULT_SETTINGS, warnings=warnings
+        )
+        return b"".join(chunks), warnings
+
+    def test_transcode(self):
+        self.assertEqual(
+            self._transcode("café".encode("windows-1252"), "windows-1252"),
+            ("café".encode("utf-8"), []),
+        )
+
+    def test_detect_encoding(self):
+        self.assertEqual(
+            self._transcode(b"\xff\xfe" + "café".encode("utf-16le"), None),
+            ("café".encode("utf-8"), []),
+        )
+
+    def test_warn_and_replace(self):
+        self.assertEqual(
+            self._transcode("A\nfôo\ncafé".encode("windows-1252"), "utf-8"),
+            (
+                "A\nf�o\ncaf�".encode("utf-8"),
+                [
+                    I18nMessage(
+                        "text.repaired_encoding",
+                        dict(encoding="utf-8", byte="0xF4", position=3),
+                        "cjwparse",
+                    )
+                ],
+            ),
+        )
+
+    def test_append_to_existing_warnings(self):
+        previous = I18nMessage("x", {}, None)
+        _, warnings = self._transcode(b"caf\xe9", "utf-8", [previous])
+        self.assertEqual(len(warnings), 2)
+        self.assertEqual(warnings[0], previous)
+
+    def test_raise_lazily(self):
+        chunks = transcode_to_utf8_chunks_and_warn(
+            io.BytesIO(b"x"), "not-an-encoding", settings=DEFAULT_SETTINGS, warnings=[]
+        )
+        with self.assertRaises(LookupError):
+            next(chunks)
+
+
+class TranscodeInParallelTests(unittest.TestCase):
+    def _assert_same_as_serial(self, b: bytes, encoding: str):
+        def transcode(settings):
+            warnings = []
+            chunks = transcode_to_utf8_chunks_and_warn(
+                io.BytesIO(b), encoding, settings=settings, warnings=warnings
+            )
+            return b"".join(chunks), warnings
+
+        # Small buffers, so we split into many pieces
+        with patch("cjwparse.text.BUFFER_SIZE", 16):
+            result = transcode(Settings(TRANSCODE_N_PROCESSES=2))
+        self.assertEqual(result, transcode(DEFAULT_SETTINGS))
+        return result
+
+    def test_multibyte(self):
+        text = "".join("日本語のテキスト,%d\n" % i for i in range(50))
+        result = self._assert_same_as_serial(text.encode("shift_jis"), "shift_jis")
+        self.assertEqual(result, (text.encode("utf-8"), []))
+
+    def test_single_byte_ascii_and_not(self):
+        text = "ascii only,1\n" * 10 + "café,2\n" * 10
+        result = self._assert_same_as_serial(
+            text.encode("windows-1252"), "windows-1252"
+        )
+        self.assertEqual(result, (text.encode("utf-8"), []))
+
+    def test_warn_and_replace(self):
+        b = "café,1\n".encode("windows-1252") * 20 + b"x\x81y\n" + b"caf\xe9\n" * 20
+        _, warnings = self._assert_same_as_serial(b, "windows-1252")
+        self.assertEqual(
+            warnings,
+            [
+                I18nMessage(
+                    "text.repaired_encoding",
+                    dict(encoding="charmap", byte="0x81", position=141),
+                    "cjwparse",
+                )
+            ],
+        )
+
+    def test_warn_on_truncated_final_character(self):
+        b = "日本語\n".encode("shift_jis") * 20 + "日".encode("shift_jis")[:1]
+        _, warnings = self._assert_same_as_serial(b, "shift_jis")
+        self.assertEqual(len(warnings), 1)
+
+    def test_giant_line(self):
+        text = "日本語" * 100 + "\n" + "テキスト" * 10
+        with patch("cjwparse.text._MAX_TRANSCODE_PIECE_SIZE", 64):
+            result = self._assert_same_as_serial(text.encode("gbk"), "gbk")
+        self.assertEqual(result, (text.encode("utf-8"), []))
+
+    def test_stateful_encoding_is_serial(self):
+        text = "日本語\n" * 20
+        result = self._assert_same_as_serial(text.encode("iso2022_jp"), "iso2022_jp")
+        self.assertEqual(result, (text.encode("utf-8"), []))
+
+
+class Utf8InputContextTests(unittest.TestCase):
+    def _read(self, b: bytes, encoding, *, settings=DEFAULT_SETTINGS, max_n_bytes=None):
+        """
+        Return (used_original_path, utf8_bytes, warnings).
+        """
+        warnings = []
+        with tempfile_context(suffix=".txt") as path:
+            path.write_bytes(b)
+            with utf8_input_context(
+                path,
+                encoding,
+                settings=settings,
+                warnings=warnings,
+                n_head_bytes=3,
+                max_n_bytes=max_n_bytes,
+            ) as utf8_input:
+                self.assertEqual(
+                    utf8_input.path == STDIN_PATH, settings.STREAM_TEXT_TO_ARROW_TOOLS
+                )
+                if utf8_input.stdin_chunks is None:
+                    with open(utf8_input.path, "rb") as f:
+                        utf8 = f.read()
+                else:
+                    utf8 = b"".join(utf8_input.stdin_chunks)
+                self.assertTrue(utf8.startswith(utf8_input.head))
+                return utf8_input.path == path.as_posix(), utf8, warnings
+
+    def test_valid_utf8_is_zero_copy(self):
+        self.assertEqual(
+            self._read("café".encode("utf-8"), "utf-8"),
+            (True, "café".encode("utf-8"), []),
+        )
+
+    def test_detect_valid_utf8_is_zero_copy(self):
+        self.assertEqual(
+            self._read("café".encode("utf-8"), None),
+            (True, "café".encode("utf-8"), []),
+        )
+
+    def test_empty_file_is_zero_copy(self):
+        self.assertEqual(self._read(b"", None), (True, b"", []))
+
+    def test_skip_utf8_bom(self):
+        self.assertEqual(
+            self._read(b"\xef\xbb\xbfcaf\xc3\xa9", None),
+            (False, "café".encode("utf-8"), []),
+        )
+
+    def test_stream_utf8_after_bom(self):
+        self.assertEqual(
+            self._read(
+                b"\xef\xbb\xbfcaf\xc3\xa9",
+                "utf-8",
+                settings=Settings(STREAM_TEXT_TO_ARROW_TOOLS=True),
+            ),
+            (False, "café".encode("utf-8"), []),
+        )
+
+    def test_transcode_other_encoding(self):
+        # ASCII is valid UTF-8, but the caller asked for windows-1252
+        self.assertEqual(self._read(b"cafe", "windows-1252"), (False, b"cafe", []))
+
+    def test_transcode_invalid_utf8(self):
+        self.assertEqual(
+            self._read(b"caf\xe9", "utf-8"),
+            (
+                False,
+                "caf�".encode("utf-8"),
+                [
+                    I18nMessage(
+                        "text.repaired_encoding",
+                        dict(encoding="utf-8", byte="0xE9", position=3),
+                        "cjwparse",
+                    )
+                ],
+            ),
+        )
+
+    def test_detect_encoding_when_nul_bytes(self):
+        # UTF-16 without a byte-order marker is valid UTF-8. Don't assume UTF-8.
+        used_original_path, _, _ = self._read("café".encode("utf-16le"), None)
+        self.assertFalse(used_original_path)
+
+    def test_stream_transcoded(self):
+        self.assertEqual(
+            self._read(
+                "café".encode("windows-1252"),
+                "windows-1252",
+                settings=Settings(STREAM_TEXT_TO_ARROW_TOOLS=True),
+            ),
+            (False, "café".encode("utf-8"), []),
+        )
+
+    def test_max_n_bytes_not_reached_is_zero_copy(self):
+        self.assertEqual(
+            self._read(b"A,B\na,b", None, max_n_bytes=7), (True, b"A,B\na,b", [])
+        )
+
+    def test_max_n_bytes_truncates(self):
+        self.assertEqual(
+            self._read(b"A,B\na,b\nc,d", None, max_n_bytes=7),
+            (False, b"A,B\na,b", []),
+        )
+
+    def test_max_n_bytes_cuts_before_split_character(self):
+        self.assertEqual(
+            self._read(
+                "A,B\na,b\nc,d\né,f\ng,h".encode("utf-8"), "utf-8", max_n_bytes=13
+            ),
+            (False, b"A,B\na,b\nc,d\n", []),
+        )
+
+    def test_max_n_bytes_cuts_before_split_4_byte_character(self):
+        self.assertEqual(
+            self._read("A\n\U00010348x".encode("utf-8"), None, max_n_bytes=5),
+            (False, b"A\n", []),
+        )
+
+    def test_max_n_bytes_only_validates_before_cut(self):
+        self.assertEqual(
+            self._read(b"A,B\na,b\n\xff", None, max_n_bytes=7),
+            (False, b"A,B\na,b", []),
+        )
+
+    def test_max_n_bytes_transcodes_invalid_utf8(self):
+        self.assertEqual(
+            self._read(b"caf\xe9\nx,y", "utf-8", max_n_bytes=6),
+            (
+                False,
+                "caf�\nx".encode("utf-8"),
+                [
+                    I18nMessage(
+                        "text.repaired_encoding",
+                        dict(encoding="utf-8", byte="0xE9", position=3),
+                        "cjwparse",
+                    )
+                ],
+            ),
+        )
+
+    def test_max_n_bytes_stream_truncated(self):
+        self.assertEqual(
+            self._read(
+                b"A,B\na,b\nc,d",
+                None,
+                max_n_bytes=7,
+                settings=Settings(STREAM_TEXT_TO_ARROW_TOOLS=True),
+            ),
+            (False, b"A,B\na,b", []),
+        )
+
+    def test_max_n_bytes_skips_utf8_bom(self):
+        self.assertEqual(
+            self._read(b"\xef\xbb\xbfA,B\na,b", None, max_n_bytes=7),
+            (False, b"A,B\n", []),
+        )
+
+    def _read_gzip(self, b: bytes, *, settings=DEFAULT_SETTINGS, **kwargs):
+        with tempfile_context(suffix=".txt.gz") as path:
+            path.write_bytes(gzip.compress(b))
+            with utf8_input_context(
+                path,
+                None,
+                settings=settings,
+                warnings=[],
+                n_head_bytes=3,
+                **kwargs,
+            ) as utf8_input:
+                if utf8_input.stdin_chunks is None:
+                    with open(utf8_input.path, "rb") as f:
+                        utf8 = f.read()
+                else:
+                    utf8 = b"".join(utf8_input.stdin_chunks)
+                return utf8_input.path, utf8
+
+    def test_decompressed_text_is_a_file(self):
+        path, utf8 = self._read_gzip(b"A,B\na,b")
+        self.assertNotEqual(path, STDIN_PATH)
+        self.assertEqual(utf8, b"A,B\na,b")
+
+    def test_stream_decompressed_text(self):
+        self.assertEqual(
+            self._read_gzip(
+                b"A,B\na,b", settings=Settings(STREAM_TEXT_TO_ARROW_TOOLS=True)
+            ),
+            (STDIN_PATH, b"A,B\na,b"),
+        )
+
+    def test_seekable_decompressed_text_is_a_file(self):
+        path, utf8 = self._read_gzip(
+            b"A,B\na,b",
+            settings=Settings(STREAM_TEXT_TO_ARROW_TOOLS=True),
+            seekable=True,
+        )
+        self.assertNotEqual(path, STDIN_PATH)
+        self.assertEqual(utf8, b"A,B\na,b")
+
+    def test_stream_zip_member(self):
+        with tempfile_context(suffix=".zip") as path:
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr("a.csv", b"A,B\na,b")
+            with utf8_input_context(
+                path,
+                None,
+                settings=Settings(STREAM_TEXT_TO_ARROW_TOOLS=True),
+                warnings=[],
+                n_head_bytes=3,
+                zip_member="a.csv",
+            ) as utf8_input:
+                self.assertEqual(utf8_input.path, STDIN_PATH)
+                self.assertEqual(b"".join(utf8_input.stdin_chunks), b"A,B\na,b")
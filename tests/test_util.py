@@ -0,0 +1,144 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from cjwparse._util import (
+    STDIN_PATH,
+    ToolCall,
+    run_tool,
+    run_tool_async,
+    run_tool_steps,
+    run_tool_steps_async,
+    run_tools,
+    run_with_stdin_chunks,
+)
+
+
+class RunWithStdinChunksTests(unittest.TestCase):
+    def test_stream_chunks_to_stdin(self):
+        chunks = [b"x" * 100000 for _ in range(100)]  # bigger than pipe buffer
+        child = run_with_stdin_chunks(["/bin/cat", STDIN_PATH], iter(chunks))
+        self.assertEqual(child.stdout, b"".join(chunks))
+        self.assertEqual(child.returncode, 0)
+
+    def test_capture_stderr(self):
+        child = run_with_stdin_chunks(["/bin/sh", "-c", "echo err >&2"], iter([]))
+        self.assertEqual(child.stderr, b"err\n")
+
+    def test_raise_called_process_error(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            run_with_stdin_chunks(["/bin/sh", "-c", "exit 3"], iter([b"x"]))
+        self.assertEqual(cm.exception.returncode, 3)
+
+    def test_child_stops_reading_early(self):
+        chunks = (b"x" * 100000 for _ in range(1000))
+        child = run_with_stdin_chunks(["/usr/bin/head", "-c", "3"], chunks)
+        self.assertEqual(child.stdout, b"xxx")
+
+    def test_reraise_chunks_error(self):
+        def chunks():
+            yield b"x"
+            raise UnicodeError("bad")
+
+        with self.assertRaisesRegex(UnicodeError, "bad"):
+            run_with_stdin_chunks(["/bin/cat", STDIN_PATH], chunks())
+
+
+def _echo_steps(text: str):
+    child = yield ToolCall(["/bin/echo", text])
+    try:
+        yield ToolCall(["/bin/sh", "-c", "exit 3"])
+    except subprocess.CalledProcessError as err:
+        return child.stdout, err.returncode
+
+
+def _parallel_steps():
+    children = yield [ToolCall(["/bin/echo", text]) for text in ("a", "b")]
+    try:
+        yield [ToolCall(["/bin/sleep", "0.2"]), ToolCall(["/bin/sh", "-c", "exit 3"])]
+    except subprocess.CalledProcessError as err:
+        return [child.stdout for child in children], err.returncode
+
+
+class RunToolTests(unittest.TestCase):
+    def test_run_tool_steps(self):
+        self.assertEqual(run_tool_steps(_echo_steps("hi")), (b"hi\n", 3))
+
+    def test_run_tool_steps_parallel(self):
+        self.assertEqual(run_tool_steps(_parallel_steps()), ([b"a\n", b"b\n"], 3))
+
+    def test_run_tool_steps_async_parallel(self):
+        self.assertEqual(
+            asyncio.run(run_tool_steps_async(_parallel_steps())),
+            ([b"a\n", b"b\n"], 3),
+        )
+
+    def test_run_tools_at_the_same_time(self):
+        start = time.monotonic()
+        run_tools([ToolCall(["/bin/sleep", "0.5"]) for _ in range(4)])
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_run_tool_steps_async(self):
+        self.assertEqual(
+            asyncio.run(run_tool_steps_async(_echo_steps("hi"))), (b"hi\n", 3)
+        )
+
+    def test_run_tool_measure_usage(self):
+        call = ToolCall([sys.executable, "-c", "x = b'x' * 100_000_000; print(1)"])
+        child = run_tool(call)
+        self.assertEqual(child.stdout, b"1\n")
+        self.assertGreater(child.usage.max_rss, 100_000_000)
+        self.assertGreater(child.usage.user_time + child.usage.system_time, 0)
+
+    def test_run_tool_async_measure_usage(self):
+        call = ToolCall([sys.executable, "-c", "x = b'x' * 100_000_000"])
+        child = asyncio.run(run_tool_async(call))
+        self.assertGreater(child.usage.max_rss, 100_000_000)
+
+    @unittest.skipUnless(hasattr(os, "pidfd_open"), "needs pidfds")
+    def test_run_tool_async_without_threads(self):
+        with patch.object(
+            threading.Thread, "start", side_effect=AssertionError("started a thread")
+        ):
+            child = asyncio.run(run_tool_async(ToolCall(["/bin/echo", "hi"])))
+        self.assertEqual(child.stdout, b"hi\n")
+        self.assertGreater(child.usage.max_rss, 0)
+
+    def test_run_tool_async_stream_chunks_to_stdin(self):
+        chunks = [b"x" * 100000 for _ in range(100)]  # bigger than pipe buffer
+        child = asyncio.run(
+            run_tool_async(ToolCall(["/bin/cat", STDIN_PATH], iter(chunks)))
+        )
+        self.assertEqual(child.stdout, b"".join(chunks))
+
+    def test_run_tool_async_child_stops_reading_early(self):
+        chunks = (b"x" * 100000 for _ in range(1000))
+        child = asyncio.run(
+            run_tool_async(ToolCall(["/usr/bin/head", "-c", "3"], chunks))
+        )
+        self.assertEqual(child.stdout, b"xxx")
+
+    def test_run_tool_async_reraise_chunks_error(self):
+        def chunks():
+            yield b"x"
+            raise UnicodeError("bad")
+
+        with self.assertRaisesRegex(UnicodeError, "bad"):
+            asyncio.run(run_tool_async(ToolCall(["/bin/cat", STDIN_PATH], chunks())))
+
+    def test_run_tool_async_cancel_kills_program(self):
+        async def run():
+            task = asyncio.ensure_future(run_tool_async(ToolCall(["/bin/sleep", "10"])))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.monotonic()
+        asyncio.run(run())
+        self.assertLess(time.monotonic() - start, 5)